@@ -0,0 +1,79 @@
+#!/usr/bin/python
+# Filename: chunked_grids.py
+
+""" Measures drawing square and hex grids of 10k to 1M cells with
+    block_size, from a database csv, and writing them to a stream: the
+    peak memory allocated while drawing and writing (tracemalloc, after the
+    Chorogrid is made) should stay about the same as the grid grows. Each
+    grid is drawn in its own process.
+
+    python -m benchmarks.chunked_grids [block_size] [--full]   (from the
+    top directory of the repository, or with chorogrid installed); --full
+    also draws without block_size, up to 100k cells
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import chorogrid
+
+SIZES = [10000, 100000, 1000000]
+
+def write_database(n, csv_path):
+    """A square layout of n cells, also used as a hex layout"""
+    side = int(np.ceil(np.sqrt(n)))
+    cells = np.arange(n)
+    pd.DataFrame({'abbrev': cells.astype(str), 'square_x': cells % side,
+                  'square_y': cells // side, 'hex_x': cells % side,
+                  'hex_y': cells // side}).to_csv(csv_path, index=False)
+
+def measure(csv_path, method, block_size):
+    """Peak MB allocated and seconds taken to draw and write one grid"""
+    n = sum(1 for line in open(csv_path)) - 1
+    colors = chorogrid.Palettecolors(['#d73027', '#fee090', '#4575b4'],
+                                     np.arange(n) % 3)
+    cg = chorogrid.Chorogrid(csv_path, None, colors)
+    tracemalloc.start()
+    start = time.perf_counter()
+    getattr(cg, method)(block_size=block_size)
+    with open(os.devnull, 'wb') as f:
+        cg.done(show=False, stream=f)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return peak, seconds
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--measure':
+        # one grid, in a process of its own
+        csv_path, method, block_size = sys.argv[2:5]
+        block_size = None if block_size == 'None' else int(block_size)
+        print('{:.1f} {:.2f}'.format(*measure(csv_path, method, block_size)))
+        sys.exit()
+    args = [a for a in sys.argv[1:] if a != '--full']
+    block_size = int(args[0]) if args else 10000
+    block_sizes = [block_size]
+    if '--full' in sys.argv:
+        block_sizes.append(None)
+    print('{:<14}{:>10}{:>12}{:>10}{:>8}'.format('method', 'cells', 
+          'block_size', 'peak MB', 's'))
+    with tempfile.TemporaryDirectory() as directory:
+        for n in SIZES:
+            csv_path = os.path.join(directory, 'grid{}.csv'.format(n))
+            write_database(n, csv_path)
+            for method in ('draw_squares', 'draw_hex'):
+                for size in block_sizes:
+                    if size is None and n > 100000:
+                        continue
+                    out = subprocess.run([sys.executable, '-m', 
+                        'benchmarks.chunked_grids', '--measure', csv_path, 
+                        method, str(size)], stdout=subprocess.PIPE, 
+                        stderr=subprocess.DEVNULL, check=True)
+                    peak, seconds = out.stdout.split()
+                    print('{:<14}{:>10}{:>12}{:>10}{:>8}'.format(method, n,
+                          str(size), peak.decode(), seconds.decode()))
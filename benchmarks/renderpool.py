@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# Filename: renderpool.py
+
+""" Compares making maps of the US counties in worker processes that each
+    read the database (chorogrid.render in a ProcessPoolExecutor) with a
+    Renderpool, whose workers share one published copy of it. Prints the
+    time to the first map, the total time, and the workers' private
+    (unshared) resident memory, read from /proc, so Linux only.
+
+    python -m benchmarks.renderpool [processes] [maps]   (from the top
+    directory of the repository, or with chorogrid installed)
+"""
+
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import chorogrid
+
+CSV_PATH = os.path.join(os.path.dirname(chorogrid.__file__), 'databases',
+                        'usa_counties.csv')
+
+def _private_mb(pid):
+    """Private and total resident memory of a process, in MB"""
+    sizes = {}
+    with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if value.strip().endswith('kB'):
+                sizes[key] = int(value.split()[0])
+    return ((sizes['Private_Clean'] + sizes['Private_Dirty']) / 1024,
+            sizes['Rss'] / 1024)
+
+def _workers_mb():
+    sizes = [_private_mb(p.pid) for p in multiprocessing.active_children()]
+    return max(s[0] for s in sizes), max(s[1] for s in sizes)
+
+def _render(job):
+    chorogrid.render(**job)
+
+def _jobs(n):
+    ids = list(pd.read_csv(CSV_PATH, usecols=['fips'])['fips'])
+    return [dict(csv_path=CSV_PATH, ids=ids, colors=['#4575b4'] * len(ids),
+                 id_column='fips', draw_kwargs={'viewport': 
+                                                [0, 0, 300 + i, 300]})
+            for i in range(n)]
+
+def run_naive(processes, jobs):
+    start = time.perf_counter()
+    with ProcessPoolExecutor(processes) as executor:
+        executor.submit(_render, jobs[0]).result()
+        first = time.perf_counter() - start
+        list(executor.map(_render, jobs))
+        total = time.perf_counter() - start
+        private, rss = _workers_mb()
+    return first, total, private, rss
+
+def run_pool(processes, jobs):
+    start = time.perf_counter()
+    with chorogrid.Renderpool(CSV_PATH, processes) as pool:
+        pool.submit(**jobs[0]).result()
+        first = time.perf_counter() - start
+        pool.map(jobs)
+        total = time.perf_counter() - start
+        private, rss = _workers_mb()
+    return first, total, private, rss
+
+if __name__ == '__main__':
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    jobs = _jobs(int(sys.argv[2]) if len(sys.argv) > 2 else 32)
+    print('{:<12}{:>12}{:>10}{:>20}{:>12}'.format('', 'first map s',
+          'total s', 'worker private MB', 'worker RSS'))
+    for name, run in (('render', run_naive), ('Renderpool', run_pool)):
+        print('{:<12}{:>12.2f}{:>10.2f}{:>20.1f}{:>12.1f}'.format(
+              name, *run(processes, jobs)))
@@ -0,0 +1,140 @@
+#!/usr/bin/python
+# Filename: Adjacency.py
+
+import heapq
+import numpy as np
+from chorogrid import Dbcache
+from chorogrid.Geometry import Geometry
+
+class Adjacency(object):
+    """ Which regions of a database border each other, derived from their
+        map paths in one pass by hashing vertices: two regions are
+        neighbours if they share at least min_shared vertices (so regions
+        meeting at a single point, like Arizona and Colorado, are not).
+        Instantiated with:
+            geometry: a Geometry object
+            tolerance: vertices closer than about this are treated as the
+                       same; they are hashed on a grid of this size and on
+                       one ten times finer
+            min_shared: number of shared vertices needed to be neighbours
+
+        The graph is stored in compressed sparse row form: the neighbours
+        of region i are indices[indptr[i]:indptr[i+1]] (indices into ids).
+
+        methods:
+        .from_database(csv_path, id_column, path_column, ...): build from a
+            database, cached next to the database csv
+        .neighbours(id_): list of the ids bordering id_
+        .neighbour_indices(i): array of the regions bordering region i
+        .degrees(): number of neighbours of every region
+        .coloring(): a color number for every region, no two neighbours
+                     alike, usually four or five in all
+    """
+    def __init__(self, geometry, tolerance=1.0, min_shared=2,
+                 indptr=None, indices=None):
+        self.ids = geometry.ids
+        self._positions = {id_: i for i, id_ in enumerate(self.ids)}
+        if indptr is None:
+            pairs = set()
+            for grid in (tolerance / 10, tolerance):
+                pairs.update(self._shared_vertex_pairs(geometry, grid,
+                                                       min_shared))
+            indptr, indices = self._to_csr(pairs, len(self.ids))
+        self.indptr = indptr
+        self.indices = indices
+
+    def _shared_vertex_pairs(self, geometry, grid, min_shared):
+        """Returns a list of (i, j) pairs of regions, i < j, sharing at
+           least min_shared vertices once snapped to a grid"""
+        n = len(geometry.ids)
+        vertex_counts = np.diff(geometry.ring_offsets[geometry.region_offsets])
+        region = np.repeat(np.arange(n, dtype=np.int64), vertex_counts)
+        if len(region) == 0:
+            return []
+        snapped = np.round(geometry.coords / grid).astype(np.int64)
+        snapped -= snapped.min(axis=0)
+        key = snapped[:, 0] * (snapped[:, 1].max() + 1) + snapped[:, 1]
+        # one entry per distinct (vertex, region), sorted by vertex
+        unique = np.unique(key * n + region)
+        key, region = unique // n, unique % n
+        starts = np.nonzero(np.r_[True, key[1:] != key[:-1]])[0]
+        sizes = np.diff(np.r_[starts, len(key)])
+        firsts, seconds = [], []
+        for size in np.unique(sizes[sizes > 1]):
+            group_starts = starts[sizes == size]
+            for a in range(size):
+                for b in range(a + 1, size):
+                    firsts.append(region[group_starts + a])
+                    seconds.append(region[group_starts + b])
+        if len(firsts) == 0:
+            return []
+        codes, counts = np.unique(np.concatenate(firsts) * n +
+                                  np.concatenate(seconds), return_counts=True)
+        codes = codes[counts >= min_shared]
+        return list(zip(codes // n, codes % n))
+
+    def _to_csr(self, pairs, n):
+        pairs = np.array(sorted(pairs), dtype=np.int64).reshape(-1, 2)
+        rows = np.concatenate([pairs[:, 0], pairs[:, 1]])
+        cols = np.concatenate([pairs[:, 1], pairs[:, 0]])
+        order = np.lexsort((cols, rows))
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(rows,
+                                                minlength=n))])
+        return indptr.astype(np.int64), cols[order]
+
+    @classmethod
+    def from_database(cls, csv_path, id_column='abbrev',
+                      path_column='map_path', tolerance=1.0, min_shared=2):
+        geometry = Geometry.from_database(csv_path, id_column, path_column)
+        name = '{}.adjacency'.format(path_column)
+        cached = Dbcache.load(csv_path, name)
+        if (cached is not None and cached['tolerance'] == tolerance and
+                cached['min_shared'] == min_shared):
+            return cls(geometry, indptr=cached['indptr'],
+                       indices=cached['indices'])
+        adjacency = cls(geometry, tolerance, min_shared)
+        Dbcache.save(csv_path, name, indptr=adjacency.indptr,
+                     indices=adjacency.indices,
+                     tolerance=np.float64(tolerance),
+                     min_shared=np.int64(min_shared))
+        return adjacency
+
+    def neighbour_indices(self, i):
+        """Returns an array of the indices of the regions bordering
+           region i"""
+        return self.indices[self.indptr[i]:self.indptr[i+1]]
+
+    def neighbours(self, id_):
+        """Returns a list of the ids of the regions bordering id_"""
+        return [self.ids[j] for j in
+                self.neighbour_indices(self._positions[id_])]
+
+    def degrees(self):
+        """Returns an array of the number of neighbours of each region"""
+        return np.diff(self.indptr)
+
+    def coloring(self):
+        """Returns an array with a color number (0, 1, 2...) for every
+           region such that no two neighbours share one, using DSatur:
+           repeatedly color the region whose neighbours already use the
+           most different colors, with the lowest color it can take."""
+        n = len(self.ids)
+        colors = np.full(n, -1, dtype=np.int64)
+        neighbour_colors = [set() for _ in range(n)]
+        degrees = self.degrees()
+        heap = [(0, -degrees[i], i) for i in range(n)]
+        heapq.heapify(heap)
+        while len(heap) > 0:
+            saturation, _, i = heapq.heappop(heap)
+            if colors[i] >= 0 or -saturation != len(neighbour_colors[i]):
+                continue  # already colored, or a stale entry
+            color = 0
+            while color in neighbour_colors[i]:
+                color += 1
+            colors[i] = color
+            for j in self.neighbour_indices(i):
+                if colors[j] < 0 and color not in neighbour_colors[j]:
+                    neighbour_colors[j].add(color)
+                    heapq.heappush(heap, (-len(neighbour_colors[j]),
+                                          -degrees[j], j))
+        return colors
@@ -0,0 +1,82 @@
+#!/usr/bin/python
+# Filename: Asyncrenderer.py
+
+import asyncio
+import functools
+import weakref
+from chorogrid.Chorogrid import render, _render_key
+
+class Asyncrenderer(object):
+    """ Makes maps from asyncio code (e.g. a web service) without blocking
+        the event loop: reading the database, drawing and serializing all
+        happen in an executor, and so does writing the file. Instantiated
+        with:
+            executor: a concurrent.futures executor, or None for the event
+                      loop's default thread pool. Drawing is CPU-bound, so
+                      a ProcessPoolExecutor lets maps be made in parallel
+                      (its arguments must then be picklable)
+            max_concurrent: at most this many maps are made at once;
+                            further calls wait their turn, which keeps a
+                            burst of requests from swamping the executor
+            cache: a Rendercache, used as by render(); it is looked up
+                   and filled in the event loop's thread, and only maps
+                   not in it are made in the executor, so one cache
+                   serves every thread or process of the executor
+
+        methods:
+        .render(...): coroutine; takes the arguments of chorogrid.render(),
+            plus save_filename, and returns the svg document as bytes
+    """
+    def __init__(self, executor=None, max_concurrent=4, cache=None):
+        self.executor = executor
+        self.max_concurrent = max_concurrent
+        self.cache = cache
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def render(self, csv_path, ids, colors, save_filename=None,
+                     **kwargs):
+        """Makes a map as chorogrid.render(csv_path, ids, colors, **kwargs)
+           does, in the executor. If save_filename is given, the document
+           is also written there (also in the executor); a name ending in
+           '.svgz' implies compress=True."""
+        if save_filename is not None and save_filename[-5:] == '.svgz':
+            kwargs['compress'] = True
+        cache = kwargs.pop('cache', self.cache)
+        loop = asyncio.get_running_loop()
+        async with self._semaphore:
+            data = None
+            if cache is not None:
+                key = _render_key(cache, csv_path, ids, colors, **kwargs)
+                data = cache.get(key)
+            if data is None:
+                data = await loop.run_in_executor(self.executor,
+                    functools.partial(render, csv_path, ids, colors, 
+                                      **kwargs))
+                if cache is not None:
+                    cache.put(key, data)
+            if save_filename is not None:
+                if kwargs.get('compress', False):
+                    if save_filename[-5:] != '.svgz':
+                        save_filename += '.svgz'
+                elif save_filename[-4:] != '.svg':
+                    save_filename += '.svg'
+                await loop.run_in_executor(self.executor, _write_file,
+                                           save_filename, data)
+        return data
+
+# one per event loop, as a semaphore belongs to the loop it is used in
+_default_renderers = weakref.WeakKeyDictionary()
+
+async def render_async(csv_path, ids, colors, save_filename=None, **kwargs):
+    """await render_async(...) is render(...) without blocking the event
+       loop, using a shared Asyncrenderer with the default thread pool and
+       at most 4 maps at once; make an Asyncrenderer to choose otherwise."""
+    loop = asyncio.get_running_loop()
+    if loop not in _default_renderers:
+        _default_renderers[loop] = Asyncrenderer()
+    return await _default_renderers[loop].render(csv_path, ids, colors,
+                                                 save_filename, **kwargs)
+
+def _write_file(filename, data):
+    with open(filename, 'wb') as f:
+        f.write(data)
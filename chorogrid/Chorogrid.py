@@ -3,10 +3,31 @@
 
 import xml.etree.ElementTree as ET
 import pandas as pd
+import gzip
+import io
+import os
 import re
 import sys
+import numpy as np
+import copy
+import functools
+import itertools
+from functools import lru_cache
 from math import sqrt
-from IPython.display import SVG, display
+from chorogrid import Dbcache
+from chorogrid.Adjacency import Adjacency
+from chorogrid.Geometry import Geometry
+from chorogrid.Hexgrid import MULTIHEX_STEPS, hex_origins
+from chorogrid.Palettecolors import Palettecolors
+from chorogrid.Spatialindex import Spatialindex
+
+# the ids of each database, in row order, shared by every Chorogrid made
+# with ids=None: {(path, mtime, id_column): (ids, positions)}
+_database_ids = {}
+
+# numbers the clip paths of zoomed-in maps, so that the ids stay unique when
+# several maps are stacked in one document
+_clip_ids = itertools.count()
 
 class Chorogrid(object):
     """ An object which makes choropleth grids, instantiated with:
@@ -14,12 +35,20 @@ class Chorogrid(object):
                 * ids: e.g., states or countries, corresponding to
                        the Colorbin.colorlist
                 * coordinates or path
-            ids: a listlike object of ids corresponding to colors
+                      (a dataframe with these columns can be given instead,
+                       e.g. Dissolve.to_dataframe())
+            ids: a listlike object of ids corresponding to colors, or 
+                 None for all the ids of the database in row order (these
+                 are only read once per database, however many maps)
             colors: a listlike object of colors in hex (#123456) format
-                    corresponding to ids
+                    corresponding to ids, or a Palettecolors, which keeps
+                    a palette and one small integer per id instead
             id_column: the name of the column in csv_path containing ids
                        if there is not a 1:1 map between the ids object
                        and the contents of id_column, you will be warned
+            warn: if False, don't print those warnings; either way, the 
+                  ids not in the database are kept in .invalid_ids, and 
+                  those in the database but not in ids in .missing_ids
             
         Methods (introspect to see arguments)
            set_colors: pass a new list of colors to replace the one
@@ -36,32 +65,149 @@ class Chorogrid(object):
            draw_multisquare: draw a multiple-square-based choropleth
            draw_map: draw a regular, geographic choropleth
            
+           spatial_index: index of the drawn regions, for hit-testing
+           label_anchors: label positions computed from map paths
+           adjacency: which regions border each other, and a coloring
+           animate: step the drawn grid or map through a sequence of
+                    colorings, as one animated svg
+           
            done: save and/or display the result in IPython notebook
-           done_with_overlay: overlay two Chorogrid objects
+           done_with_overlay: overlay two Chorogrid objects (for more
+                              layers, or svg fragments, see Layerstack)
     """
-    def __init__(self, csv_path, ids, colors, id_column='abbrev'):
-        self.df = pd.read_csv(csv_path)
-        comparison_set = set(self.df[id_column])
-        invalid = set(ids).difference(comparison_set)
-        missing = comparison_set.difference(set(ids))
-        if len(invalid) > 0:
-            print('WARNING: The following are not recognized'
-                  ' ids: {}'.format(invalid), file=sys.stderr)
-        if len(missing) > 0:
-            print('WARNING: The following ids in the csv are not '
-                  'included: {}'.format(missing), file=sys.stderr)
-        self.colors = list(colors)
-        self.ids = list(ids)
+    def __init__(self, csv_path, ids, colors, id_column='abbrev', 
+                 warn=True):
+        if isinstance(csv_path, pd.DataFrame):
+            # nothing on disk to cache things next to
+            self.csv_path = None
+            self.df = csv_path
+        else:
+            self.csv_path = csv_path
+            # read when first needed (see df); grids drawn with block_size
+            # read the database a block at a time instead
+            self._df = None
+        assert id_column in self._database_columns(), ("{} is not a column"
+            " in the database".format(id_column))
+        self._positions = None
+        self.invalid_ids = set()
+        self.missing_ids = set()
+        if ids is None:
+            self.ids, self._positions = self._database_ids(id_column)
+        else:
+            comparison_set = set(self._database_column(id_column))
+            invalid = set(ids).difference(comparison_set)
+            missing = comparison_set.difference(set(ids))
+            if len(invalid) > 0 and warn:
+                print('WARNING: The following are not recognized'
+                      ' ids: {}'.format(invalid), file=sys.stderr)
+            if len(missing) > 0 and warn:
+                print('WARNING: The following ids in the csv are not '
+                      'included: {}'.format(missing), file=sys.stderr)
+            self.invalid_ids = invalid
+            self.missing_ids = missing
+            self.ids = list(ids)
+        if isinstance(colors, Palettecolors):
+            self.colors = colors
+        else:
+            self.colors = list(colors)
         self.svglist = []
-        assert id_column in self.df.columns, ("{} is not a column in"
-            " {}".format(id_column, csv_path))
         self.id_column = id_column
         self.title = ''
         self.additional_svg = []
         self.additional_offset = [0, 0]
         self.legend_params = None
+        self.drawn = None
+        self._geometries = {}
+        # text columns read from elsewhere than self.df, row by row (see
+        # Renderpool): {column: sequence of the column's values}
+        self._text_columns = {}
+
+    @property
+    def df(self):
+        """The database, read from csv_path the first time it is needed"""
+        if self._df is None:
+            self._df = pd.read_csv(self.csv_path)
+        return self._df
+    @df.setter
+    def df(self, df):
+        self._df = df
 
     #methods called from within methods, beginning with underscore
+    def _database_columns(self):
+        if self._df is None:
+            return pd.read_csv(self.csv_path, nrows=0).columns
+        return self._df.columns
+    def _database_column(self, column):
+        """Returns a column of the database, reading only that column if
+           the database hasn't been read"""
+        if self._df is None:
+            return pd.read_csv(self.csv_path, usecols=[column])[column]
+        return self._df[column]
+    def _database_blocks(self, columns, block_size):
+        """Yields DataFrames of the given columns of block_size rows of the
+           database at a time, read from csv_path a block at a time if the
+           database hasn't been read"""
+        if self._df is None:
+            for block in pd.read_csv(self.csv_path, usecols=columns,
+                                     chunksize=block_size):
+                yield block
+        else:
+            for start in range(0, len(self._df), block_size):
+                yield self._df.iloc[start:start + block_size][columns]
+    def _layout_max(self, x_column, y_column, block_size=None):
+        """Returns the largest x and y of a grid layout"""
+        if block_size is None or self._df is not None:
+            return self.df[x_column].max(), self.df[y_column].max()
+        maxes = [(block[x_column].max(), block[y_column].max()) for block 
+                 in self._database_blocks([x_column, y_column], block_size)]
+        return max(m[0] for m in maxes), max(m[1] for m in maxes)
+    def _database_ids(self, id_column):
+        """Returns the ids of the database in row order, and their
+           positions, shared between Chorogrids of the same database"""
+        if self.csv_path is None:
+            ids = tuple(self.df[id_column])
+            return ids, {id_: i for i, id_ in reversed(list(enumerate(ids)))}
+        key = (os.path.abspath(self.csv_path), 
+               os.path.getmtime(self.csv_path), id_column)
+        if key not in _database_ids:
+            ids = tuple(self._database_column(id_column))
+            _database_ids[key] = (ids, {id_: i for i, id_ in 
+                                        reversed(list(enumerate(ids)))})
+        return _database_ids[key]
+    def _id_positions(self):
+        """Returns a dict of each id to its (first) position in self.ids"""
+        if self._positions is not None:
+            return self._positions
+        positions = {}
+        for i, id_ in enumerate(self.ids):
+            positions.setdefault(id_, i)
+        return positions
+    def _geometry(self, path_column):
+        """Returns the Geometry of the database's paths in path_column"""
+        if self.csv_path is not None:
+            return Geometry.from_database(self.csv_path, self.id_column,
+                                          path_column)
+        if path_column not in self._geometries:
+            self._geometries[path_column] = Geometry.from_paths(
+                self.df[self.id_column], self.df[path_column])
+        return self._geometries[path_column]
+    def _select_map_rows(self, path_column, subset, viewport):
+        """Returns the database rows to draw for a subset of ids and/or a
+           viewport, and the extent (xmin, ymin, xmax, ymax) to show"""
+        bboxes = self._geometry(path_column).bboxes
+        keep = ~np.isnan(bboxes[:, 0])
+        if subset is not None:
+            keep &= self.df[self.id_column].isin(list(subset)).values
+        if viewport is not None:
+            xmin, ymin, xmax, ymax = viewport
+            keep &= ((bboxes[:, 0] <= xmax) & (bboxes[:, 2] >= xmin) &
+                     (bboxes[:, 1] <= ymax) & (bboxes[:, 3] >= ymin))
+        rows = np.nonzero(keep)[0]
+        if viewport is not None:
+            return rows, tuple(viewport)
+        assert len(rows) > 0, "none of the subset ids have paths"
+        return rows, (bboxes[rows, 0].min(), bboxes[rows, 1].min(),
+                      bboxes[rows, 2].max(), bboxes[rows, 3].max())
     def _update_default_dict(self, default_dict, dict_name, kwargs):
         """Updates a dict based on kwargs"""
         if dict_name in kwargs.keys():
@@ -75,31 +221,48 @@ class Chorogrid(object):
                     default_dict[k] = v
         return default_dict
     def _dict2style(self, dict_):
-        """Returns a concatenated string from the dict"""
-        to_return = []
-        for k,v in dict_.items():
-            to_return.append(k + ':' + str(v) + ';')
-        to_return[-1] = to_return[-1][:-1]
-        return ''.join(to_return)
+        """Returns a concatenated string from the dict; the same string
+           object for dicts with the same items"""
+        return _style_string(tuple(dict_.items()))
     def _make_svg_top(self, width, height):
         """Writes first part of svg"""
         self.svg = ET.Element('svg', xmlns="http://www.w3.org/2000/svg", 
             version="1.1", height=str(height), width=str(width))
+        # serialized forms of elements of self.svg: {id(element): (element,
+        # text, fingerprint when serialized)}
+        self._fragments = {}
+        # with block_size, a function yielding the cells' svg, which isn't
+        # in the tree
+        self._cell_blocks = None
     def _draw_title(self, x, y):
         if len(self.title) > 0:
             font_style = self._dict2style(self.title_font_dict)
-            _ = ET.SubElement(self.svg, "text", id="title", x=str(x), 
-                              y=str(y), style=font_style)
-            _.text = self.title
+            prototype, text, fingerprint = _title_fragment(self.title, 
+                str(x), str(y), font_style)
+            # each map gets its own copy, free to be changed
+            element = copy.deepcopy(prototype)
+            self.svg.append(element)
+            self._fragments[id(element)] = (element, text, fingerprint)
     def _determine_font_colors(self, kwargs):
+        compact = isinstance(self.colors, Palettecolors)
         if 'font_colors' in kwargs.keys():
             fc = kwargs['font_colors']
             if type(fc) is str:
-                font_colors = [fc] * len(self.ids)
-            elif type(fc) is list:
+                if compact:
+                    font_colors = Palettecolors([fc], 
+                                  np.zeros(len(self.ids), dtype=np.uint8))
+                else:
+                    font_colors = [fc] * len(self.ids)
+            elif type(fc) is list or isinstance(fc, Palettecolors):
                 font_colors = fc
             elif type(fc) is dict:
-                font_colors = [fc[x] for x in self.colors]
+                if compact:
+                    font_colors = self.colors.map_palette(fc)
+                else:
+                    font_colors = [fc[x] for x in self.colors]
+        elif compact:
+            font_colors = Palettecolors(['#000000'], 
+                          np.zeros(len(self.ids), dtype=np.uint8))
         else:
             font_colors = ['#000000'] * len(self.ids)
         return font_colors
@@ -122,32 +285,14 @@ class Chorogrid(object):
                                                                 x, y-hh,
                                                                 x-ww/2, y-hh/2)
             
-    def _increment_multihex(self, x, y, w, direction):                                        
+    def _increment_multihex(self, x, y, w, direction):
         h = w/sqrt(3)
-        if direction == 'a':
-            return 'L', x+w/2, y-h/2
-        elif direction == 'b':
-            return 'L', x+w/2, y+h/2
-        elif direction == 'c':
-            return 'L', x, y+h
-        elif direction == 'd':
-            return 'L', x-w/2, y+h/2
-        elif direction == 'e':
-            return 'L', x-w/2, y-h/2
-        elif direction == 'f':
-            return 'L', x, y-h
-        elif direction == 'A':
-            return 'M', x+w/2, y-h/2
-        elif direction == 'B':
-            return 'M', x+w/2, y+h/2
-        elif direction == 'C':
-            return 'M', x, y+h
-        elif direction == 'D':
-            return 'M', x-w/2, y+h/2
-        elif direction == 'E':
-            return 'M', x-w/2, y-h/2
-        elif direction == 'F':
-            return 'M', x, y-h
+        dx, dy = MULTIHEX_STEPS[direction.lower()]
+        if dx:
+            x = x + dx * w
+        if dy:
+            y = y + dy * h
+        return ('M' if direction.isupper() else 'L'), x, y
     def _calc_multihex(self, x, y, w, contour):
         result = []
         result.append("M{}, {}".format(x, y))
@@ -187,8 +332,10 @@ class Chorogrid(object):
     # types of grid
     def set_colors(self, colors):
         """change colors list specified when Chorogrid is instantiated"""
+        if not isinstance(colors, Palettecolors):
+            colors = list(colors)
         self.colors = colors
-        assert len(ids) == len(colors), ("ids and colors must be "
+        assert len(self.ids) == len(colors), ("ids and colors must be "
                                          "the same length")
     def set_title(self, title, **kwargs):
         """Set a title for the grid
@@ -302,39 +449,22 @@ class Chorogrid(object):
     
     # another function-from-within, I'm placing it here to be right below the set_legend method
     def _apply_legend(self):
-        d = self.legend_params # convenient one-letter-long dict name    
-        for i, color in enumerate(d['colors']):
-            style_text = ("fill:{0};stroke-width:{1}px;stroke:{2};fill-rule:"
-                          "evenodd;stroke-linecap:butt;stroke-linejoin:miter;"
-                          "stroke-opacity:1".format(color,
-                              d['stroke_width'],
-                              d['stroke_color']))
-            ET.SubElement(self.legendsvg,
-                          "rect", 
-                          id="legendbox{}".format(i), 
-                          x="0",
-                          y=str(d['y_offset'] + i * (d['box_height'] + 
-                          d['gutter'])), 
-                          height=str(d['box_height']),
-                          width=str(d['width']), 
-                          style=style_text)
-        for i, label in enumerate(d['labels']):
-            style_text = d['font_style'] + ";alignment-baseline:middle"       
-            _ = ET.SubElement(self.legendsvg, "text", id="legendlabel{}".format(
-                    i), x=str(d['label_x_offset'] + d['width'] + d['gutter']),
-                    y=str(d['label_y_offset'] + d['y_offset'] + i * (
-                    d['box_height'] + d['gutter']) + 
-                    (d['box_height']) / 2), style=style_text)
-            _.text = label
-        if d['title'] is not None and len(d['title']) > 0:   
-            _ = ET.SubElement(self.legendsvg, "text", id="legendtitle", x="0", 
-                              y="0", style=d['font_style'])
-            _.text = d['title']
+        # legends are usually the same map after map, so their elements
+        # and serialized svg are made once and reused
+        prototypes, text, fingerprint = _legend_fragment(
+            _hashable(self.legend_params))
+        # each map gets its own copies, free to be changed
+        self.legendsvg.extend(copy.deepcopy(e) for e in prototypes)
+        self._fragments[id(self.legendsvg)] = (self.legendsvg, text, 
+                                               fingerprint)
 
-    def add_svg(self, text, offset=[0, 0]):
+    def add_svg(self, text, offset=None):
         """Adds svg text to the final output. Can be called more than once."""
-        offset[0] += self.additional_offset[0]
-        offset[1] += self.additional_offset[1]
+        if offset is None:
+            offset = [0, 0]
+        # a new list, so neither a caller's offset nor a default is changed
+        offset = [offset[0] + self.additional_offset[0],
+                  offset[1] + self.additional_offset[1]]
         translate_text = "translate({} {})".format(offset[0], offset[1])
         text = ("<g transform=\"{}\">".format(translate_text) +
                 text + "</g>")
@@ -342,6 +472,9 @@ class Chorogrid(object):
         
     def done_and_overlay(self, other_chorogrid, show=True, save_filename=None):
         """Overlays a second chorogrid object on top of the root object."""
+        for cg in (self, other_chorogrid):
+            assert getattr(cg, '_cell_blocks', None) is None, ("overlays"
+                " need grids drawn without block_size")
         svgstring = ET.tostring(self.svg).decode('utf-8')
         svgstring = svgstring.replace('</svg>', ''.join(self.additional_svg) + '</svg>')
         svgstring = svgstring.replace(">", ">\n")
@@ -358,32 +491,401 @@ class Chorogrid(object):
             with open(save_filename, 'w+', encoding='utf-8') as f:
                 f.write(svgstring)
         if show:
-            display(SVG(svgstring))
+            _display(svgstring)
             
+    def _iter_svg_chunks(self):
+        """Yields the finished svg document as a series of strings, one per
+           element that has no children (groups are opened, their contents
+           yielded one by one, then closed), so it can be written out (and
+           compressed) without first building the whole document in
+           memory."""
+        yield _svg_head(self.svg.attrib)
+        for chunk in self._iter_body_chunks():
+            yield chunk
+        yield "</svg>\n"
+    def _iter_body_chunks(self):
+        """Yields the elements inside the svg tag, as _iter_svg_chunks"""
+        fragments = getattr(self, '_fragments', {})
+        if getattr(self, '_cell_blocks', None) is not None:
+            # the cells come first, as in the tree
+            for chunk in self._cell_blocks():
+                yield chunk
+        for child in self.svg:
+            fragment = fragments.get(id(child))
+            # the cached text only stands for the element as it was then
+            if (fragment is not None and fragment[0] is child and 
+                    _fingerprint(child) == fragment[2]):
+                if child.tag != 'g':
+                    yield fragment[1]
+                else:
+                    # a group, of which only the contents were cached
+                    yield (_open_tag(child) + fragment[1] + 
+                           '</{}>\n'.format(child.tag))
+                continue
+            for chunk in _iter_element_chunks(child):
+                yield chunk
+        for text in self.additional_svg:
+            yield text.replace(">", ">\n")
+    def _write_chunks(self, chunks, stream, compress):
+        """Encodes chunks and writes them to a binary stream, gzipping
+           them as they come if compress is True"""
+        _write_chunks(chunks, stream, compress)
+    def _block_colors(self, ids, font_colors, spacing_dict):
+        """Returns lists of the fill and font colors of a block of ids, 
+           looked up all at once"""
+        if self._positions is not None:
+            # the database's own ids, already indexed
+            positions = [self._positions.get(id_, -1) for id_ in ids]
+        else:
+            if getattr(self, '_id_index', None) is None:
+                ids_ = pd.Series(self.ids, dtype=object)
+                first = ~ids_.duplicated().values
+                self._id_index = (pd.Index(ids_.values[first]), 
+                                  np.nonzero(first)[0])
+            index, rows = self._id_index
+            found = index.get_indexer(pd.Index(ids, dtype=object))
+            positions = np.where(found >= 0, rows[found], -1).tolist()
+        fills, fonts = [], []
+        for k in positions:
+            if k >= 0:
+                fills.append(self.colors[k])
+                fonts.append(font_colors[k])
+            else:
+                fills.append(spacing_dict['missing_color'])
+                fonts.append(spacing_dict['missing_font_color'])
+        return fills, fonts
+    def _iter_square_blocks(self, x_column, y_column, spacing_dict, 
+                            font_style, font_colors, roundxy, block_size):
+        """Yields the svg of the cells of draw_squares (with block_size),
+           block_size rows of the database at a time, as the element tree 
+           would be written"""
+        sd = spacing_dict
+        w = sd['cell_width']
+        rect = ('<rect id="rect{}" x="{}" y="{}" ry="%s" width="%s" '
+                'height="%s" style="{}" />\n' % (_escape_attrib(roundxy),
+                _escape_attrib(w), _escape_attrib(w)))
+        text = '<text id="text{}" x="{}" y="{}" style="{}">\n{}</text>\n'
+        # the style of each fill color and font color, escaped
+        styles, font_styles = {}, {}
+        for block in self._database_blocks([self.id_column, x_column, 
+                                            y_column], block_size):
+            ids = block[self.id_column].tolist()
+            fills, fonts = self._block_colors(ids, font_colors, sd)
+            xs = (sd['margin_left'] + block[x_column].values * 
+                  (w + sd['gutter'])).tolist()
+            ys = (sd['margin_top'] + block[y_column].values * 
+                  (w + sd['gutter'])).tolist()
+            chunk = []
+            for id_, fill, font, x, y in zip(ids, fills, fonts, xs, ys):
+                if fill not in styles:
+                    styles[fill] = _escape_attrib("stroke:{0};stroke-width:"
+                        "{1};stroke-miterlimit:4;stroke-opacity:1;"
+                        "stroke-dasharray:none;fill:{2}".format(
+                        sd['stroke_color'], sd['stroke_width'], fill))
+                if font not in font_styles:
+                    font_styles[font] = _escape_attrib(font_style + 
+                                                       ';fill:{}'.format(font))
+                id_ = str(id_)
+                chunk.append(rect.format(_escape_attrib(id_), x, y, 
+                                         styles[fill]))
+                chunk.append(text.format(_escape_attrib(id_), x + w/2, 
+                    y + sd['name_y_offset'], font_styles[font], 
+                    _escape_text(id_)))
+            yield ''.join(chunk)
+    def _iter_hex_blocks(self, x_column, y_column, true_rows, spacing_dict,
+                         font_style, font_colors, block_size):
+        """Yields the svg of the cells of draw_hex (with block_size), as
+           _iter_square_blocks"""
+        sd = spacing_dict
+        w = sd['cell_width']
+        polygon = '<polygon id="hex{}" points="{}" style="{}" />\n'
+        text = '<text id="text{}" x="{}" y="{}" style="{}">\n{}</text>\n'
+        # the style of each fill color and font color, escaped
+        styles, font_styles = {}, {}
+        for block in self._database_blocks([self.id_column, x_column, 
+                                            y_column], block_size):
+            ids = block[self.id_column].tolist()
+            fills, fonts = self._block_colors(ids, font_colors, sd)
+            xs, ys = hex_origins(block[x_column].values, 
+                                 block[y_column].values, w, sd['gutter'], 
+                                 sd['margin_left'], sd['margin_top'], 
+                                 true_rows)
+            chunk = []
+            for id_, fill, font, x, y in zip(ids, fills, fonts, xs, ys):
+                if fill not in styles:
+                    styles[fill] = _escape_attrib("stroke:{0};"
+                        "stroke-miterlimit:4;stroke-opacity:1;"
+                        "stroke-dasharray:none;fill:{1};stroke-width:"
+                        "{2}".format(sd['stroke_color'], fill, 
+                                     sd['stroke_width']))
+                if font not in font_styles:
+                    font_styles[font] = _escape_attrib(font_style + 
+                                                       ';fill:{}'.format(font))
+                id_ = str(id_)
+                chunk.append(polygon.format(_escape_attrib(id_), 
+                    self._calc_hexagon(x, y, w, true_rows), styles[fill]))
+                chunk.append(text.format(_escape_attrib(id_), x + w/2, 
+                    y + sd['name_y_offset'], font_styles[font], 
+                    _escape_text(id_)))
+            yield ''.join(chunk)
+
+    def _drawn_geometry(self):
+        """Returns a Geometry of the regions as last drawn, in svg 
+           coordinates"""
+        d = self.drawn
+        sd = d['spacing_dict']
+        ids = list(self.df[self.id_column])
+        if d['method'] == 'draw_map':
+            geometry = self._geometry(d['path_column'])
+            if d['view'] is None:
+                return geometry.translated(sd['margin_left'], 
+                                           sd['margin_top'])
+            xmin, ymin, xmax, ymax = d['view']
+            scale = sd['map_width'] / max(xmax - xmin, 1e-9)
+            visible = np.zeros(len(geometry), dtype=bool)
+            visible[d['rows']] = True
+            geometry = geometry.translated(sd['margin_left'] - xmin * scale,
+                                           sd['margin_top'] - ymin * scale,
+                                           scale)
+            # regions that weren't drawn can't be hit
+            geometry.bboxes[~visible] = np.nan
+            return geometry
+        across = self.df[d['x_column']].values.astype(float)
+        down = self.df[d['y_column']].values.astype(float)
+        if d['method'] == 'draw_squares':
+            w = sd['cell_width']
+            x = sd['margin_left'] + across * (w + sd['gutter'])
+            y = sd['margin_top'] + down * (w + sd['gutter'])
+            corners = np.array([[0, 0], [w, 0], [w, w], [0, w]])
+            origins = np.stack([x, y], axis=1)[:, np.newaxis, :]
+            return Geometry(ids, [[ring] for ring in origins + corners])
+        if d['method'] == 'draw_hex':
+            w = sd['cell_width']
+            x, y = hex_origins(self.df[d['x_column']].values, 
+                               self.df[d['y_column']].values, w, 
+                               sd['gutter'], sd['margin_left'], 
+                               sd['margin_top'], d['true_rows'])
+            x, y = np.array(x, dtype=float), np.array(y, dtype=float)
+            corners = np.array([[float(n) for n in pair.split(',')] for pair
+                       in self._calc_hexagon(0, 0, w, d['true_rows']).split()])
+            origins = np.stack([x, y], axis=1)[:, np.newaxis, :]
+            return Geometry(ids, [[ring] for ring in origins + corners])
+        # multihex and multisquare: reuse the contour paths themselves
+        w = sd['cell_width']
+        contours = self.df[d['contour_column']]
+        paths = []
+        for across_, down_, contour in zip(across, down, contours):
+            if d['method'] == 'draw_multihex':
+                x = sd['margin_left'] + (down_ % 2) * w/2 + across_ * w
+                y = sd['margin_top'] + down_ * (1.5 * w / sqrt(3))
+                paths.append(self._calc_multihex(x, y, w, contour))
+            else:
+                x = sd['margin_left'] + across_ * w
+                y = sd['margin_top'] + down_ * w
+                paths.append(self._calc_multisquare(x, y, w, contour))
+        return Geometry.from_paths(ids, paths)
+
+    def label_anchors(self, path_column='map_path', precision=0.5):
+        """Returns an (n, 2) array with a label position for each row of
+           the database: the point of each region's path farthest from its
+           outline (pole of inaccessibility), to within precision. Computed
+           once for all regions and cached in a file next to the database,
+           so later calls (and draw_map(labels=True)) just load it."""
+        if self.csv_path is None:
+            return self._geometry(path_column).label_anchors(precision)
+        name = '{}.labels'.format(path_column)
+        cached = Dbcache.load(self.csv_path, name)
+        if cached is not None and cached['precision'] == precision:
+            return cached['anchors']
+        anchors = self._geometry(path_column).label_anchors(precision)
+        Dbcache.save(self.csv_path, name, anchors=anchors,
+                     precision=np.float64(precision))
+        return anchors
+
+    def _draw_map_labels(self, mapsvg, path_column, rows, view, 
+                         spacing_dict, font_dict, kwargs):
+        font_colors = self._determine_font_colors(kwargs)
+        font_style = self._dict2style(font_dict)
+        anchors = self.label_anchors(path_column)
+        if (path_column == 'map_path' and 'map_label_x' in self.df.columns
+                and 'map_label_y' in self.df.columns):
+            # prefer hand-placed labels where the database has them
+            curated = self.df[['map_label_x', 'map_label_y']].values
+            anchors = np.where(np.isnan(curated.astype(float)), anchors, 
+                               curated)
+        if view is not None:
+            # labels stay the same size when zoomed in, so are moved 
+            # rather than scaled
+            xmin, ymin, xmax, ymax = view
+            scale = spacing_dict['map_width'] / max(xmax - xmin, 1e-9)
+            anchors = (anchors - [xmin, ymin]) * scale
+        positions = self._id_positions()
+        ids = self.df[self.id_column].values
+        for i in rows:
+            id_ = ids[i]
+            x, y = anchors[i]
+            if np.isnan(x):
+                continue
+            if id_ in positions:
+                this_font_color = font_colors[positions[id_]]
+            else:
+                this_font_color = spacing_dict['missing_font_color']
+            this_font_style = font_style + ';fill:{}'.format(this_font_color)
+            _ = ET.SubElement(mapsvg, 
+                              "text", 
+                              id="text{}".format(id_),
+                              x=str(x),
+                              y=str(y), 
+                              style=this_font_style)
+            _.text = str(id_)
+
+    def adjacency(self, path_column='map_path', tolerance=1.0, 
+                  min_shared=2):
+        """Returns an Adjacency of the database's regions, derived from the
+           paths in path_column and cached next to the database. Its 
+           .neighbours(id) lists bordering regions and .coloring() numbers
+           the regions so that no neighbours match, like the 
+           map_fill_default column but for any database."""
+        if self.csv_path is None:
+            return Adjacency(self._geometry(path_column), tolerance, 
+                             min_shared)
+        return Adjacency.from_database(self.csv_path, self.id_column,
+                                       path_column, tolerance, min_shared)
+
+    def spatial_index(self, buckets_per_side=None):
+        """Returns a Spatialindex of the regions of the grid or map most 
+           recently drawn, in the coordinates of the svg, for answering
+           point -> region and box -> regions queries (e.g. tooltips).
+           Geographic paths are only parsed once per database."""
+        assert self.drawn is not None, ("a draw_... method must be called"
+                                        " before spatial_index")
+        return Spatialindex(self._drawn_geometry(), buckets_per_side)
+
+    def animate(self, color_frames, frame_duration=1., frame_titles=None,
+                drop_constant=True):
+        """Turns the grid or map most recently drawn into an animated svg
+           that steps through a sequence of colorings, e.g. one per month.
+           The shapes are written once; each region whose color changes
+           gets a CSS keyframe animation of its fill, with regions that
+           change the same way sharing one.
+           * color_frames: a list of listlike objects of colors, one per 
+             frame, each corresponding to ids (e.g. the colors_out of a 
+             Colorbin per column of a wide dataframe)
+           * frame_duration: seconds each frame is shown; the animation
+             loops
+           * frame_titles: a list of strings, one per frame, shown in
+             place of the title (set_title must have been called before
+             drawing)
+           * drop_constant: if True, regions whose color never changes are
+             left out of the animation, which makes the output smaller
+           Shapes start out with the colors of the first frame. Call done()
+           afterwards as usual."""
+        assert self.drawn is not None, ("a draw_... method must be called"
+                                        " before animate")
+        assert self._cell_blocks is None, ("animate needs a grid drawn"
+                                           " without block_size")
+        n_frames = len(color_frames)
+        assert n_frames > 0, "color_frames is empty"
+        for frame in color_frames:
+            assert len(frame) == len(self.ids), ("each frame must have one"
+                " color per id")
+        prefix = {'draw_squares': 'rect', 'draw_map': '', 'draw_hex': 'hex',
+                  'draw_multihex': 'hex', 'draw_multisquare': 'square'
+                  }[self.drawn['method']]
+        missing_color = self.drawn['spacing_dict']['missing_color']
+        positions = self._id_positions()
+        elements = {}
+        for element in self.svg.iter():
+            if element.tag in ('rect', 'path', 'polygon'):
+                elements[element.get('id')] = element
+        total = n_frames * frame_duration
+        keyframes = {}
+        rules = []
+        for id_ in self.df[self.id_column]:
+            element = elements.get(prefix + str(id_))
+            if element is None:
+                continue  # not drawn, e.g. outside the viewport
+            if id_ in positions:
+                i = positions[id_]
+                sequence = tuple(frame[i] for frame in color_frames)
+            else:
+                sequence = (missing_color,) * n_frames
+            element.set('style', re.sub('(^|;)fill:[^;]*', 
+                        '\\1fill:' + str(sequence[0]), element.get('style')))
+            if drop_constant and len(set(sequence)) == 1:
+                continue
+            if sequence not in keyframes:
+                keyframes[sequence] = 'frames{}'.format(len(keyframes))
+            rules.append('[id="{}"]{{animation:{} {}s step-end infinite}}'
+                         .format(element.get('id'), keyframes[sequence], 
+                                 total))
+        css = []
+        for sequence, name in keyframes.items():
+            # a step holds its fill until the next, so only changes count
+            steps = ['{:g}%{{fill:{}}}'.format(100. * k / n_frames, color)
+                     for k, color in enumerate(sequence)
+                     if k == 0 or color != sequence[k-1]]
+            steps.append('100%{{fill:{}}}'.format(sequence[-1]))
+            css.append('@keyframes {}{{{}}}'.format(name, ''.join(steps)))
+        if frame_titles is not None:
+            assert len(frame_titles) == n_frames, ("frame_titles must have"
+                " one title per frame")
+            title = self.svg.find("text[@id='title']")
+            assert title is not None, ("set_title must be called before"
+                " drawing to use frame_titles")
+            self.svg.remove(title)
+            for k, text in enumerate(frame_titles):
+                _ = ET.SubElement(self.svg, "text", id="title{}".format(k),
+                                  x=title.get('x'), y=title.get('y'),
+                                  style=title.get('style'))
+                _.text = text
+                # visible only during frame k
+                steps = ['{:g}%{{visibility:visible}}'.format(
+                         100. * k / n_frames)]
+                if k > 0:
+                    steps.insert(0, '0%{visibility:hidden}')
+                steps.append('{:g}%{{visibility:hidden}}'.format(
+                    100. * (k + 1) / n_frames))
+                css.append('@keyframes titleframe{}{{{}}}'.format(k, 
+                           ''.join(steps)))
+                rules.append('#title{0}{{visibility:hidden;animation:'
+                             'titleframe{0} {1}s step-end infinite}}'.format(
+                             k, total))
+        style = ET.Element('style')
+        style.text = '\n'.join(css + rules)
+        self.svg.insert(0, style)
+
     # the .done() method           
-    def done(self, show=True, save_filename=None):
+    def done(self, show=True, save_filename=None, compress=False, 
+             stream=None, as_bytes=False):
         """if show == True, displays the svg in IPython notebook. If save_filename
-           is specified, saves svg file"""
-        svgstring = ET.tostring(self.svg).decode('utf-8')
-        svgstring = svgstring.replace('</svg>', ''.join(self.additional_svg) + '</svg>')
-        svgstring = svgstring.replace(">", ">\n")
-        if save_filename is not None:
-            if save_filename[-4:] != '.svg':
-                save_filename += '.svg'
-            with open(save_filename, 'w+', encoding='utf-8') as f:
-                f.write(svgstring)
-        if show:
-            display(SVG(svgstring))
+           is specified, saves svg file.
+           * compress: if True, output is gzipped (svgz); this is implied by
+             a save_filename ending in '.svgz'
+           * stream: a binary file-like object (open file, pipe, socket
+             file, io.BytesIO) to which the document is written
+           * as_bytes: if True, returns the (possibly compressed) document 
+             as bytes without touching the disk"""
+        return _output(self._iter_svg_chunks, show, save_filename, compress,
+                       stream, as_bytes)
    
     # the methods to draw square grids, map (traditional choropleth),
     # hex grid, four-hex grid, multi-square grid
     
     def draw_squares(self, x_column='square_x', 
-                     y_column='square_y', **kwargs):
+                     y_column='square_y', block_size=None, **kwargs):
         """ Creates an SVG file based on a square grid, with coordinates from 
         the specified columns in csv_path (specified when Chorogrid class
         initialized).
         
+        For grids of hundreds of thousands of cells, pass block_size (e.g.
+        10000): the cells are then not kept in the element tree but written
+        by done() straight to the file or stream, block_size rows of the 
+        database at a time, so memory for the svg stays bounded however 
+        large the grid. The output is the same; animate and 
+        done_and_overlay need the cells in the tree, so draw without 
+        block_size to use them.
+        
         Note on kwarg dicts: defaults will be used for all keys unless
         overridden, i.e. you don't need to state all the key-value pairs.
         
@@ -433,60 +935,70 @@ class Chorogrid(object):
                                                  'spacing_dict', kwargs) 
         font_colors = self._determine_font_colors(kwargs)
         font_style = self._dict2style(font_dict)
+        x_max, y_max = self._layout_max(x_column, y_column, block_size)
         total_width = (spacing_dict['margin_left'] + 
-                       (self.df[x_column].max() + 1) * 
+                       (x_max + 1) * 
                        spacing_dict['cell_width'] + 
-                       self.df[x_column].max() *
+                       x_max *
                        spacing_dict['gutter'] + 
                        spacing_dict['margin_right'])
         total_height = (spacing_dict['margin_top'] + 
-                        (self.df[y_column].max() + 1) *
+                        (y_max + 1) *
                         spacing_dict['cell_width'] + 
-                        self.df[x_column].max() * 
+                        x_max * 
                         spacing_dict['gutter'] + 
                         spacing_dict['margin_bottom'])
         self._make_svg_top(total_width, total_height)
+        self.drawn = {'method': 'draw_squares', 'x_column': x_column,
+                      'y_column': y_column, 'spacing_dict': spacing_dict}
         if spacing_dict['roundedness'] > 0:
             roundxy = spacing_dict['roundedness']
         else:
             roundxy = 0
-        for i, id_ in enumerate(self.df[self.id_column]):
-            if id_ in self.ids:
-                this_color = self.colors[self.ids.index(id_)]
-                this_font_color = font_colors[self.ids.index(id_)]
-            else:
-                this_color = spacing_dict['missing_color']
-                this_font_color = spacing_dict['missing_font_color']
-            across = self.df[x_column].iloc[i]
-            down = self.df[y_column].iloc[i]
-            x = (spacing_dict['margin_left'] + 
-                 across * (spacing_dict['cell_width'] + 
-                 spacing_dict['gutter']))
-            y = (spacing_dict['margin_top'] + 
-                 down * (spacing_dict['cell_width'] + 
-                 spacing_dict['gutter']))
-            style_text = ("stroke:{0};stroke-width:{1};stroke-miterlimit:4;"
-                          "stroke-opacity:1;stroke-dasharray:none;fill:"
-                          "{2}".format(spacing_dict['stroke_color'],
-                                       spacing_dict['stroke_width'],
-                                       this_color))
-            this_font_style = font_style + ';fill:{}'.format(this_font_color)
-            ET.SubElement(self.svg, 
-                          "rect", 
-                          id="rect{}".format(id_),
-                          x=str(x),
-                          y=str(y), 
-                          ry = str(roundxy), 
-                          width=str(spacing_dict['cell_width']),
-                          height=str(spacing_dict['cell_width']), 
-                          style=style_text)
-            _ = ET.SubElement(self.svg, 
-                              "text", 
-                              id="text{}".format(id_),
-                              x=str(x + spacing_dict['cell_width']/2),
-                              y=str(y + spacing_dict['name_y_offset']), 
-                              style=this_font_style)
-            _.text =str(id_)
+        if block_size is not None:
+            self._cell_blocks = functools.partial(self._iter_square_blocks,
+                x_column, y_column, spacing_dict, font_style, font_colors,
+                roundxy, block_size)
+        else:
+            positions = self._id_positions()
+            for i, id_ in enumerate(self.df[self.id_column]):
+                if id_ in positions:
+                    this_color = self.colors[positions[id_]]
+                    this_font_color = font_colors[positions[id_]]
+                else:
+                    this_color = spacing_dict['missing_color']
+                    this_font_color = spacing_dict['missing_font_color']
+                across = self.df[x_column].iloc[i]
+                down = self.df[y_column].iloc[i]
+                x = (spacing_dict['margin_left'] + 
+                     across * (spacing_dict['cell_width'] + 
+                     spacing_dict['gutter']))
+                y = (spacing_dict['margin_top'] + 
+                     down * (spacing_dict['cell_width'] + 
+                     spacing_dict['gutter']))
+                style_text = ("stroke:{0};stroke-width:{1};"
+                              "stroke-miterlimit:4;stroke-opacity:1;"
+                              "stroke-dasharray:none;fill:{2}".format(
+                              spacing_dict['stroke_color'],
+                              spacing_dict['stroke_width'], this_color))
+                this_font_style = (font_style + 
+                                   ';fill:{}'.format(this_font_color))
+                ET.SubElement(self.svg, 
+                              "rect", 
+                              id="rect{}".format(id_),
+                              x=str(x),
+                              y=str(y), 
+                              ry = str(roundxy), 
+                              width=str(spacing_dict['cell_width']),
+                              height=str(spacing_dict['cell_width']), 
+                              style=style_text)
+                _ = ET.SubElement(self.svg, 
+                                  "text", 
+                                  id="text{}".format(id_),
+                                  x=str(x + spacing_dict['cell_width']/2),
+                                  y=str(y + spacing_dict['name_y_offset']), 
+                                  style=this_font_style)
+                _.text =str(id_)
         if self.legend_params is not None and len(self.legend_params) > 0:
             self.legendsvg = ET.SubElement(self.svg, "g", transform=
                     "translate({} {})".format(total_width - 
@@ -500,7 +1012,8 @@ class Chorogrid(object):
                           spacing_dict['margin_left'],
                           spacing_dict['title_y_offset'])
         
-    def draw_map(self, path_column='map_path', **kwargs):
+    def draw_map(self, path_column='map_path', labels=False, subset=None,
+                 viewport=None, **kwargs):
         """ Creates an SVG file based on SVG paths delineating a map, 
             with paths from the specified columns in csv_path 
             (specified when Chorogrid class initialized).
@@ -508,8 +1021,32 @@ class Chorogrid(object):
         Note on kwarg dict: defaults will be used for all keys unless 
         overridden, i.e. you don't need to state all the key-value pairs.
         
-        Note that the map does not have an option for font_dict, as
-        it will not print labels.
+        If labels is True, each region is labelled with its id, at 
+        map_label_x, map_label_y where the database has them, otherwise at
+        the point computed by label_anchors (cached next to the database).
+        
+        To draw a zoomed-in view, pass subset (a listlike of ids to draw)
+        and/or viewport (xmin, ymin, xmax, ymax, in the coordinates of the
+        paths). Only regions in the subset whose bounding boxes meet the
+        viewport are drawn, and the view is scaled to fill map_width and 
+        map_height (keeping its aspect ratio; the canvas shrinks to fit).
+        Bounding boxes are computed once per database.
+        
+        kwarg: font_dict (only used if labels is True)
+            default: {'font-style': 'normal', 'font-weight': 'normal', 
+                      'font-size': '12px', 'line-height': '125%', 
+                      'text-anchor': 'middle', 'font-family': 'sans-serif', 
+                      'letter-spacing': '0px', 'word-spacing': '0px', 
+                      'fill-opacity': 1, 'stroke': 'none', 
+                      'stroke-width': '1px', 'stroke-linecap': 'butt', 
+                      'stroke-linejoin': 'miter', 'stroke-opacity': 1,
+                      'alignment-baseline': 'middle'}
+                      
+        kwarg: font_colors (only used if labels is True)
+            default = "#000000"
+            if specified, must be either listlike object of colors 
+            corresponding to ids, a dict of hex colors to font color, or a 
+            string of a single color.             
                       
         kwarg: spacing_dict
             # Note that total_width and total_height will depend on where 
@@ -522,8 +1059,24 @@ class Chorogrid(object):
                         'title_y_offset': 45,
                         'stroke_color': '#ffffff', 'stroke_width': 0.5, 
                         'missing_color': '#a0a0a0',
+                        'missing_font_color': '#000000',
                         'legend_offset': [0, 0]}           
         """
+        font_dict = {'font-style': 'normal', 
+                     'font-weight': 'normal', 
+                     'font-size': '12px', 
+                     'line-height': '125%', 
+                     'text-anchor': 'middle', 
+                     'font-family': 'sans-serif', 
+                     'letter-spacing': '0px', 
+                     'word-spacing': '0px', 
+                     'fill-opacity': 1, 
+                     'stroke': 'none', 
+                     'stroke-width': '1px',
+                     'stroke-linecap': 'butt', 
+                     'stroke-linejoin': 'miter', 
+                     'stroke-opacity': 1,
+                     'alignment-baseline': 'middle'}
         spacing_dict = {'map_width': 959, 
                         'map_height': 593,
                         'margin_left': 10,  
@@ -534,9 +1087,20 @@ class Chorogrid(object):
                         'stroke_color': '#ffffff', 
                         'stroke_width': 0.5, 
                         'missing_color': '#a0a0a0',
+                        'missing_font_color': '#000000',
                         'legend_offset': [0, 0]}        
         spacing_dict = self._update_default_dict(spacing_dict, 
                                                  'spacing_dict', kwargs) 
+        font_dict = self._update_default_dict(font_dict, 'font_dict', kwargs)
+        rows = np.arange(len(self.df))
+        view = None
+        if subset is not None or viewport is not None:
+            rows, view = self._select_map_rows(path_column, subset, viewport)
+            xmin, ymin, xmax, ymax = view
+            scale = min(spacing_dict['map_width'] / max(xmax - xmin, 1e-9),
+                        spacing_dict['map_height'] / max(ymax - ymin, 1e-9))
+            spacing_dict['map_width'] = (xmax - xmin) * scale
+            spacing_dict['map_height'] = (ymax - ymin) * scale
         total_width = (spacing_dict['map_width'] + 
                        spacing_dict['margin_left'] + 
                        spacing_dict['margin_right'])
@@ -544,6 +1108,9 @@ class Chorogrid(object):
                         spacing_dict['margin_top'] + 
                         spacing_dict['margin_bottom'])
         self._make_svg_top(total_width, total_height)
+        self.drawn = {'method': 'draw_map', 'path_column': path_column,
+                      'spacing_dict': spacing_dict, 'rows': rows, 
+                      'view': view}
         translate_text = "translate({} {})".format(spacing_dict['margin_left'],
                                                    spacing_dict['margin_top'])
         self.additional_offset = [spacing_dict['margin_left'],
@@ -551,22 +1118,45 @@ class Chorogrid(object):
         mapsvg = ET.SubElement(self.svg,
                                "g",
                                transform=translate_text)
-        for i, id_ in enumerate(self.df[self.id_column]):
-            path = self.df[self.df[self.id_column] == id_][path_column].iloc[0]
-            if id_ in self.ids:
-                this_color = self.colors[self.ids.index(id_)]
+        stroke_width = spacing_dict['stroke_width']
+        pathsvg = mapsvg
+        if view is not None:
+            # regions partly in view are cut off at its edges, not drawn
+            # over the margins, title and legend
+            clip_id = "map_view_{}".format(next(_clip_ids))
+            clip = ET.SubElement(ET.SubElement(mapsvg, "defs"), "clipPath",
+                                 id=clip_id)
+            ET.SubElement(clip, "rect", x=str(xmin), y=str(ymin), 
+                          width=str(xmax - xmin), height=str(ymax - ymin))
+            # the paths are scaled into view, the strokes must not be
+            pathsvg = ET.SubElement(mapsvg, "g", transform=
+                "scale({0}) translate({1} {2})".format(scale, -xmin, -ymin))
+            pathsvg.set("clip-path", "url(#{})".format(clip_id))
+            stroke_width = stroke_width / scale
+        positions = self._id_positions()
+        ids = self.df[self.id_column].values
+        paths = self._text_columns.get(path_column)
+        if paths is None:
+            paths = self.df[path_column].values
+        for i in rows:
+            id_ = ids[i]
+            if id_ in positions:
+                this_color = self.colors[positions[id_]]
             else:
                 this_color = spacing_dict['missing_color']
             style_text = ("stroke:{0};stroke-width:{1};stroke-miterlimit:4;"
                           "stroke-opacity:1;stroke-dasharray:none;fill:"
                           "{2}".format(spacing_dict['stroke_color'],
-                                       spacing_dict['stroke_width'],
+                                       stroke_width,
                                        this_color))
-            ET.SubElement(mapsvg,
+            ET.SubElement(pathsvg,
                           "path",
                           id=str(id_),
-                          d=path,
+                          d=paths[i],
                           style=style_text)
+        if labels:
+            self._draw_map_labels(mapsvg, path_column, rows, view, 
+                                  spacing_dict, font_dict, kwargs)
         if self.legend_params is not None and len(self.legend_params) > 0:
             self.legendsvg = ET.SubElement(self.svg, "g", transform=
                     "translate({} {})".format(total_width - 
@@ -580,7 +1170,8 @@ class Chorogrid(object):
                           spacing_dict['margin_left'],
                           spacing_dict['title_y_offset'])
 
-    def draw_hex(self, x_column='hex_x', y_column='hex_y', true_rows=True, **kwargs):
+    def draw_hex(self, x_column='hex_x', y_column='hex_y', true_rows=True, 
+                 block_size=None, **kwargs):
         """ Creates an SVG file based on a hexagonal grid, with coordinates 
         from the specified columns in csv_path (specified when Chorogrid class
         initialized).
@@ -601,6 +1192,14 @@ class Chorogrid(object):
           * then (1,0) shares its northeast side with (2,0)'s southwest side.
           * thus odd columns are offset to the south of even columns
 
+        For grids of hundreds of thousands of cells, pass block_size (e.g.
+        10000): the cells are then not kept in the element tree but written
+        by done() straight to the file or stream, block_size rows of the 
+        database at a time, so memory for the svg stays bounded however 
+        large the grid. The output is the same; animate and 
+        done_and_overlay need the cells in the tree, so draw without 
+        block_size to use them.
+        
         Note on kwarg dicts: defaults will be used for all keys unless 
         overridden, i.e. you don't need to state all the key-value pairs.
         
@@ -663,80 +1262,76 @@ class Chorogrid(object):
                                                  'spacing_dict', kwargs)
         font_colors = self._determine_font_colors(kwargs)
         font_style = self._dict2style(font_dict)
+        x_max, y_max = self._layout_max(x_column, y_column, block_size)
         if true_rows:
             total_width = (spacing_dict['margin_left'] + 
-                           (self.df[x_column].max()+1.5) * 
+                           (x_max+1.5) * 
                            spacing_dict['cell_width'] + 
-                           (self.df[x_column].max()-1) *
+                           (x_max-1) *
                            spacing_dict['gutter'] + 
                            spacing_dict['margin_right'])
             total_height = (spacing_dict['margin_top'] + 
-                            (self.df[y_column].max()*0.866 + 0.289) *
+                            (y_max*0.866 + 0.289) *
                             spacing_dict['cell_width'] + 
-                            (self.df[y_column].max()-1) *
+                            (y_max-1) *
                             spacing_dict['gutter'] + 
                             spacing_dict['margin_bottom'])
         else:
             total_width = (spacing_dict['margin_left'] + 
-                           (self.df[x_column].max()*0.75 + 0.25) * 
+                           (x_max*0.75 + 0.25) * 
                            spacing_dict['cell_width'] + 
-                           (self.df[x_column].max()-1) *
+                           (x_max-1) *
                            spacing_dict['gutter'] + 
                            spacing_dict['margin_right'])
             total_height = (spacing_dict['margin_top'] + 
-                            (self.df[y_column].max() + 1.5) *
+                            (y_max + 1.5) *
                             spacing_dict['cell_width'] + 
-                            (self.df[y_column].max()-1) *
+                            (y_max-1) *
                             spacing_dict['gutter'] + 
                             spacing_dict['margin_bottom'])
         self._make_svg_top(total_width, total_height)
+        self.drawn = {'method': 'draw_hex', 'x_column': x_column,
+                      'y_column': y_column, 'true_rows': true_rows,
+                      'spacing_dict': spacing_dict}
         w = spacing_dict['cell_width']
-        for i, id_ in enumerate(self.df[self.id_column]):
-            if id_ in self.ids:
-                this_color = self.colors[self.ids.index(id_)]
-                this_font_color = font_colors[self.ids.index(id_)]
-            else:
-                this_color = spacing_dict['missing_color']
-                this_font_color = spacing_dict['missing_font_color']
-            across = self.df[x_column].iloc[i]
-            down = self.df[y_column].iloc[i]
-            # offset odd rows to the right or down
-            x_offset = 0
-            y_offset = 0
-            if true_rows:
-                if down % 2 == 1:
-                    x_offset = w/2
-                x = (spacing_dict['margin_left'] + 
-                     x_offset + across * (w + spacing_dict['gutter']))
-                y = (spacing_dict['margin_top'] + 
-                    down * (1.5 * w / sqrt(3) + spacing_dict['gutter']))
-            else:
-                x_offset = 0.25 * w # because northwest corner is to the east of westmost point
-                if across % 2 == 1:
-                    y_offset = w*0.866/2
-                x = (spacing_dict['margin_left'] + 
-                     x_offset + across * 0.75 * (w + spacing_dict['gutter']))
-                y = (spacing_dict['margin_top'] + 
-                    y_offset + down * (sqrt(3) / 2 * w + spacing_dict['gutter']))
-       
-            polystyle = ("stroke:{0};stroke-miterlimit:4;stroke-opacity:1;"
-                         "stroke-dasharray:none;fill:{1};stroke-width:"
-                         "{2}".format(spacing_dict['stroke_color'],
-                                      this_color,
-                                      spacing_dict['stroke_width']))
-            this_font_style = font_style + ';fill:{}'.format(this_font_color)
-            ET.SubElement(self.svg, 
-                          "polygon", 
-                          id="hex{}".format(id_),
-                          points=self._calc_hexagon(x, y, w, true_rows),
-                          style=polystyle)
-            _ = ET.SubElement(self.svg, 
-                              "text", 
-                              id="text{}".format(id_),
-                              x=str(x+w/2),
-                              y=str(y + spacing_dict['name_y_offset']), 
-                              style=this_font_style)
-            _.text =str(id_)
+        if block_size is not None:
+            self._cell_blocks = functools.partial(self._iter_hex_blocks,
+                x_column, y_column, true_rows, spacing_dict, font_style,
+                font_colors, block_size)
+        else:
+            xs, ys = hex_origins(self.df[x_column].values, 
+                                 self.df[y_column].values, w, 
+                                 spacing_dict['gutter'], 
+                                 spacing_dict['margin_left'], 
+                                 spacing_dict['margin_top'], true_rows)
+            positions = self._id_positions()
+            for i, id_ in enumerate(self.df[self.id_column]):
+                if id_ in positions:
+                    this_color = self.colors[positions[id_]]
+                    this_font_color = font_colors[positions[id_]]
+                else:
+                    this_color = spacing_dict['missing_color']
+                    this_font_color = spacing_dict['missing_font_color']
+                x, y = xs[i], ys[i]
+                polystyle = ("stroke:{0};stroke-miterlimit:4;stroke-opacity:1;"
+                             "stroke-dasharray:none;fill:{1};stroke-width:"
+                             "{2}".format(spacing_dict['stroke_color'],
+                                          this_color,
+                                          spacing_dict['stroke_width']))
+                this_font_style = (font_style + 
+                                   ';fill:{}'.format(this_font_color))
+                ET.SubElement(self.svg, 
+                              "polygon", 
+                              id="hex{}".format(id_),
+                              points=self._calc_hexagon(x, y, w, true_rows),
+                              style=polystyle)
+                _ = ET.SubElement(self.svg, 
+                                  "text", 
+                                  id="text{}".format(id_),
+                                  x=str(x+w/2),
+                                  y=str(y + spacing_dict['name_y_offset']), 
+                                  style=this_font_style)
+                _.text =str(id_)
         if self.legend_params is not None and len(self.legend_params) > 0:
             self.legendsvg = ET.SubElement(self.svg, "g", transform=
                     "translate({} {})".format(total_width - 
@@ -764,6 +1359,8 @@ class Chorogrid(object):
                 e: up and to the left
                 f: up
             Capital letters signify a move without drawing.
+            chorogrid.Hexgrid.multihex_contour(x, y) gives the start cell
+            and contour of a shape from the positions of its hexagons.
         
         Note on kwarg dicts: defaults will be used for all keys unless 
         overridden, i.e. you don't need to state all the key-value pairs.
@@ -835,12 +1432,16 @@ class Chorogrid(object):
                         spacing_dict['cell_width'] + 
                         spacing_dict['margin_bottom'])
         self._make_svg_top(total_width, total_height)
+        self.drawn = {'method': 'draw_multihex', 'x_column': x_column,
+                      'y_column': y_column, 'contour_column': contour_column,
+                      'spacing_dict': spacing_dict}
         w = spacing_dict['cell_width']
         h = w/sqrt(3)
+        positions = self._id_positions()
         for i, id_ in enumerate(self.df[self.id_column]):
-            if id_ in self.ids:
-                this_color = self.colors[self.ids.index(id_)]
-                this_font_color = font_colors[self.ids.index(id_)]
+            if id_ in positions:
+                this_color = self.colors[positions[id_]]
+                this_font_color = font_colors[positions[id_]]
             else:
                 this_color = spacing_dict['missing_color']
                 this_font_color = spacing_dict['missing_font_color']
@@ -976,11 +1577,15 @@ class Chorogrid(object):
                         spacing_dict['cell_width'] + 
                         spacing_dict['margin_bottom'])
         self._make_svg_top(total_width, total_height)
+        self.drawn = {'method': 'draw_multisquare', 'x_column': x_column,
+                      'y_column': y_column, 'contour_column': contour_column,
+                      'spacing_dict': spacing_dict}
         w = spacing_dict['cell_width']
+        positions = self._id_positions()
         for i, id_ in enumerate(self.df[self.id_column]):
-            if id_ in self.ids:
-                this_color = self.colors[self.ids.index(id_)]
-                this_font_color = font_colors[self.ids.index(id_)]
+            if id_ in positions:
+                this_color = self.colors[positions[id_]]
+                this_font_color = font_colors[positions[id_]]
             else:
                 this_color = spacing_dict['missing_color']
                 this_font_color = spacing_dict['missing_font_color']
@@ -1024,3 +1629,245 @@ class Chorogrid(object):
                           spacing_dict['margin_right']) / 2 + 
                           spacing_dict['margin_left'],
                           spacing_dict['title_y_offset'])
+
+
+def _hashable(value):
+    """value, with dicts and lists made into (sorted) tuples"""
+    if isinstance(value, (np.ndarray, pd.Series)):
+        value = value.tolist()
+    if isinstance(value, dict):
+        return tuple(sorted((k, _hashable(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(v) for v in value)
+    return value
+
+@lru_cache(maxsize=1024)
+def _style_string(items):
+    """The style attribute for a tuple of (property, value) pairs"""
+    return ';'.join(k + ':' + str(v) for k, v in items)
+
+def _open_tag(element):
+    """An element's start tag, as ElementTree writes it, and a newline"""
+    tag = ET.Element(element.tag, element.attrib)
+    tag = ET.tostring(tag, short_empty_elements=False).decode('utf-8')
+    return tag[:-len('</{}>'.format(element.tag))] + '\n'
+
+def _iter_element_chunks(element):
+    """Yields an element as ElementTree writes it (with a newline after
+       each tag), one string per element without children"""
+    if len(element) == 0:
+        yield ET.tostring(element).decode('utf-8').replace(">", ">\n")
+        return
+    head = _open_tag(element)
+    if element.text:
+        head += _escape_text(element.text)
+    yield head
+    for child in element:
+        for chunk in _iter_element_chunks(child):
+            yield chunk
+    tail = '</{}>\n'.format(element.tag)
+    if element.tail:
+        tail += _escape_text(element.tail)
+    yield tail
+
+def _fingerprint(element):
+    """Everything about an element that is serialized, bar a group's own
+       tag (for a group, its contents); to tell whether it has changed"""
+    if element.tag == 'g':
+        elements = [e for child in element for e in child.iter()]
+    else:
+        elements = list(element.iter())
+    return tuple((e.tag, tuple(e.attrib.items()), e.text, e.tail)
+                 for e in elements)
+
+def _serialize(elements):
+    return ''.join(ET.tostring(e).decode('utf-8').replace(">", ">\n")
+                   for e in elements)
+
+@lru_cache(maxsize=256)
+def _title_fragment(title, x, y, font_style):
+    """A title's text element (to copy, not to use), its serialized svg
+       and its fingerprint"""
+    element = ET.Element("text", id="title", x=x, y=y, style=font_style)
+    element.text = title
+    return element, _serialize([element]), _fingerprint(element)
+
+@lru_cache(maxsize=256)
+def _legend_fragment(legend_params):
+    """The elements of a legend (see Chorogrid.set_legend), given its
+       parameters as from _hashable (to copy, not to use), their serialized
+       svg and the fingerprint of a group of them"""
+    d = dict(legend_params) # convenient one-letter-long dict name    
+    legendsvg = ET.Element("g")
+    for i, color in enumerate(d['colors']):
+        style_text = ("fill:{0};stroke-width:{1}px;stroke:{2};fill-rule:"
+                      "evenodd;stroke-linecap:butt;stroke-linejoin:miter;"
+                      "stroke-opacity:1".format(color,
+                          d['stroke_width'],
+                          d['stroke_color']))
+        ET.SubElement(legendsvg,
+                      "rect", 
+                      id="legendbox{}".format(i), 
+                      x="0",
+                      y=str(d['y_offset'] + i * (d['box_height'] + 
+                      d['gutter'])), 
+                      height=str(d['box_height']),
+                      width=str(d['width']), 
+                      style=style_text)
+    for i, label in enumerate(d['labels']):
+        style_text = d['font_style'] + ";alignment-baseline:middle"       
+        _ = ET.SubElement(legendsvg, "text", id="legendlabel{}".format(
+                i), x=str(d['label_x_offset'] + d['width'] + d['gutter']),
+                y=str(d['label_y_offset'] + d['y_offset'] + i * (
+                d['box_height'] + d['gutter']) + 
+                (d['box_height']) / 2), style=style_text)
+        _.text = label
+    if d['title'] is not None and len(d['title']) > 0:   
+        _ = ET.SubElement(legendsvg, "text", id="legendtitle", x="0", 
+                          y="0", style=d['font_style'])
+        _.text = d['title']
+    elements = tuple(legendsvg)
+    return elements, _serialize(elements), _fingerprint(legendsvg)
+
+# as ElementTree escapes attribute values and text
+_attrib_escapes = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;',
+                                 '"': '&quot;', '\r': '&#13;', 
+                                 '\n': '&#10;', '\t': '&#09;'})
+_text_escapes = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+
+_attrib_special = re.compile('[&<>"\r\n\t]')
+
+def _escape_attrib(value):
+    value = str(value)
+    if _attrib_special.search(value) is None:
+        return value
+    return value.translate(_attrib_escapes)
+
+def _escape_text(value):
+    value = str(value)
+    if _attrib_special.search(value) is None:
+        return value
+    return value.translate(_text_escapes)
+
+def _svg_head(attrib):
+    """The opening svg tag, as ElementTree writes it, and a newline"""
+    head = ET.Element('svg', attrib)
+    head = ET.tostring(head, short_empty_elements=False).decode('utf-8')
+    return head[:-len('</svg>')].replace(">", ">\n")
+
+def _write_chunks(chunks, stream, compress):
+    """Encodes chunks and writes them to a binary stream, gzipping them as
+       they come if compress is True"""
+    if compress:
+        stream = gzip.GzipFile(fileobj=stream, mode='wb')
+    for chunk in chunks:
+        stream.write(chunk.encode('utf-8'))
+    if compress:
+        stream.close()
+
+def _display(svgstring):
+    # IPython is only needed to show maps in a notebook, so scripts and
+    # the command line don't pay for importing it
+    from IPython.display import SVG, display
+    display(SVG(svgstring))
+
+def _output(iter_chunks, show, save_filename, compress, stream, as_bytes):
+    """Does the work of done() for a function yielding document chunks:
+       the document is made once, each chunk going to every output"""
+    streams = []
+    f = None
+    if save_filename is not None:
+        if save_filename[-5:] == '.svgz':
+            compress = True
+        elif compress:
+            save_filename += '.svgz'
+        elif save_filename[-4:] != '.svg':
+            save_filename += '.svg'
+        f = open(save_filename, 'wb')
+        streams.append(f)
+    if stream is not None:
+        streams.append(stream)
+    if as_bytes:
+        buffer = io.BytesIO()
+        streams.append(buffer)
+    if compress:
+        streams = [gzip.GzipFile(fileobj=s, mode='wb') for s in streams]
+    shown = []
+    try:
+        for chunk in iter_chunks():
+            data = chunk.encode('utf-8')
+            for s in streams:
+                s.write(data)
+            if show:
+                shown.append(chunk)
+        if compress:
+            for s in streams:
+                s.close()
+    finally:
+        if f is not None:
+            f.close()
+    if show:
+        _display(''.join(shown))
+    if as_bytes:
+        return buffer.getvalue()
+
+def render(csv_path, ids, colors, draw_method='draw_map', id_column='abbrev',
+           draw_kwargs=None, title=None, title_kwargs=None, legend=None,
+           svg_fragments=None, compress=False, cache=None):
+    """Makes a map in one call and returns the svg document as bytes.
+       * csv_path, ids, colors, id_column: as for Chorogrid
+       * draw_method: name of the draw_... method, e.g. 'draw_squares'
+       * draw_kwargs: dict of keyword arguments for the draw method, e.g.
+         {'spacing_dict': {...}, 'font_dict': {...}}
+       * title, title_kwargs: passed to set_title
+       * legend: dict of keyword arguments for set_legend
+       * svg_fragments: list of svg text, or (text, offset) pairs, for
+         add_svg
+       * compress: if True, returns gzipped (svgz) bytes
+       * cache: a Rendercache; if it already holds a map made from the 
+         same inputs, that is returned without loading the database or
+         drawing anything"""
+    draw_kwargs = draw_kwargs or {}
+    title_kwargs = title_kwargs or {}
+    svg_fragments = svg_fragments or []
+    if cache is not None:
+        key = _render_key(cache, csv_path, ids, colors, draw_method, 
+                          id_column, draw_kwargs, title, title_kwargs, 
+                          legend, svg_fragments, compress)
+        data = cache.get(key)
+        if data is not None:
+            return data
+    cg = Chorogrid(csv_path, ids, colors, id_column)
+    _draw(cg, draw_method, draw_kwargs, title, title_kwargs, legend, 
+          svg_fragments)
+    data = cg.done(show=False, compress=compress, as_bytes=True)
+    if cache is not None:
+        cache.put(key, data)
+    return data
+
+def _render_key(cache, csv_path, ids, colors, draw_method='draw_map', 
+                id_column='abbrev', draw_kwargs=None, title=None, 
+                title_kwargs=None, legend=None, svg_fragments=None, 
+                compress=False):
+    """The key in a Rendercache of the map render() makes from the same
+       arguments"""
+    return cache.key(csv_path, ids=ids, colors=colors, 
+                     draw_method=draw_method, id_column=id_column,
+                     draw_kwargs=draw_kwargs or {}, title=title,
+                     title_kwargs=title_kwargs or {}, legend=legend,
+                     svg_fragments=svg_fragments or [], compress=compress)
+
+def _draw(cg, draw_method, draw_kwargs, title, title_kwargs, legend,
+          svg_fragments):
+    """Sets the title and legend of a Chorogrid, draws it and adds the svg
+       fragments, as render() does"""
+    if title is not None:
+        cg.set_title(title, **title_kwargs)
+    if legend is not None:
+        cg.set_legend(**legend)
+    getattr(cg, draw_method)(**draw_kwargs)
+    for fragment in svg_fragments:
+        if isinstance(fragment, str):
+            cg.add_svg(fragment)
+        else:
+            cg.add_svg(fragment[0], list(fragment[1]))
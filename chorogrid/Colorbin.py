@@ -1,6 +1,8 @@
 #!/usr/bin/python
 # Filename: Colorbin.py
 
+from chorogrid.Palettecolors import Palettecolors
+
 class Colorbin(object):
     """ Instantiate with a list of quantities and colors, then retrieve 
         the following attributes:
@@ -27,6 +29,8 @@ class Colorbin(object):
         .calc_complements(cutoff [between 0 and 1], color_below, color_above):
             if the greyscale color is below the cutoff (i.e. darker),
             complement is assigned color_below, otherwise color_above.
+        .compact(): colors_out as a Palettecolors (colors_in and one small
+            integer per quantity), to keep many maps in memory
     """
     def __init__(self, quantities, colors_in, proportional=True, decimals=None):
         self.quantities = quantities
@@ -102,4 +106,11 @@ class Colorbin(object):
             if grey < cutoff:
                 self.complements.append(color_below)
             else:
-                self.complements.append(color_above)
\ No newline at end of file
+                self.complements.append(color_above)
+
+    def compact(self):
+        positions = {}
+        for i, color in enumerate(self.colors_in):
+            positions.setdefault(color, i)
+        return Palettecolors(self.colors_in, 
+                             [positions[color] for color in self.colors_out])
\ No newline at end of file
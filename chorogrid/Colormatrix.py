@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# Filename: Colormatrix.py
+
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from chorogrid.Palettecolors import Palettecolors
+
+class Colormatrix(object):
+    """ Colorbin for many columns of quantities at once, e.g. every
+        indicator column of a county data table. Bins are the same as
+        Colorbin's for each column on its own. Instantiate with:
+            quantities: a 2-D array (rows x columns) or a dataframe
+            colors_in: list of colors, one per bin
+            proportional: as for Colorbin; if True, fenceposts are evenly
+                          spaced between bin_min, bin_mid and bin_max,
+                          otherwise bins have (insofar as possible) the
+                          same number of members
+            decimals: if not None, fenceposts are rounded to this number
+            shared: if True, one set of fenceposts is computed from all
+                    the columns together and used for each
+            fenceposts: a list of fenceposts to use for every column
+                        instead of computing them
+            bin_min, bin_max, bin_mid: as for Colorbin, scalars or one per
+                        column; by default each column's (or, if shared,
+                        the table's) minimum, maximum and their midpoint
+            threads: if given, columns are binned in this many threads
+                     (numpy does the work, so this helps very wide tables)
+        NaN quantities go in the first bin, as with Colorbin.
+
+        attributes:
+        .columns : the column names (0, 1, 2... for an array)
+        .indices : rows x columns array of bin numbers (uint8, or uint16
+                   with more than 256 colors)
+        .fenceposts : columns x (len(colors_in) + 1) array
+        .bin_counts : columns x len(colors_in) array
+        .labels, .fencepostlabels : lists of Colorbin-style labels, one
+                                    list per column
+
+        methods:
+        .colors_out(column): list of colors for one column, as Colorbin's
+                             colors_out
+        .color_frames(): colors_out of every column, e.g. for
+                         Chorogrid.animate
+        .compact(column): colors for one column as a Palettecolors, which
+                          shares the palette and the column of .indices
+    """
+    def __init__(self, quantities, colors_in, proportional=True,
+                 decimals=None, shared=False, fenceposts=None, bin_min=None,
+                 bin_max=None, bin_mid=None, threads=None):
+        if isinstance(quantities, pd.DataFrame):
+            self.columns = list(quantities.columns)
+            # one flag per column, as a mixed table's .values is all float
+            integer = [np.issubdtype(dtype, np.integer)
+                       for dtype in quantities.dtypes]
+            quantities = quantities.values
+        else:
+            quantities = np.asarray(quantities)
+            assert quantities.ndim == 2, "quantities must be 2-dimensional"
+            self.columns = list(range(quantities.shape[1]))
+            integer = [np.issubdtype(quantities.dtype, np.integer)] * \
+                      quantities.shape[1]
+        self.quantities = quantities.astype(float)
+        self.colors_in = list(colors_in)
+        self.proportional = proportional
+        self.decimals = decimals
+        self.bin_min = bin_min
+        self.bin_max = bin_max
+        self.bin_mid = bin_mid
+        n_columns = self.quantities.shape[1]
+        # fenceposts are quantities of an integer column (or, if shared,
+        # of any column) only when they are computed and not proportional
+        if fenceposts is not None or proportional:
+            self._integer = [False] * n_columns
+        elif shared:
+            self._integer = [all(integer)] * n_columns
+        else:
+            self._integer = integer
+        if fenceposts is not None:
+            assert len(fenceposts) == len(self.colors_in) + 1, ("there must"
+                " be one more fencepost than colors")
+            self.fenceposts = np.tile(np.asarray(fenceposts, dtype=float),
+                                      (n_columns, 1))
+        elif shared:
+            self.fenceposts = np.tile(self._calc_fenceposts(
+                self.quantities.reshape(-1, 1))[0], (n_columns, 1))
+        else:
+            self.fenceposts = None
+        dtype = np.uint8 if len(self.colors_in) <= 256 else np.uint16
+        self.indices = np.zeros(self.quantities.shape, dtype=dtype)
+        if self.fenceposts is None:
+            self.fenceposts = np.zeros((n_columns, len(self.colors_in) + 1))
+        self.bin_counts = np.zeros((n_columns, len(self.colors_in)),
+                                   dtype=np.int64)
+        compute = fenceposts is None and not shared
+        chunks = np.array_split(np.arange(n_columns),
+                                max(1, min(threads or 1, n_columns)))
+        if threads is None or len(chunks) == 1:
+            for chunk in chunks:
+                self._bin_columns(chunk, compute)
+        else:
+            with ThreadPoolExecutor(threads) as executor:
+                for _ in executor.map(lambda c: self._bin_columns(c, compute),
+                                      chunks):
+                    pass
+        self._calc_labels()
+
+    def _column_values(self, value, columns, default):
+        """A per-column bin_min/bin_max/bin_mid, or the default"""
+        if value is None:
+            return default
+        value = np.asarray(value, dtype=float)
+        if value.ndim == 0:
+            return np.full(len(default), float(value))
+        return value[columns]
+
+    def _calc_fenceposts(self, quantities, columns=None):
+        """Fenceposts (columns x len(colors_in) + 1) for each column of
+           quantities, as Colorbin computes them"""
+        n = len(self.colors_in)
+        if columns is None:
+            columns = np.zeros(1, dtype=np.int64)
+        if self.proportional:
+            bin_min = self._column_values(self.bin_min, columns,
+                                          np.nanmin(quantities, axis=0))
+            bin_max = self._column_values(self.bin_max, columns,
+                                          np.nanmax(quantities, axis=0))
+            bin_mid = self._column_values(self.bin_mid, columns,
+                                          (bin_min + bin_max) / 2)
+            step_1 = (bin_mid - bin_min) / n * 2
+            step_2 = (bin_max - bin_mid) / n * 2
+            i = np.arange(n + 1)[:, np.newaxis]
+            fenceposts = np.where(i < n / 2, bin_min + i * step_1,
+                                  bin_max - (n - i) * step_2)
+            if n % 2 == 0:
+                fenceposts[n // 2] = bin_mid
+            fenceposts = fenceposts.T
+        else:
+            # NaNs sort to the end, as they are never the smaller in a
+            # comparison
+            quant_sorted = np.sort(quantities, axis=0)
+            step = len(quant_sorted) / n
+            take = [int(i * step) for i in range(n)] + [-1]
+            fenceposts = quant_sorted[take].T
+        if self.decimals is not None:
+            fenceposts = np.array([[round(x, self.decimals) for x in row]
+                                   for row in fenceposts.tolist()])
+        return fenceposts
+
+    def _bin_columns(self, columns, compute):
+        """Fills in fenceposts (if compute), indices and bin_counts for
+           some columns"""
+        if len(columns) == 0:
+            return
+        quantities = self.quantities[:, columns]
+        if compute:
+            self.fenceposts[columns] = self._calc_fenceposts(quantities,
+                                                             columns)
+        n = len(self.colors_in)
+        inner = self.fenceposts[columns, 1:n]
+        # the highest bin whose lower fencepost the quantity reaches
+        indices = np.zeros(quantities.shape, dtype=self.indices.dtype)
+        for i in range(n - 1):
+            indices[quantities >= inner[:, i]] = i + 1
+        self.indices[:, columns] = indices
+        for k, j in enumerate(columns):
+            self.bin_counts[j] = np.bincount(indices[:, k], minlength=n)
+
+    def _calc_labels(self):
+        self.labels = []
+        self.fencepostlabels = []
+        for fenceposts, integer in zip(self.fenceposts.tolist(),
+                                       self._integer):
+            if integer:
+                # fenceposts are quantities; show ints as ints, as Colorbin
+                fenceposts = [int(x) for x in fenceposts]
+            self.labels.append(['{}-{}'.format(n1, n2) for n1, n2 in
+                                zip(fenceposts[:-1], fenceposts[1:])])
+            self.fencepostlabels.append([str(x) for x in fenceposts])
+
+    def colors_out(self, column):
+        """Returns the list of colors for a column (a name, or a number if
+           quantities was an array)"""
+        j = self.columns.index(column)
+        return [self.colors_in[i] for i in self.indices[:, j]]
+
+    def color_frames(self):
+        """Returns a list of colors_out lists, one per column"""
+        return [self.colors_out(column) for column in self.columns]
+
+    def compact(self, column):
+        """Returns the colors for a column as a Palettecolors"""
+        j = self.columns.index(column)
+        return Palettecolors(self.colors_in, self.indices[:, j])
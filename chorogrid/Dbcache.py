@@ -0,0 +1,46 @@
+#!/usr/bin/python
+# Filename: Dbcache.py
+
+# Persistent caches of things precomputed from a database (label anchors
+# and the like), stored as .npz files next to the database csv. A cache
+# file is only used if the csv has not changed since it was written.
+
+import os
+import numpy as np
+
+def cache_path(csv_path, name):
+    """Returns the path of the cache file called name for csv_path,
+       e.g. databases/usa_counties.map_path.labels.cache.npz"""
+    root, _ = os.path.splitext(csv_path)
+    return '{}.{}.cache.npz'.format(root, name)
+
+def _signature(csv_path):
+    stat = os.stat(csv_path)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+def load(csv_path, name):
+    """Returns a dict of the arrays cached under name for csv_path, or None
+       if there is no up-to-date cache"""
+    path = cache_path(csv_path, name)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as f:
+            if not np.array_equal(f['_signature'], _signature(csv_path)):
+                return None
+            return {k: f[k] for k in f.files if k != '_signature'}
+    except (OSError, ValueError, KeyError):
+        return None
+
+def save(csv_path, name, **arrays):
+    """Caches the given (numeric) arrays under name for csv_path. If the
+       directory is not writable, nothing is cached."""
+    path = cache_path(csv_path, name)
+    temp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(temp_path, 'wb') as f:
+            np.savez(f, _signature=_signature(csv_path), **arrays)
+        os.replace(temp_path, path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
@@ -0,0 +1,217 @@
+#!/usr/bin/python
+# Filename: Dissolve.py
+
+import os
+import numpy as np
+import pandas as pd
+from chorogrid import Dbcache
+from chorogrid.Geometry import Geometry
+
+_cache = {}
+
+def _ring_area(ring):
+    """The signed (shoelace) area of an n x 2 array of vertices"""
+    x, y = ring[:, 0], ring[:, 1]
+    return (np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2
+
+class Dissolve(object):
+    """ Combines the regions of a database into the larger regions they
+        belong to, e.g. counties into states by the 'state' column of
+        usa_counties.csv, or ridings into provinces. Instantiated with:
+            csv_path: the path to the (child) database csv
+            id_column: the name of the column containing child ids
+            parent_column: the name of the column naming each child's parent
+            path_column: the column with the children's svg paths, or None
+                         to only aggregate values (e.g. the Canadian ridings,
+                         which have no paths)
+            tolerance: vertices closer than this are treated as the same
+            min_ring_share: rings smaller than this share of their parent's
+                            area are dropped; they are slivers left where
+                            children's edges do not quite meet, not islands
+
+        Parent outlines are made by dropping every edge two children of the
+        same parent share and joining up what remains. They are cached in
+        memory and next to the database, so switching between levels is
+        cheap after the first time.
+
+        attributes:
+        .parent_ids : the parents, in order of first appearance
+        .geometry : Geometry of the parents (None if path_column is None)
+        .paths : list of svg path strings, one per parent
+
+        methods:
+        .aggregate(ids, values, how, weights): combine child values into
+            parent values, aligned with .parent_ids, ready for Colorbin
+        .to_dataframe(): a database of the parents, which Chorogrid accepts
+            in place of a csv path
+    """
+    def __init__(self, csv_path, id_column='fips', parent_column='state',
+                 path_column='map_path', tolerance=0.05, min_ring_share=1e-4):
+        self.csv_path = csv_path
+        self.id_column = id_column
+        self.parent_column = parent_column
+        self.path_column = path_column
+        self.df = pd.read_csv(csv_path)
+        self.parent_ids = list(pd.unique(self.df[parent_column]))
+        self._parent_positions = {p: i for i, p in
+                                  enumerate(self.parent_ids)}
+        self.parent_of_row = self.df[parent_column].map(
+            self._parent_positions).values
+        self.geometry = None
+        self.paths = None
+        if path_column is not None:
+            self.geometry = self._dissolved_geometry(tolerance,
+                                                     min_ring_share)
+            self.paths = [self._path_string(i) for i in
+                          range(len(self.parent_ids))]
+
+    def _dissolved_geometry(self, tolerance, min_ring_share):
+        key = (os.path.abspath(self.csv_path),
+               os.path.getmtime(self.csv_path), self.id_column,
+               self.parent_column, self.path_column, tolerance,
+               min_ring_share)
+        if key in _cache:
+            return _cache[key]
+        name = '{}.dissolve-{}'.format(self.path_column, self.parent_column)
+        cached = Dbcache.load(self.csv_path, name)
+        if (cached is not None and cached['tolerance'] == tolerance and
+                'min_ring_share' in cached and
+                cached['min_ring_share'] == min_ring_share):
+            geometry = Geometry.from_arrays(self.parent_ids, 
+                                            cached['coords'],
+                                            cached['ring_offsets'],
+                                            cached['region_offsets'])
+        else:
+            geometry = self._dissolve(tolerance, min_ring_share)
+            Dbcache.save(self.csv_path, name, coords=geometry.coords,
+                         ring_offsets=geometry.ring_offsets,
+                         region_offsets=geometry.region_offsets,
+                         tolerance=np.float64(tolerance),
+                         min_ring_share=np.float64(min_ring_share))
+        _cache[key] = geometry
+        return geometry
+
+    def _dissolve(self, tolerance, min_ring_share):
+        children = Geometry.from_database(self.csv_path, self.id_column,
+                                          self.path_column)
+        coords = children.coords
+        # every edge of every child ring, as a pair of vertex numbers
+        ring_lengths = np.diff(children.ring_offsets)
+        following = np.arange(len(coords)) + 1
+        ends = children.ring_offsets[1:] - 1
+        nonempty = ring_lengths > 0
+        following[ends[nonempty]] = children.ring_offsets[:-1][nonempty]
+        snapped = np.round(coords / tolerance).astype(np.int64)
+        snapped -= snapped.min(axis=0)
+        vertex_key = snapped[:, 0] * (snapped[:, 1].max() + 1) + snapped[:, 1]
+        _, vertex = np.unique(vertex_key, return_inverse=True)
+        vertex = vertex.ravel()
+        rings_of_child = np.diff(children.region_offsets)
+        child_of_ring = np.repeat(np.arange(len(children)), rings_of_child)
+        child_of_vertex = np.repeat(child_of_ring, ring_lengths)
+        parent = self.parent_of_row[child_of_vertex]
+        a, b = vertex, vertex[following]
+        keep = a != b
+        a, b, parent = a[keep], b[keep], parent[keep]
+        # an edge two children of the same parent share is internal
+        n_vertices = vertex.max() + 1
+        low, high = np.minimum(a, b), np.maximum(a, b)
+        edge_key = (parent * n_vertices + low) * n_vertices + high
+        _, inverse, counts = np.unique(edge_key, return_inverse=True,
+                                       return_counts=True)
+        outer = counts[inverse.ravel()] == 1
+        a, b, parent = a[outer], b[outer], parent[outer]
+        # the position of each (snapped) vertex
+        vertex_xy = np.zeros((n_vertices, 2))
+        vertex_xy[vertex] = coords
+        rings = [[] for _ in self.parent_ids]
+        order = np.argsort(parent, kind='stable')
+        a, b, parent = a[order], b[order], parent[order]
+        bounds = np.searchsorted(parent, np.arange(len(self.parent_ids) + 1))
+        for p in range(len(self.parent_ids)):
+            for ring in self._chain(a[bounds[p]:bounds[p+1]],
+                                    b[bounds[p]:bounds[p+1]]):
+                rings[p].append(vertex_xy[ring])
+            areas = np.abs([_ring_area(ring) for ring in rings[p]])
+            rings[p] = [ring for ring, area in zip(rings[p], areas)
+                        if area >= min_ring_share * areas.sum()]
+        return Geometry(self.parent_ids, rings)
+
+    def _chain(self, a, b):
+        """Joins undirected edges a[k]-b[k] into closed rings of vertex
+           numbers"""
+        at_vertex = {}
+        for k, (u, v) in enumerate(zip(a, b)):
+            at_vertex.setdefault(u, []).append(k)
+            at_vertex.setdefault(v, []).append(k)
+        used = np.zeros(len(a), dtype=bool)
+        rings = []
+        for k in range(len(a)):
+            if used[k]:
+                continue
+            used[k] = True
+            start, current = a[k], b[k]
+            ring = [start]
+            while current != start:
+                ring.append(current)
+                for e in at_vertex[current]:
+                    if not used[e]:
+                        used[e] = True
+                        current = b[e] if a[e] == current else a[e]
+                        break
+                else:
+                    break  # dangling edge; leave the ring open
+            if len(ring) > 2:
+                rings.append(ring)
+        return rings
+
+    def _path_string(self, i):
+        parts = []
+        for ring in self.geometry.rings(i):
+            parts.append('M' + ' L'.join('{:g},{:g}'.format(x, y)
+                                        for x, y in ring) + ' Z')
+        return ' '.join(parts)
+
+    def aggregate(self, ids, values, how='sum', weights=None):
+        """Combines values of child regions into values for their parents.
+           * ids, values: listlike objects of child ids and their values
+           * how: 'sum', 'mean' or 'weighted_mean'
+           * weights: for 'weighted_mean', a listlike object of weights
+             corresponding to ids, or the name of a database column
+             (e.g. 'pop')
+           Returns parent_ids and an array of values; parents without any
+           child in ids are left out."""
+        assert how in ('sum', 'mean', 'weighted_mean'), ("how must be 'sum',"
+            " 'mean' or 'weighted_mean'")
+        row_of_id = pd.Series(np.arange(len(self.df)),
+                              index=self.df[self.id_column])
+        row_of_id = row_of_id[~row_of_id.index.duplicated()]
+        rows = row_of_id.reindex(list(ids)).values
+        found = ~np.isnan(rows)
+        rows = rows[found].astype(np.int64)
+        values = np.asarray(values, dtype=float)[found]
+        if how == 'weighted_mean':
+            assert weights is not None, "weighted_mean needs weights"
+            if isinstance(weights, str):
+                weights = self.df[weights].values[rows].astype(float)
+            else:
+                weights = np.asarray(weights, dtype=float)[found]
+        else:
+            weights = np.ones(len(values))
+        parent = self.parent_of_row[rows]
+        n = len(self.parent_ids)
+        totals = np.bincount(parent, values * weights, n)
+        counts = np.bincount(parent, weights, n)
+        present = np.bincount(parent, minlength=n) > 0
+        if how != 'sum':
+            totals = totals / np.where(counts == 0, np.nan, counts)
+        return ([p for p, keep in zip(self.parent_ids, present) if keep],
+                totals[present])
+
+    def to_dataframe(self):
+        """Returns a dataframe with one row per parent: the parent_column
+           and, if there are paths, the path_column"""
+        df = pd.DataFrame({self.parent_column: self.parent_ids})
+        if self.paths is not None:
+            df[self.path_column] = self.paths
+        return df
@@ -0,0 +1,461 @@
+#!/usr/bin/python
+# Filename: Geometry.py
+
+import os
+import re
+from math import sqrt
+import numpy as np
+import pandas as pd
+
+_cache = {}
+
+_token_re = re.compile(r'[MmLlHhVvCcSsQqTtAaZz]|'
+                       r'[-+]?(?:\d*\.\d+|\d+\.?)(?:[eE][-+]?\d+)?')
+# number of arguments taken by each path command
+_n_args = {'m': 2, 'l': 2, 'h': 1, 'v': 1, 'c': 6, 's': 4, 'q': 4, 't': 2,
+           'a': 7, 'z': 0}
+
+def parse_path(path):
+    """Parses an svg path string into a list of rings, each an (n, 2) array
+       of absolute coordinates. Relative commands are made absolute; curves
+       and arcs are reduced to their end points, which is plenty for
+       bounds, hit-testing and the like."""
+    rings = []
+    ring = []
+    x, y = 0., 0.
+    start_x, start_y = 0., 0.
+    command = None
+    args = []
+    for token in _token_re.findall(path):
+        if token.isalpha():
+            command = token
+            args = []
+            if command in 'zZ':
+                if len(ring) > 0:
+                    rings.append(ring)
+                ring = []
+                x, y = start_x, start_y
+            continue
+        args.append(float(token))
+        lower = command.lower()
+        if len(args) < _n_args[lower]:
+            continue
+        relative = command != command.upper()
+        if lower == 'h':
+            x = args[0] + (x if relative else 0)
+        elif lower == 'v':
+            y = args[0] + (y if relative else 0)
+        elif relative:
+            x, y = x + args[-2], y + args[-1]
+        else:
+            x, y = args[-2], args[-1]
+        if lower == 'm':
+            if len(ring) > 0:
+                rings.append(ring)
+            ring = []
+            start_x, start_y = x, y
+            # further coordinate pairs after a moveto are linetos
+            command = 'l' if relative else 'L'
+        ring.append((x, y))
+        args = []
+    if len(ring) > 0:
+        rings.append(ring)
+    return [np.array(r, dtype=float) for r in rings]
+
+# paths using anything but movetos, linetos, cubic curves and closepaths,
+# absolute or relative (the exponent e of a number aside), need parse_path
+_not_simple_re = re.compile(r'[^MmLlCcZz0-9eE.,+\s-]')
+_END = ord('|')
+_number_chars = np.zeros(256, dtype=bool)
+_number_chars[[ord(c) for c in '0123456789.+-eE']] = True
+_command_chars = np.zeros(256, dtype=bool)
+_command_chars[[ord(c) for c in 'MmLlCcZz|']] = True
+_to_spaces = str.maketrans('MmLlCcZz|,', '          ')
+
+def parse_paths(paths):
+    """Parses a whole column of svg path strings at once. Returns coords,
+       an (n_vertices, 2) array, ring_offsets and region_offsets (see
+       Geometry); anything that is not a string (e.g. NaN) gets no rings.
+       Paths made only of M, L, C and Z commands, absolute or relative,
+       like those of the included databases, are scanned together as one
+       array of characters, their numbers converted in a single NumPy call
+       and relative coordinates summed per stretch of relative commands;
+       any others go through parse_path, with the same results."""
+    paths = list(paths)
+    simple = [isinstance(p, str) and _not_simple_re.search(p) is None
+              for p in paths]
+    simple_paths = [p for p, is_simple in zip(paths, simple) if is_simple]
+    parsed = _parse_simple_paths(simple_paths)
+    if parsed is None:
+        # e.g. an odd number of coordinates somewhere; take the long way
+        simple = [False] * len(paths)
+    elif all(simple):
+        return parsed
+    pieces = []
+    ring_lengths = []
+    rings_per_region = []
+    if parsed is not None:
+        coords, ring_offsets, region_offsets = parsed
+        simple_ring_lengths = np.diff(ring_offsets)
+    k = 0
+    for path, is_simple in zip(paths, simple):
+        if is_simple:
+            first, last = region_offsets[k], region_offsets[k+1]
+            pieces.append(coords[ring_offsets[first]:ring_offsets[last]])
+            ring_lengths.extend(simple_ring_lengths[first:last])
+            rings_per_region.append(last - first)
+            k += 1
+            continue
+        rings = parse_path(path) if isinstance(path, str) else []
+        pieces.extend(rings)
+        ring_lengths.extend(len(ring) for ring in rings)
+        rings_per_region.append(len(rings))
+    if len(pieces) > 0:
+        coords = np.concatenate(pieces).reshape(-1, 2)
+    else:
+        coords = np.zeros((0, 2))
+    ring_offsets = np.concatenate([[0], np.cumsum(ring_lengths, 
+                                   dtype=np.int64)]).astype(np.int64)
+    region_offsets = np.concatenate([[0], np.cumsum(rings_per_region,
+                                     dtype=np.int64)]).astype(np.int64)
+    return coords, ring_offsets, region_offsets
+
+def _parse_simple_paths(paths):
+    """parse_paths for paths of M, L, C and Z commands only; returns None
+       if they are not well formed enough for the shortcut"""
+    text = '|'.join(paths) + '|'
+    chars = np.frombuffer(text.encode('ascii'), dtype=np.uint8)
+    is_number = _number_chars[chars]
+    # a number starts wherever a number character follows anything else
+    # (a sign after an exponent's e doesn't: e is a number character)
+    number_starts = is_number & ~np.r_[False, is_number[:-1]]
+    try:
+        numbers = np.fromstring(text.translate(_to_spaces), sep=' ')
+    except ValueError:
+        # numbers run together, e.g. 1.5-2.5
+        return None
+    if len(numbers) != number_starts.sum():
+        return None
+    is_command = _command_chars[chars]
+    # how many numbers come before each command
+    numbers_before = np.cumsum(number_starts)[is_command]
+    commands = chars[is_command]
+    lower = commands | 0x20
+    relative = (commands != _END) & (commands == lower)
+    is_moveto = lower == ord('m')
+    is_curve = lower == ord('c')
+    is_close = lower == ord('z')
+    n_numbers = np.diff(np.append(numbers_before, len(numbers)))
+    if (len(numbers) % 2 == 1 or (numbers_before % 2 == 1).any() or
+            (n_numbers[is_close | (commands == _END)] != 0).any()):
+        return None
+    following = np.append(lower[1:], _END)
+    # a lineto or curve straight after a closepath starts a ring without a
+    # moveto
+    if (is_close & (following != ord('m')) & (following != ord('z')) &
+            (following != _END)).any():
+        return None
+    # every path must start with a moveto (or be empty)
+    starts = np.r_[True, commands[:-1] == _END]
+    if (starts & ~is_moveto & (commands != _END)).any():
+        return None
+    # only a curve's end point is a vertex, not its two control points
+    # (nor, as in parse_path, the points of an incomplete last curve)
+    pairs = numbers.reshape(-1, 2)
+    pairs_before = numbers_before // 2
+    command_of_pair = np.searchsorted(pairs_before, np.arange(len(pairs)),
+                                      side='right') - 1
+    is_vertex = ~is_curve[command_of_pair] | ((np.arange(len(pairs)) - 
+        pairs_before[command_of_pair]) % 3 == 2)
+    coords = pairs[is_vertex]
+    vertices_before = np.r_[0, np.cumsum(is_vertex)][pairs_before]
+    # rings start at each moveto and end at the next moveto, closepath or
+    # end of path; a closepath's end is the next ring's start, so only
+    # empty stretches between them need dropping
+    ring_starts = vertices_before[is_moveto]
+    bounds = vertices_before[is_moveto | is_close | (commands == _END)]
+    ring_ends = bounds[np.searchsorted(bounds, ring_starts, side='right')]
+    keep = ring_ends > ring_starts
+    contiguous = (len(ring_starts) > 0 and ring_starts[0] == 0 and
+                  ring_ends[-1] == len(coords) and
+                  (ring_starts[1:] == ring_ends[:-1]).all())
+    if relative.any():
+        if not (keep.all() and contiguous):
+            return None
+        coords = _absolute_coords(coords, relative[command_of_pair[
+            is_vertex]], ring_starts, np.r_[False, is_close][:-1][is_moveto],
+            starts[is_moveto])
+    ring_starts, ring_ends = ring_starts[keep], ring_ends[keep]
+    region_of_ring = np.cumsum(commands == _END)[is_moveto][keep]
+    if not contiguous:
+        # some vertices belong to no ring
+        coords = np.concatenate([np.zeros((0, 2))] + 
+                                [coords[a:b] for a, b in 
+                                 zip(ring_starts, ring_ends)])
+    ring_offsets = np.concatenate([[0], np.cumsum(ring_ends - ring_starts)]
+                                  ).astype(np.int64)
+    region_offsets = np.searchsorted(region_of_ring, 
+                                     np.arange(len(paths) + 1)
+                                     ).astype(np.int64)
+    return coords, ring_offsets, region_offsets
+
+def _absolute_coords(coords, relative, ring_starts, after_close, 
+                     path_starts):
+    """Makes the relative vertices of _parse_simple_paths absolute, adding
+       up each stretch of relative vertices from the point before it in
+       the same order as parse_path, so the sums come out the same. A
+       ring's relative moveto is from the origin at the start of a path,
+       from the previous ring's start after a closepath, and otherwise
+       from the last vertex."""
+    coords = coords.copy()
+    is_ring_start = np.zeros(len(coords), dtype=bool)
+    is_ring_start[ring_starts] = True
+    ring_of_vertex = np.cumsum(is_ring_start) - 1
+    stretch_starts = relative & (is_ring_start | ~np.r_[True, relative[:-1]])
+    stretch_ends = relative & (np.r_[is_ring_start[1:], True] | 
+                               ~np.r_[relative[1:], False])
+    for a, b in zip(np.nonzero(stretch_starts)[0].tolist(),
+                    (np.nonzero(stretch_ends)[0] + 1).tolist()):
+        ring = ring_of_vertex[a]
+        if not is_ring_start[a]:
+            point = coords[a - 1]
+        elif path_starts[ring]:
+            point = np.zeros(2)
+        elif after_close[ring]:
+            point = coords[ring_starts[ring - 1]]
+        else:
+            point = coords[a - 1]
+        coords[a:b] = np.cumsum(np.vstack([point, coords[a:b]]), axis=0)[1:]
+    return coords
+
+
+class Geometry(object):
+    """ Flat, array-based outlines of every region of a database,
+        instantiated with:
+            ids: a listlike object of region ids
+            rings: a list with one entry per region, each a list of (n, 2)
+                   coordinate arrays (see parse_path)
+
+        attributes:
+        .ids : list of ids, in database order
+        .coords : (n_vertices, 2) array of every vertex
+        .ring_offsets : ring k is coords[ring_offsets[k]:ring_offsets[k+1]]
+        .region_offsets : region i owns rings
+                          region_offsets[i] to region_offsets[i+1]
+        .bboxes : (n_regions, 4) array of xmin, ymin, xmax, ymax
+
+        methods:
+        .from_paths(ids, paths): build from svg path strings, parsed in
+            bulk by parse_paths
+        .from_arrays(ids, coords, ring_offsets, region_offsets): build
+            from flat arrays
+        .from_database(csv_path, id_column, path_column): build from a
+            database csv; cached, so this is only parsed once per file
+        .rings(i): list of coordinate arrays for region i
+        .contains(i, points): which of an (n, 2) array of points are in
+            region i (even-odd rule)
+        .translated(dx, dy, scale): a scaled and shifted copy
+        .label_anchors(precision): a good label position for every region
+            (pole of inaccessibility)
+        .centroids(): area-weighted center of every region
+    """
+    def __init__(self, ids, rings):
+        self.ids = list(ids)
+        ring_lengths = []
+        region_offsets = [0]
+        flat = []
+        for region in rings:
+            for ring in region:
+                ring_lengths.append(len(ring))
+                flat.append(ring)
+            region_offsets.append(len(ring_lengths))
+        if len(flat) > 0:
+            self.coords = np.concatenate(flat).reshape(-1, 2)
+        else:
+            self.coords = np.zeros((0, 2))
+        self.ring_offsets = np.concatenate([[0], np.cumsum(ring_lengths,
+                                            dtype=np.int64)]).astype(np.int64)
+        self.region_offsets = np.array(region_offsets, dtype=np.int64)
+        self._calc_bboxes()
+
+    def _calc_bboxes(self):
+        vertex_starts = self.ring_offsets[self.region_offsets]
+        self.bboxes = np.full((len(self.ids), 4), np.nan)
+        has_vertices = vertex_starts[:-1] < vertex_starts[1:]
+        starts = vertex_starts[:-1][has_vertices]
+        if len(starts) > 0:
+            self.bboxes[has_vertices, 0] = np.minimum.reduceat(
+                self.coords[:, 0], starts)
+            self.bboxes[has_vertices, 1] = np.minimum.reduceat(
+                self.coords[:, 1], starts)
+            self.bboxes[has_vertices, 2] = np.maximum.reduceat(
+                self.coords[:, 0], starts)
+            self.bboxes[has_vertices, 3] = np.maximum.reduceat(
+                self.coords[:, 1], starts)
+
+    @classmethod
+    def from_arrays(cls, ids, coords, ring_offsets, region_offsets):
+        """Builds a geometry from flat arrays, e.g. those of parse_paths"""
+        geometry = object.__new__(cls)
+        geometry.ids = list(ids)
+        geometry.coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        geometry.ring_offsets = np.asarray(ring_offsets, dtype=np.int64)
+        geometry.region_offsets = np.asarray(region_offsets, dtype=np.int64)
+        geometry._calc_bboxes()
+        return geometry
+
+    @classmethod
+    def from_paths(cls, ids, paths):
+        return cls.from_arrays(ids, *parse_paths(paths))
+
+    @classmethod
+    def from_database(cls, csv_path, id_column='abbrev',
+                      path_column='map_path'):
+        key = (os.path.abspath(csv_path), os.path.getmtime(csv_path),
+               id_column, path_column)
+        if key not in _cache:
+            df = pd.read_csv(csv_path)
+            _cache[key] = cls.from_paths(df[id_column], df[path_column])
+        return _cache[key]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rings(self, i):
+        """Returns the list of coordinate arrays of region i"""
+        return [self.coords[self.ring_offsets[k]:self.ring_offsets[k+1]]
+                for k in range(self.region_offsets[i],
+                               self.region_offsets[i+1])]
+
+    def contains(self, i, points):
+        """Returns a boolean array, True for each of an (n, 2) array of
+           points lying inside region i, using the even-odd rule"""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        px = points[:, 0][np.newaxis, :]
+        py = points[:, 1][np.newaxis, :]
+        inside = np.zeros(len(points), dtype=bool)
+        for ring in self.rings(i):
+            x1 = ring[:, 0][:, np.newaxis]
+            y1 = ring[:, 1][:, np.newaxis]
+            x2 = np.roll(ring[:, 0], -1)[:, np.newaxis]
+            y2 = np.roll(ring[:, 1], -1)[:, np.newaxis]
+            straddles = (y1 > py) != (y2 > py)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x_cross = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+            crossings = np.sum(straddles & (px < x_cross), axis=0)
+            inside ^= (crossings % 2 == 1)
+        return inside
+
+    def translated(self, dx, dy, scale=1.):
+        """Returns a copy of this geometry scaled by scale, then shifted by
+           dx, dy"""
+        other = object.__new__(type(self))
+        other.ids = self.ids
+        other.coords = self.coords * scale + np.array([dx, dy])
+        other.ring_offsets = self.ring_offsets
+        other.region_offsets = self.region_offsets
+        other.bboxes = self.bboxes * scale + np.array([dx, dy, dx, dy])
+        return other
+
+    def edges(self, i):
+        """Returns x1, y1, x2, y2 arrays of every edge of region i"""
+        rings = self.rings(i)
+        if len(rings) == 0:
+            return [np.zeros(0)] * 4
+        starts = np.concatenate(rings)
+        ends = np.concatenate([np.roll(ring, -1, axis=0) for ring in rings])
+        return starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]
+
+    def signed_distance(self, i, points):
+        """Returns the distance from each of an (n, 2) array of points to
+           the outline of region i, positive inside and negative outside"""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        x1, y1, x2, y2 = [e[:, np.newaxis] for e in self.edges(i)]
+        px = points[:, 0][np.newaxis, :]
+        py = points[:, 1][np.newaxis, :]
+        dx, dy = x2 - x1, y2 - y1
+        length2 = dx * dx + dy * dy
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = ((px - x1) * dx + (py - y1) * dy) / length2
+        t = np.clip(np.nan_to_num(t), 0, 1)
+        dist2 = (x1 + t * dx - px) ** 2 + (y1 + t * dy - py) ** 2
+        dist = np.sqrt(dist2.min(axis=0))
+        return np.where(self.contains(i, points), dist, -dist)
+
+    def _polylabel(self, i, precision):
+        """Pole of inaccessibility of region i: the interior point farthest
+           from the outline, found by subdividing the bounding box into
+           ever smaller cells and discarding those that cannot beat the
+           best point found so far (after Mapbox's polylabel). Every
+           surviving cell of a generation is evaluated in one NumPy call."""
+        xmin, ymin, xmax, ymax = self.bboxes[i]
+        size = min(xmax - xmin, ymax - ymin)
+        if np.isnan(size):
+            return np.nan, np.nan
+        if size <= 0:
+            return (xmin + xmax) / 2, (ymin + ymax) / 2
+        h = size / 2
+        xs = np.arange(xmin, xmax, size) + h
+        ys = np.arange(ymin, ymax, size) + h
+        centers = np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 2)
+        # start from the bounding-box center
+        best = np.array([(xmin + xmax) / 2, (ymin + ymax) / 2])
+        best_d = self.signed_distance(i, [best])[0]
+        while len(centers) > 0:
+            d = self.signed_distance(i, centers)
+            top = np.argmax(d)
+            if d[top] > best_d:
+                best, best_d = centers[top], d[top]
+            # the most any point in a cell could score
+            potential = d + h * sqrt(2)
+            centers = centers[potential - best_d > precision]
+            if len(centers) == 0 or h <= precision / 4:
+                break
+            h /= 2
+            centers = (centers[:, np.newaxis, :] + 
+                       np.array([[-h, -h], [h, -h], [-h, h], [h, h]])
+                       ).reshape(-1, 2)
+        return best[0], best[1]
+
+    def label_anchors(self, precision=0.5):
+        """Returns an (n_regions, 2) array with, for each region, the point
+           inside it farthest from its outline, to within precision; this
+           is where a label fits best. NaN for regions without a path."""
+        anchors = np.full((len(self.ids), 2), np.nan)
+        for i in range(len(self.ids)):
+            anchors[i] = self._polylabel(i, precision)
+        return anchors
+
+    def centroids(self):
+        """Returns an (n_regions, 2) array of the area-weighted centroid of
+           each region (the centre of its bounding box if it has no area).
+           All rings count positively, so islands are included."""
+        coords = self.coords
+        n_rings = len(self.ring_offsets) - 1
+        ring_of_vertex = np.repeat(np.arange(n_rings), 
+                                   np.diff(self.ring_offsets))
+        following = np.arange(len(coords)) + 1
+        ends = self.ring_offsets[1:] - 1
+        nonempty = self.ring_offsets[:-1] <= ends
+        following[ends[nonempty]] = self.ring_offsets[:-1][nonempty]
+        x, y = coords[:, 0], coords[:, 1]
+        x2, y2 = x[following], y[following]
+        cross = x * y2 - x2 * y
+        ring_area = np.bincount(ring_of_vertex, cross, n_rings) / 2
+        ring_cx = np.bincount(ring_of_vertex, (x + x2) * cross, n_rings)
+        ring_cy = np.bincount(ring_of_vertex, (y + y2) * cross, n_rings)
+        # make every ring count positively
+        sign = np.where(ring_area < 0, -1, 1)
+        region_of_ring = np.repeat(np.arange(len(self.ids)),
+                                   np.diff(self.region_offsets))
+        area = np.bincount(region_of_ring, ring_area * sign, len(self.ids))
+        cx = np.bincount(region_of_ring, ring_cx * sign, len(self.ids))
+        cy = np.bincount(region_of_ring, ring_cy * sign, len(self.ids))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = np.stack([cx, cy], axis=1) / (6 * area[:, np.newaxis])
+        no_area = ~(area > 0)
+        result[no_area, 0] = (self.bboxes[no_area, 0] + 
+                              self.bboxes[no_area, 2]) / 2
+        result[no_area, 1] = (self.bboxes[no_area, 1] + 
+                              self.bboxes[no_area, 3]) / 2
+        return result
@@ -0,0 +1,290 @@
+#!/usr/bin/python
+# Filename: Gridcartogram.py
+
+import numpy as np
+import pandas as pd
+from math import sqrt, ceil
+from chorogrid.Adjacency import Adjacency
+from chorogrid.Geometry import Geometry
+from chorogrid.Hexgrid import offset_to_axial
+
+class Gridcartogram(object):
+    """ Generates a new square or hex grid layout for a database from its
+        map paths: every region gets its own cell, as close as possible to
+        where its centroid falls. Instantiated with:
+            csv_path: the path to a database csv with a path column
+            id_column: the name of the column containing ids
+            path_column: the column with the svg paths of the regions
+            grid: 'square' or 'hex' ('hex' is the 'true rows' layout used
+                  by Chorogrid.draw_hex)
+            spare: ratio of grid cells to regions; more spare cells leave
+                   more room to keep regions near their real positions
+            evenness: between 0 and 1, how much centroids are spread out
+                      by their rank along each axis rather than placed by
+                      their position, so that crowded areas such as the
+                      Northeast's counties don't all want the same cells
+            radius, candidates: each region first bids only for the
+                    nearest candidates cells within radius cells of its
+                    position; the window doubles (and four times as many
+                    cells are considered) for any region crowded out of it
+            adjacency_weight: how much keeping two bordering regions in
+                              neighbouring cells is worth, in squared cell
+                              widths of distance from where they belong;
+                              0 to place by position only
+
+        Regions are assigned to cells by an auction algorithm minimising
+        total squared distance. Then regions are moved to free cells, or
+        swapped, next to the regions they border (see Adjacency) wherever
+        that gains more in neighbours kept, times adjacency_weight, than
+        it costs in squared distance.
+
+        attributes:
+        .x, .y : integer grid coordinates, one per database row
+        .ids : the ids, in database order
+        .adjacency : the Adjacency of the regions
+
+        methods:
+        .adjacency_kept(): the share of bordering regions put in
+            neighbouring cells
+        .add_columns(df, prefix): add prefix_x and prefix_y columns to a
+            dataframe of the database
+        .to_csv(save_filename, prefix): write the database with the new
+            columns, ready for draw_squares/draw_hex(x_column=prefix+'_x',
+            y_column=prefix+'_y')
+    """
+    def __init__(self, csv_path, id_column='abbrev', path_column='map_path',
+                 grid='square', spare=1.5, evenness=0.75, radius=2, candidates=8,
+                 adjacency_weight=2.):
+        assert grid in ('square', 'hex'), "grid must be 'square' or 'hex'"
+        self.csv_path = csv_path
+        self.grid = grid
+        self.geometry = Geometry.from_database(csv_path, id_column,
+                                               path_column)
+        self.ids = self.geometry.ids
+        centroids = self.geometry.centroids()
+        self._make_cells(centroids, spare)
+        self._target = self._even_out(centroids, evenness)
+        self.radius = radius
+        self.candidates = candidates
+        self.adjacency = Adjacency.from_database(csv_path, id_column,
+                                                 path_column)
+        assigned = self._assign(radius)
+        if adjacency_weight > 0:
+            assigned = self._keep_neighbours(assigned, adjacency_weight)
+        self._place(assigned)
+
+    def _make_cells(self, centroids, spare):
+        """Makes a grid of cells with about the same aspect ratio as the
+           map; self.cell_xy are their centres, in units of cell width"""
+        n = len(self.ids)
+        width = np.ptp(centroids[:, 0]) or 1.
+        height = np.ptp(centroids[:, 1]) or 1.
+        if self.grid == 'hex':
+            # rows of hexes are sqrt(3)/2 of a width apart
+            height = height / (sqrt(3) / 2)
+        self.n_columns = max(1, int(ceil(sqrt(n * spare * width / height))))
+        self.n_rows = max(1, int(ceil(n * spare / self.n_columns)))
+        col, row = np.meshgrid(np.arange(self.n_columns),
+                               np.arange(self.n_rows))
+        self.cell_col, self.cell_row = col.ravel(), row.ravel()
+        if self.grid == 'hex':
+            self.cell_xy = np.stack([self.cell_col + 0.5 * (self.cell_row % 2),
+                                     self.cell_row * sqrt(3) / 2], axis=1)
+        else:
+            self.cell_xy = np.stack([self.cell_col, self.cell_row],
+                                    axis=1).astype(float)
+
+    def _even_out(self, centroids, evenness):
+        """Spreads centroids over the grid's extent, partly by their 
+           position and partly by their rank along each axis"""
+        target = np.empty_like(centroids)
+        extent = self.cell_xy.max(axis=0)
+        for axis in (0, 1):
+            values = centroids[:, axis]
+            span = np.ptp(values) or 1.
+            linear = (values - values.min()) / span
+            ranks = np.argsort(np.argsort(values, kind='stable'))
+            ranked = ranks / max(len(values) - 1, 1)
+            target[:, axis] = ((1 - evenness) * linear + 
+                               evenness * ranked) * extent[axis]
+        return target
+
+    def _candidates(self, i, radius):
+        """Cell indices within radius cells of region i's target, and
+           the (negative squared distance) benefit of each"""
+        tx, ty = self._target[i]
+        row_step = sqrt(3) / 2 if self.grid == 'hex' else 1.
+        row = int(round(ty / row_step))
+        col = int(round(tx))
+        rows = np.arange(max(row - radius, 0),
+                         min(row + radius + 1, self.n_rows))
+        cols = np.arange(max(col - radius - 1, 0),
+                         min(col + radius + 2, self.n_columns))
+        cells = (rows[:, np.newaxis] * self.n_columns + cols).ravel()
+        d = self.cell_xy[cells] - self._target[i]
+        benefits = -(d * d).sum(axis=1)
+        # only the nearest ones, to keep bidding cheap
+        n = self.candidates * (radius // self.radius) ** 2
+        nearest = np.argsort(-benefits)[:n]
+        return list(cells[nearest]), list(benefits[nearest])
+
+    def _assign(self, radius):
+        """Gauss-Seidel auction with epsilon scaling: unassigned regions bid
+           for their best candidate cell, raising its price by how much
+           they prefer it to their second choice (plus epsilon), until
+           every region has a cell. Coarse rounds with a big epsilon settle
+           crowded areas quickly; the prices they leave are kept for the
+           finer rounds, which then only need to make small corrections."""
+        n = len(self.ids)
+        prices = [0.] * len(self.cell_xy)
+        radii = [radius] * n
+        candidates = [self._candidates(i, radius) for i in range(n)]
+        # a region whose best cell costs more than this is crowded out of
+        # its window, which is then made bigger
+        too_dear = float(radius * radius)
+        for epsilon in (1., 0.1, 0.01):
+            owner = [-1] * len(self.cell_xy)
+            assigned = [-1] * n
+            unassigned = list(range(n - 1, -1, -1))
+            while len(unassigned) > 0:
+                i = unassigned.pop()
+                cells, benefits = candidates[i]
+                best_j, best_v, second_v = -1, -np.inf, -np.inf
+                for j, b in zip(cells, benefits):
+                    v = b - prices[j]
+                    if v > best_v:
+                        best_j, best_v, second_v = j, v, best_v
+                    elif v > second_v:
+                        second_v = v
+                if -best_v > too_dear * (radii[i] / radius) ** 2:
+                    radii[i] *= 2
+                    candidates[i] = self._candidates(i, radii[i])
+                    unassigned.append(i)
+                    continue
+                if second_v == -np.inf:
+                    second_v = best_v
+                prices[best_j] += best_v - second_v + epsilon
+                previous = owner[best_j]
+                owner[best_j] = i
+                assigned[i] = best_j
+                if previous >= 0:
+                    assigned[previous] = -1
+                    unassigned.append(previous)
+        return np.array(assigned)
+
+    def _cell_neighbours(self):
+        """Returns a list of the set of cells next to each cell"""
+        if self.grid == 'hex':
+            q, r = offset_to_axial(self.cell_col, self.cell_row)
+            steps = [(1, 0), (1, -1), (0, -1), (-1, 0), (-1, 1), (0, 1)]
+        else:
+            q, r = self.cell_col, self.cell_row
+            steps = [(1, 0), (0, -1), (-1, 0), (0, 1)]
+        cell_of = {(a, b): k for k, (a, b) in 
+                   enumerate(zip(q.tolist(), r.tolist()))}
+        return [set(cell_of[a + da, b + db] for da, db in steps 
+                    if (a + da, b + db) in cell_of)
+                for a, b in zip(q.tolist(), r.tolist())]
+
+    def _keep_neighbours(self, assigned, weight):
+        """Local search after the auction: moves each region to a free 
+           cell, or swaps it with the region in a cell, next to the cells
+           of the regions it borders, whenever weight times the change in
+           bordering pairs in neighbouring cells outweighs the change in
+           squared distance from the regions' targets; until no move
+           helps"""
+        n = len(self.ids)
+        cell_neighbours = self._cell_neighbours()
+        borders = [self.adjacency.neighbour_indices(i).tolist() 
+                   for i in range(n)]
+        cell = assigned.tolist()
+        owner = [-1] * len(self.cell_xy)
+        for i, c in enumerate(cell):
+            owner[c] = i
+        cell_xy = self.cell_xy.tolist()
+        target = self._target.tolist()
+        def cost(i, c):
+            dx = cell_xy[c][0] - target[i][0]
+            dy = cell_xy[c][1] - target[i][1]
+            return dx * dx + dy * dy
+        def kept(i, c, other):
+            # bordering regions of i, bar other, next to cell c
+            near = cell_neighbours[c]
+            return sum(1 for j in borders[i] if j != other and 
+                       cell[j] in near)
+        for _ in range(20):
+            moved = False
+            for i in range(n):
+                here = cell[i]
+                options = set()
+                for j in borders[i]:
+                    options.update(cell_neighbours[cell[j]])
+                options.discard(here)
+                best, best_gain = -1, 1e-9
+                for c in options:
+                    other = owner[c]
+                    gain = (weight * (kept(i, c, other) - 
+                                      kept(i, here, other)) -
+                            cost(i, c) + cost(i, here))
+                    if other >= 0:
+                        gain += (weight * (kept(other, here, i) - 
+                                           kept(other, c, i)) -
+                                 cost(other, here) + cost(other, c))
+                    if gain > best_gain:
+                        best, best_gain = c, gain
+                if best >= 0:
+                    other = owner[best]
+                    owner[here], owner[best] = other, i
+                    cell[i] = best
+                    if other >= 0:
+                        cell[other] = here
+                    moved = True
+            if not moved:
+                break
+        return np.array(cell)
+
+    def _place(self, assigned):
+        """Sets x and y from the cell of each region"""
+        col = self.cell_col[assigned]
+        row = self.cell_row[assigned]
+        # trim empty margins; hex rows only by an even number, which keeps
+        # the odd rows offset to the east
+        row_shift = row.min()
+        if self.grid == 'hex':
+            row_shift -= row_shift % 2
+        self.x = col - col.min()
+        self.y = row - row_shift
+
+    def adjacency_kept(self):
+        """Returns the share of pairs of bordering regions that are in
+           neighbouring cells"""
+        if self.grid == 'hex':
+            q, r = offset_to_axial(self.x, self.y)
+        else:
+            q, r = np.asarray(self.x), np.asarray(self.y)
+        rows = np.repeat(np.arange(len(self.ids)), self.adjacency.degrees())
+        cols = self.adjacency.indices
+        if len(rows) == 0:
+            return 1.
+        dq, dr = q[rows] - q[cols], r[rows] - r[cols]
+        if self.grid == 'hex':
+            steps = (np.abs(dq) + np.abs(dr) + np.abs(dq + dr)) // 2
+        else:
+            steps = np.abs(dq) + np.abs(dr)
+        return float(np.mean(steps == 1))
+
+    def add_columns(self, df, prefix=None):
+        """Adds prefix_x and prefix_y columns to df (a dataframe of the
+           database, in the same row order); prefix defaults to
+           'gen' + grid, e.g. 'gensquare'"""
+        if prefix is None:
+            prefix = 'gen' + self.grid
+        df[prefix + '_x'] = self.x
+        df[prefix + '_y'] = self.y
+        return df
+
+    def to_csv(self, save_filename, prefix=None):
+        """Writes the database, with the new layout columns added, to
+           save_filename"""
+        df = self.add_columns(pd.read_csv(self.csv_path), prefix)
+        df.to_csv(save_filename, index=False)
@@ -0,0 +1,280 @@
+#!/usr/bin/python
+# Filename: Hexgrid.py
+
+import os
+import numpy as np
+import pandas as pd
+from math import sqrt
+
+_cache = {}
+
+# the six neighbours of a cell in axial coordinates (q, r): east, northeast,
+# northwest, west, southwest, southeast with true rows; with true columns,
+# southeast, northeast, north, northwest, southwest, south
+DIRECTIONS = np.array([[1, 0], [1, -1], [0, -1], [-1, 0], [-1, 1], [0, 1]])
+
+# the steps of a multihex contour (see Chorogrid.draw_multihex), in cell
+# widths and in h = width / sqrt(3); capital letters are the same moves
+# without drawing
+MULTIHEX_STEPS = {'a': (0.5, -0.5), 'b': (0.5, 0.5), 'c': (0, 1),
+                  'd': (-0.5, 0.5), 'e': (-0.5, -0.5), 'f': (0, -1)}
+
+def offset_to_axial(x, y, true_rows=True):
+    """Returns arrays q, r of the axial coordinates of cells given by their
+       column x and row y, as in the databases' hex_x and hex_y columns.
+       With true rows, odd rows are shifted east; with true columns, odd
+       columns are shifted south. The third cube coordinate is -q - r."""
+    x = np.asarray(x).astype(np.int64)
+    y = np.asarray(y).astype(np.int64)
+    if true_rows:
+        return x - (y - (y & 1)) // 2, y
+    return x, y - (x - (x & 1)) // 2
+
+def axial_to_offset(q, r, true_rows=True):
+    """Returns arrays x, y of the columns and rows of cells given by their
+       axial coordinates; the inverse of offset_to_axial"""
+    q = np.asarray(q).astype(np.int64)
+    r = np.asarray(r).astype(np.int64)
+    if true_rows:
+        return q + (r - (r & 1)) // 2, r
+    return q, r + (q - (q & 1)) // 2
+
+def hex_ring(q, r, radius):
+    """Returns an (n, 2) array of the axial coordinates of the cells at
+       exactly radius steps from (q, r), in order around the ring"""
+    if radius == 0:
+        return np.array([[q, r]])
+    steps = np.repeat(DIRECTIONS, radius, axis=0)
+    start = np.array([q, r]) + DIRECTIONS[4] * radius
+    return start + np.cumsum(steps, axis=0) - steps
+
+def hex_origins(x, y, w, gutter=0, margin_left=0, margin_top=0,
+                true_rows=True):
+    """Returns lists of the x and y of the corner each cell's hexagon is
+       drawn from by draw_hex with cell width w, for columns x and rows y.
+       The numbers are those draw_hex computes, integers included, so its
+       svg is unchanged."""
+    x, y = np.asarray(x), np.asarray(y)
+    if true_rows:
+        # odd rows are offset to the right
+        odd = y % 2 == 1
+        xs = np.empty(len(x), dtype=object)
+        xs[~odd] = (margin_left + 0 + x[~odd] * (w + gutter)).tolist()
+        xs[odd] = (margin_left + w/2 + x[odd] * (w + gutter)).tolist()
+        ys = margin_top + y * (1.5 * w / sqrt(3) + gutter)
+    else:
+        # the northwest corner is to the east of the westmost point;
+        # odd columns are offset down
+        xs = margin_left + 0.25 * w + x * 0.75 * (w + gutter)
+        ys = np.where(x % 2 == 1, margin_top + w*0.866/2, margin_top
+                      + 0.) + y * (sqrt(3) / 2 * w + gutter)
+    return list(np.asarray(xs).tolist()), list(np.asarray(ys).tolist())
+
+def multihex_contour(x, y):
+    """Returns x, y, contour for draw_multihex: the cell to start at (the
+       westmost of the top row) and the letters of the outline of the
+       given cells (true rows, as fourhex_x and fourhex_y), clockwise from
+       that cell's upper left corner. The cells must make one piece
+       without holes."""
+    x = np.asarray(x).astype(np.int64)
+    y = np.asarray(y).astype(np.int64)
+    # corners in half cell widths and half h, clockwise from upper left
+    corners = np.array([[0, 0], [1, -1], [2, 0], [2, 2], [1, 3], [0, 2]])
+    origins = np.stack([2 * x + (y & 1), 3 * y], axis=1)
+    starts = (origins[:, np.newaxis, :] + corners).reshape(-1, 2)
+    ends = (origins[:, np.newaxis, :] + np.roll(corners, -1, axis=0)
+            ).reshape(-1, 2)
+    letters = np.tile(list('abcdef'), len(x))
+    # an edge shared by two cells is walked both ways; the outline isn't
+    start_keys = [tuple(p) for p in starts.tolist()]
+    end_keys = [tuple(p) for p in ends.tolist()]
+    shared = set(zip(end_keys, start_keys))
+    outline = {}
+    for start, end, letter in zip(start_keys, end_keys, letters):
+        if (start, end) not in shared:
+            assert start not in outline, ("cells must make one piece"
+                                          " without holes")
+            outline[start] = (end, letter)
+    first = np.lexsort((x, y))[0]
+    vertex = tuple(origins[first].tolist())
+    contour = []
+    while True:
+        vertex, letter = outline[vertex]
+        contour.append(letter)
+        if vertex == tuple(origins[first].tolist()):
+            break
+    assert len(contour) == len(outline), ("cells must make one piece"
+                                          " without holes")
+    return int(x[first]), int(y[first]), ''.join(contour)
+
+class Hexgrid(object):
+    """ The cells of a hexagonal grid layout in cube/axial coordinates,
+        converted in bulk from the column and row numbers of a database
+        (hex_x and hex_y, althex_x and althex_y, truecolhex_x and
+        truecolhex_y), for neighbour, distance, ring and flood fill
+        queries on whole arrays at once. Instantiated with:
+            x, y: listlike objects of column and row numbers
+            true_rows: True for layouts in true rows (odd rows shifted
+                       east), False for true columns (odd columns shifted
+                       south); see Chorogrid.draw_hex
+            ids: listlike object of the cells' ids, by default 0, 1, ...
+
+        Where two cells share a position, the one drawn last (i.e. on top)
+        is the one found there.
+
+        attributes:
+        .q, .r : arrays of axial coordinates; the cube coordinates are
+                 q, r and -q - r
+
+        methods:
+        .from_database(csv_path, x_column, y_column, true_rows, id_column):
+            a cached Hexgrid of a database's layout
+        .cube(): (n, 3) array of cube coordinates
+        .find(q, r): index of the cell at each axial position (-1 if none)
+        .neighbour_table(): (n, 6) array of every cell's neighbours, in the
+                            order of DIRECTIONS (-1 where there is none)
+        .neighbour_indices(i): array of the cells next to cell i
+        .neighbours(id_): list of the ids next to id_
+        .distance(i, j): number of steps between cells i and j
+        .distances(i): number of steps from cell i to every cell
+        .ring(i, radius): the cells exactly radius steps from cell i
+        .flood_fill(starts, max_steps, mask): steps from the start cells
+            to every cell reachable through neighbouring cells
+        .components(): a piece number for every cell
+        .duplicates(): indices of cells at the position of another
+        .origins(w, gutter, margin_left, margin_top): where draw_hex puts
+            each cell
+    """
+    def __init__(self, x, y, true_rows=True, ids=None):
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        assert len(self.x) == len(self.y), "x and y must be the same length"
+        self.true_rows = true_rows
+        if ids is None:
+            ids = np.arange(len(self.x))
+        self.ids = np.asarray(ids)
+        self.q, self.r = offset_to_axial(self.x, self.y, true_rows)
+        self._positions = {id_: i for i, id_ in enumerate(self.ids.tolist())}
+        # sorted position keys for lookups; the stable sort puts the last
+        # drawn of any duplicates last, where find() looks
+        self._qmin = self.q.min() - 1 if len(self.q) else 0
+        self._rmin = self.r.min() - 1 if len(self.r) else 0
+        self._span = (self.r.max() - self._rmin + 2) if len(self.r) else 1
+        keys = self._keys(self.q, self.r)
+        self._order = np.argsort(keys, kind='stable')
+        self._sorted_keys = keys[self._order]
+
+    @classmethod
+    def from_database(cls, csv_path, x_column='hex_x', y_column='hex_y',
+                      true_rows=True, id_column='abbrev'):
+        key = (os.path.abspath(csv_path), os.path.getmtime(csv_path),
+               x_column, y_column, true_rows, id_column)
+        if key not in _cache:
+            df = pd.read_csv(csv_path, usecols=[id_column, x_column,
+                                                y_column])
+            _cache[key] = cls(df[x_column].values, df[y_column].values,
+                              true_rows, df[id_column].values)
+        return _cache[key]
+
+    def __len__(self):
+        return len(self.q)
+
+    def _keys(self, q, r):
+        """One integer per position; positions just outside the layout
+           get keys no cell has"""
+        q = np.clip(q - self._qmin, 0, None)
+        r = np.clip(r - self._rmin, 0, self._span - 1)
+        return q * self._span + r
+
+    def cube(self):
+        return np.stack([self.q, self.r, -self.q - self.r], axis=1)
+
+    def find(self, q, r):
+        """Returns the index of the cell at each axial position (q, r), or
+           -1 where there is no cell"""
+        keys = self._keys(np.asarray(q), np.asarray(r))
+        if len(self._sorted_keys) == 0:
+            return np.full(keys.shape, -1)
+        found = np.searchsorted(self._sorted_keys, keys, side='right') - 1
+        found = np.clip(found, 0, None)
+        hit = self._sorted_keys[found] == keys
+        return np.where(hit, self._order[found], -1)
+
+    def neighbour_table(self):
+        q = self.q[:, np.newaxis] + DIRECTIONS[:, 0]
+        r = self.r[:, np.newaxis] + DIRECTIONS[:, 1]
+        return self.find(q, r)
+
+    def neighbour_indices(self, i):
+        table = self.find(self.q[i] + DIRECTIONS[:, 0],
+                          self.r[i] + DIRECTIONS[:, 1])
+        return table[table >= 0]
+
+    def neighbours(self, id_):
+        return self.ids[self.neighbour_indices(self._positions[id_])].tolist()
+
+    def distance(self, i, j):
+        """Number of steps between cells i and j (arrays of indices, or
+           single indices), whether or not the cells between are in the
+           layout"""
+        dq = self.q[i] - self.q[j]
+        dr = self.r[i] - self.r[j]
+        return (np.abs(dq) + np.abs(dr) + np.abs(dq + dr)) // 2
+
+    def distances(self, i):
+        return self.distance(i, slice(None))
+
+    def ring(self, i, radius):
+        """Returns an array of the cells exactly radius steps from cell i,
+           in order around the ring"""
+        coords = hex_ring(self.q[i], self.r[i], radius)
+        found = self.find(coords[:, 0], coords[:, 1])
+        return found[found >= 0]
+
+    def flood_fill(self, starts, max_steps=None, mask=None):
+        """Returns an array of the number of steps from the nearest of the
+           start cells (an index or listlike of indices) to each cell,
+           moving only between neighbouring cells, or -1 for cells not
+           reached. mask: boolean array of the cells that can be crossed,
+           by default all"""
+        table = self.neighbour_table()
+        steps = np.full(len(self), -1, dtype=np.int64)
+        if mask is None:
+            mask = np.ones(len(self), dtype=bool)
+        frontier = np.unique(np.atleast_1d(starts))
+        steps[frontier] = 0
+        n = 0
+        while len(frontier) > 0 and (max_steps is None or n < max_steps):
+            n += 1
+            reached = table[frontier].ravel()
+            reached = reached[reached >= 0]
+            reached = np.unique(reached[(steps[reached] < 0) &
+                                        mask[reached]])
+            steps[reached] = n
+            frontier = reached
+        return steps
+
+    def components(self):
+        """Returns an array numbering the separate pieces of the layout
+           (0, 1, ...), e.g. to find islands; duplicates go with the cell
+           they share a position with"""
+        labels = np.full(len(self), -1, dtype=np.int64)
+        visible = self.find(self.q, self.r)
+        label = 0
+        for i in visible.tolist():
+            if labels[i] < 0:
+                labels[self.flood_fill(i) >= 0] = label
+                label += 1
+        return labels[visible]
+
+    def duplicates(self):
+        """Returns an array of the cells at the same position as a cell
+           drawn after them (and so hidden by it)"""
+        return np.nonzero(self.find(self.q, self.r) !=
+                          np.arange(len(self)))[0]
+
+    def origins(self, w, gutter=0, margin_left=0, margin_top=0):
+        """Returns lists x, y of the corner each cell's hexagon is drawn
+           from by draw_hex with cell width w; see hex_origins"""
+        return hex_origins(self.x, self.y, w, gutter, margin_left,
+                           margin_top, self.true_rows)
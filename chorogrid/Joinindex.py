@@ -0,0 +1,191 @@
+#!/usr/bin/python
+# Filename: Joinindex.py
+
+import csv
+import os
+import numpy as np
+import pandas as pd
+
+_cache = {}
+
+# columns of the included databases that identify regions
+KEY_COLUMNS = ['abbrev', 'FIPS', 'full_name', 'fips', 'district_code']
+
+def normalize(keys):
+    """Returns a pandas Series of keys made comparable: accents stripped,
+       lower case, punctuation and extra spaces removed, and numbers
+       without leading zeros or a trailing .0, so that 'Québec' matches
+       'quebec', '01001' matches 1001 and 10001.0 matches 10001"""
+    keys = pd.Series(keys).astype(str)
+    keys = (keys.str.normalize('NFKD').str.encode('ascii', 'ignore')
+            .str.decode('ascii').str.lower())
+    keys = keys.str.replace(r'[^a-z0-9]+', ' ', regex=True).str.strip()
+    # '10001.0' was split at the point just above
+    keys = keys.str.replace(r'^(\d+) 0+$', r'\1', regex=True)
+    return keys.str.replace(r'^0+(?=\d)', '', regex=True)
+
+def read_table(path, encoding='utf-8'):
+    """Reads a csv such as TRANSPOSITION_338FED.csv (encoding='latin-1'),
+       whose header is preceded by title lines and whose data is followed
+       by footnotes: the header is taken to be the first line with as
+       many fields as the widest line, and rows with fewer than two values
+       are dropped"""
+    with open(path, encoding=encoding, newline='') as f:
+        widths = [len(row) for row in csv.reader(f)]
+    header = widths.index(max(widths))
+    df = pd.read_csv(path, encoding=encoding, skiprows=header,
+                     index_col=False)
+    return df[df.notnull().sum(axis=1) >= 2].reset_index(drop=True)
+
+class Joinindex(object):
+    """ Lookups from every key column of a database to its rows, for
+        joining outside data to it. Instantiated with:
+            csv_path: the path to a database csv (or a dataframe of one)
+            id_column: the column of ids to return, as used by Chorogrid
+            key_columns: the columns to index; by default those of
+                         KEY_COLUMNS in the database, and id_column
+
+        Keys are compared after normalize(), so names, codes and numbers
+        match however they are written. The lookups are built once per
+        database by from_database.
+
+        attributes:
+        .ids : array of the database's ids, in row order
+        .key_columns : the columns indexed
+
+        methods:
+        .from_database(csv_path, id_column): a cached Joinindex
+        .rows(keys, key_column): row of each key (-1 where none)
+        .join(keys, values, key_column, how): ids and values, aligned
+        .unmatched(keys, key_column): the keys matching no row
+        .transpose(table, key_column_in_table, value_columns, ...): sum a
+            table's values by key into database ids
+        .crosswalk(keys, values, table, from_column, to_column, weights):
+            move values from one set of keys to another through a table,
+            e.g. 2003 ridings to 2013 ridings
+    """
+    def __init__(self, csv_path, id_column='abbrev', key_columns=None):
+        if isinstance(csv_path, pd.DataFrame):
+            df = csv_path
+        else:
+            df = pd.read_csv(csv_path)
+        assert id_column in df.columns, ("{} is not a column in the"
+                                         " database".format(id_column))
+        if key_columns is None:
+            key_columns = [c for c in KEY_COLUMNS if c in df.columns]
+            if id_column not in key_columns:
+                key_columns.append(id_column)
+        self.ids = df[id_column].to_numpy()
+        self.key_columns = list(key_columns)
+        self._lookups = {}
+        for column in self.key_columns:
+            keys = normalize(df[column])
+            first = ~keys.duplicated().values
+            self._lookups[column] = pd.Index(keys.values[first])
+            self._lookups[column + ' rows'] = np.nonzero(first)[0]
+
+    @classmethod
+    def from_database(cls, csv_path, id_column='abbrev'):
+        key = (os.path.abspath(csv_path), os.path.getmtime(csv_path),
+               id_column)
+        if key not in _cache:
+            _cache[key] = cls(csv_path, id_column)
+        return _cache[key]
+
+    def _rows(self, normalized, column):
+        found = self._lookups[column].get_indexer(normalized)
+        return np.where(found >= 0,
+                        self._lookups[column + ' rows'][found], -1)
+
+    def rows(self, keys, key_column=None):
+        """Returns an array with the database row of each key, or -1. If
+           key_column is None, each key is looked up in the key column
+           matching most keys, then, failing that, in the next, etc."""
+        normalized = normalize(keys).values
+        if key_column is not None:
+            return self._rows(normalized, key_column)
+        candidates = [self._rows(normalized, column)
+                      for column in self.key_columns]
+        candidates.sort(key=lambda rows: -(rows >= 0).sum())
+        rows = candidates[0]
+        for other in candidates[1:]:
+            rows = np.where(rows >= 0, rows, other)
+        return rows
+
+    def unmatched(self, keys, key_column=None):
+        """Returns a list of the keys that match no row"""
+        rows = self.rows(keys, key_column)
+        return [k for k, row in zip(keys, rows) if row < 0]
+
+    def _aligned(self, rows, values, how):
+        """Combines values (one per row in rows, -1 being no row) by row,
+           returning ids and values for the rows present"""
+        assert how in ('first', 'last', 'sum', 'mean'), ("how must be"
+            " 'first', 'last', 'sum' or 'mean'")
+        values = np.asarray(values, dtype=float)
+        keep = rows >= 0
+        rows, values = rows[keep], values[keep]
+        n = len(self.ids)
+        present = np.bincount(rows, minlength=n) > 0
+        shape = (n,) + values.shape[1:]
+        if how in ('sum', 'mean'):
+            totals = np.zeros(shape)
+            np.add.at(totals, rows, values)
+            if how == 'mean':
+                counts = np.bincount(rows, minlength=n).reshape(
+                    (n,) + (1,) * (values.ndim - 1))
+                totals = totals / np.maximum(counts, 1)
+        else:
+            totals = np.full(shape, np.nan)
+            if how == 'first':
+                rows, values = rows[::-1], values[::-1]
+            # with repeated rows, the last assignment wins
+            totals[rows] = values
+        return self.ids[present], totals[present]
+
+    def join(self, keys, values, key_column=None, how='first'):
+        """Matches keys (e.g. names or codes from a data file) to the
+           database, returning an array of ids and an array of the values,
+           aligned and in database order, ready for Colorbin and Chorogrid.
+           values may be 2-D (one column per variable). Keys that match
+           nothing are left out (see unmatched); values of keys matching
+           the same row are combined by how: 'first', 'last', 'sum' or
+           'mean'."""
+        return self._aligned(self.rows(keys, key_column), values, how)
+
+    def transpose(self, table, key_column_in_table, value_columns,
+                  key_column=None):
+        """Sums the value_columns of a table (e.g. the rows of
+           TRANSPOSITION_338FED.csv, read with read_table) by the database
+           key in key_column_in_table, e.g. '2013 FED Number'. Returns ids
+           and a values array, one column per value column (1-D for a
+           single column name)."""
+        rows = self.rows(table[key_column_in_table].values, key_column)
+        values = table[value_columns].values
+        return self._aligned(rows, values, 'sum')
+
+    def crosswalk(self, keys, values, table, from_column, to_column,
+                  weights=None, key_column=None):
+        """Moves values given for keys of another geography onto this
+           database's regions, through a table with a row per piece: the
+           old key in from_column and the database key in to_column. Each
+           piece gets the old value times its weight (a column of the
+           table, e.g. a share of population, or listlike; by default 1),
+           and the pieces are summed per region. Returns ids and values,
+           as join."""
+        source = pd.Series(np.asarray(values, dtype=float).tolist(),
+                           index=normalize(keys).values)
+        source = source[~source.index.duplicated()]
+        pieces = source.reindex(normalize(table[from_column]).values)
+        pieces = np.array(pieces.tolist(), dtype=float)
+        if weights is None:
+            weights = np.ones(len(table))
+        elif isinstance(weights, str):
+            weights = table[weights].values.astype(float)
+        weights = np.asarray(weights, dtype=float).reshape(
+            (-1,) + (1,) * (pieces.ndim - 1))
+        pieces = pieces * weights
+        known = ~np.isnan(pieces.reshape(len(pieces), -1)).any(axis=1)
+        rows = self.rows(table[to_column].values, key_column)
+        rows = np.where(known, rows, -1)
+        return self._aligned(rows, pieces, 'sum')
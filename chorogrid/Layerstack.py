@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# Filename: Layerstack.py
+
+from chorogrid.Chorogrid import Chorogrid, _output, _svg_head
+
+class Layerstack(object):
+    """ Stacks any number of maps and svg fragments into one document, e.g.
+        counties, then state lines, then labels, then highlights. Each
+        layer is written once, straight from its element tree, inside a
+        group with its own opacity. Instantiated with:
+            width, height: size of the document; by default the largest
+                           width and height of the Chorogrid layers
+
+        attributes:
+        .layers : list of dicts (layer, opacity, order, offset), in the
+                  order they were added; change them freely before done()
+
+        methods:
+        .add(layer, opacity, order, offset): add a Chorogrid (on which a
+            draw_... method has been called) or a string of svg
+        .add_file(filename, opacity, order, offset): add the svg in a file,
+            e.g. databases/usa_counties_statelines.txt
+        .done(...): as Chorogrid.done
+    """
+    def __init__(self, width=None, height=None):
+        self.width = width
+        self.height = height
+        self.layers = []
+
+    def add(self, layer, opacity=1, order=None, offset=None):
+        """Adds a layer on top of those already added.
+           * layer: a Chorogrid, or svg text
+           * opacity: between 0 and 1, for the whole layer
+           * order: layers are drawn from lowest order to highest (ties in
+             the order they were added); by default, the number of layers
+             already added
+           * offset: [x, y] to shift the layer by. By default svg text is
+             shifted like Chorogrid.add_svg, to the margins of the first
+             Chorogrid layer, so fragments in map coordinates line up with
+             draw_map."""
+        if isinstance(layer, Chorogrid):
+            assert hasattr(layer, 'svg'), ("a draw_... method must be"
+                                           " called before adding a layer")
+        else:
+            assert isinstance(layer, str), ("a layer must be a Chorogrid"
+                                            " or svg text")
+        if order is None:
+            order = len(self.layers)
+        self.layers.append({'layer': layer, 'opacity': opacity,
+                            'order': order, 'offset': offset})
+
+    def add_file(self, filename, opacity=1, order=None, offset=None):
+        """Adds the svg text in filename as a layer; see add"""
+        with open(filename, encoding='utf-8') as f:
+            self.add(f.read(), opacity, order, offset)
+
+    def _size(self):
+        width, height = self.width, self.height
+        grids = [d['layer'] for d in self.layers
+                 if isinstance(d['layer'], Chorogrid)]
+        if width is None:
+            assert len(grids) > 0, "width must be given without Chorogrids"
+            width = max(float(g.svg.get('width')) for g in grids)
+        if height is None:
+            assert len(grids) > 0, "height must be given without Chorogrids"
+            height = max(float(g.svg.get('height')) for g in grids)
+        return width, height
+
+    def _iter_svg_chunks(self):
+        """Yields the document one piece at a time: each Chorogrid layer's
+           elements as they are serialized, each fragment as it is"""
+        width, height = self._size()
+        yield _svg_head({'xmlns': "http://www.w3.org/2000/svg",
+                         'version': "1.1", 'height': '{:g}'.format(height),
+                         'width': '{:g}'.format(width)})
+        default_offset = [0, 0]
+        for d in self.layers:
+            if isinstance(d['layer'], Chorogrid):
+                default_offset = d['layer'].additional_offset
+                break
+        order = sorted(range(len(self.layers)),
+                       key=lambda k: (self.layers[k]['order'], k))
+        for k in order:
+            d = self.layers[k]
+            layer = d['layer']
+            offset = d['offset']
+            if offset is None and not isinstance(layer, Chorogrid):
+                offset = default_offset
+            attributes = 'id="layer{}"'.format(k)
+            if d['opacity'] != 1:
+                attributes += ' opacity="{}"'.format(d['opacity'])
+            if offset is not None and tuple(offset) != (0, 0):
+                attributes += ' transform="translate({} {})"'.format(
+                    offset[0], offset[1])
+            yield '<g {}>\n'.format(attributes)
+            if isinstance(layer, Chorogrid):
+                for chunk in layer._iter_body_chunks():
+                    yield chunk
+            else:
+                yield layer.replace(">", ">\n")
+            yield '</g>\n'
+        yield '</svg>\n'
+
+    def done(self, show=True, save_filename=None, compress=False,
+             stream=None, as_bytes=False):
+        """if show == True, displays the svg in IPython notebook. If
+           save_filename is specified, saves svg file. compress, stream and
+           as_bytes are as for Chorogrid.done"""
+        return _output(self._iter_svg_chunks, show, save_filename, compress,
+                       stream, as_bytes)
@@ -0,0 +1,59 @@
+#!/usr/bin/python
+# Filename: Palettecolors.py
+
+import numpy as np
+
+class Palettecolors(object):
+    """ A compact list of colors: a small palette and, for each region, the
+        number of its color in the palette (uint8, or uint16 for palettes
+        of more than 256 colors), instead of one string per region. It can
+        be passed to Chorogrid wherever a list of colors is expected, and
+        behaves like one (len, indexing, iteration). Instantiate with:
+            palette: list of colors in hex (#123456) format
+            indices: listlike object of palette positions, one per region
+
+        Get one from Colorbin.compact(), Colormatrix.compact(column) or
+        Palettecolors.from_colors(colors).
+
+        methods:
+        .from_colors(colors): compact an ordinary list of colors
+        .map_palette(mapping): the same regions with every palette color
+            replaced through a dict or function, e.g. to get font colors
+        .to_list(): the colors as an ordinary list
+    """
+    def __init__(self, palette, indices):
+        self.palette = list(palette)
+        assert len(self.palette) <= 65536, ("palette can have at most"
+                                            " 65536 colors")
+        dtype = np.uint8 if len(self.palette) <= 256 else np.uint16
+        self.indices = np.asarray(indices).astype(dtype, copy=False)
+
+    @classmethod
+    def from_colors(cls, colors):
+        palette, indices = np.unique(np.asarray(list(colors), dtype=object),
+                                     return_inverse=True)
+        return cls(palette.tolist(), indices.ravel())
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return Palettecolors(self.palette, self.indices[i])
+        return self.palette[self.indices[i]]
+
+    def __iter__(self):
+        palette = self.palette
+        for k in self.indices.tolist():
+            yield palette[k]
+
+    def map_palette(self, mapping):
+        """Returns a Palettecolors with the same indices and each palette
+           color c replaced by mapping[c] (or mapping(c))"""
+        if callable(mapping):
+            return Palettecolors([mapping(c) for c in self.palette],
+                                 self.indices)
+        return Palettecolors([mapping[c] for c in self.palette], self.indices)
+
+    def to_list(self):
+        return list(self)
@@ -0,0 +1,157 @@
+#!/usr/bin/python
+# Filename: Rendercache.py
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from chorogrid.Palettecolors import Palettecolors
+
+class Rendercache(object):
+    """ An on-disk cache of finished maps, keyed by a hash of everything
+        that goes into them, so that asking again for a map whose inputs
+        haven't changed costs a file read. Pass one to chorogrid.render().
+        Instantiated with:
+            directory: where to keep the cached documents
+            max_bytes: when the cache grows past this, the least recently
+                       used documents are deleted
+
+        One Rendercache can be shared by threads (e.g. an Asyncrenderer on
+        a thread pool); its bookkeeping is guarded by a lock.
+
+        attributes:
+        .hits, .misses : counters since instantiation
+
+        methods:
+        .key(**inputs): the hash of a set of inputs
+        .get(key): the cached bytes, or None
+        .put(key, data): store bytes
+        .clear(): delete everything
+    """
+    def __init__(self, directory, max_bytes=100*1024*1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        # guards _sizes, total_bytes, hits and misses
+        self._lock = threading.Lock()
+        self._sizes = {}
+        for name in os.listdir(directory):
+            if name.endswith('.svgcache'):
+                path = os.path.join(directory, name)
+                self._sizes[path] = os.path.getsize(path)
+        self.total_bytes = sum(self._sizes.values())
+
+    def __getstate__(self):
+        # a lock can't be pickled (e.g. into a process pool); each copy
+        # gets its own
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _canonical(self, value):
+        """Turns an input into something json can serialize the same way
+           every time"""
+        if isinstance(value, pd.DataFrame):
+            return hashlib.sha1(pd.util.hash_pandas_object(
+                value, index=True).values.tobytes()).hexdigest()
+        if isinstance(value, Palettecolors):
+            return {'palette': value.palette,
+                    'indices': value.indices.tolist()}
+        if isinstance(value, (np.ndarray, np.generic, pd.Series, pd.Index)):
+            value = value.tolist()
+        if isinstance(value, dict):
+            return {str(k): self._canonical(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self._canonical(v) for v in value]
+        return value
+
+    def key(self, csv_path=None, **inputs):
+        """Returns a hex digest of csv_path (its location, size and
+           modification time, or its contents if it is a dataframe) and
+           any other keyword inputs"""
+        if isinstance(csv_path, str):
+            stat = os.stat(csv_path)
+            database = [os.path.abspath(csv_path), stat.st_size,
+                        stat.st_mtime_ns]
+        else:
+            database = self._canonical(csv_path)
+        text = json.dumps([database, self._canonical(inputs)],
+                          sort_keys=True, default=str)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.svgcache')
+
+    def get(self, key):
+        """Returns the bytes stored under key, or None, counting a hit or
+           a miss"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        # mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass  # evicted meanwhile by another thread
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """Stores bytes under key, then evicts least recently used
+           documents until the cache is under max_bytes"""
+        path = self._path(key)
+        # a name of its own for every writer, thread or process
+        handle, temp_path = tempfile.mkstemp(suffix='.tmp', 
+                                             dir=self.directory)
+        with os.fdopen(handle, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            os.replace(temp_path, path)
+            self.total_bytes += len(data) - self._sizes.get(path, 0)
+            self._sizes[path] = len(data)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Deletes least recently used documents; called holding _lock"""
+        by_age = []
+        for path in self._sizes:
+            try:
+                by_age.append((os.path.getmtime(path), path))
+            except OSError:
+                by_age.append((0, path))
+        by_age.sort()
+        for _, path in by_age:
+            if self.total_bytes <= self.max_bytes:
+                break
+            self.total_bytes -= self._sizes.pop(path)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        """Deletes every cached document"""
+        with self._lock:
+            for path in list(self._sizes):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._sizes = {}
+            self.total_bytes = 0
@@ -0,0 +1,228 @@
+#!/usr/bin/python
+# Filename: Renderpool.py
+
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from chorogrid.Chorogrid import Chorogrid, _draw
+from chorogrid.Geometry import Geometry, parse_paths
+from chorogrid.Geometry import _cache as _geometry_cache
+
+# text columns each draw method reads, besides the id column and any
+# column named in its keyword arguments
+_TEXT_COLUMNS = {'draw_map': ['map_path'],
+                 'draw_multihex': ['fourhex_contour'],
+                 'draw_multisquare': ['multisquare_contour']}
+
+class Renderpool(object):
+    """ Worker processes for making many maps from the same databases. Each
+        database is read once, in this process, and published with its
+        paths already parsed in a block of shared memory
+        (multiprocessing.shared_memory); the workers map the block instead
+        of each reading the csv and holding its own copy of the paths.
+        Paths are drawn straight from the block, each decoded only as it is
+        drawn, and regions are picked and labelled with the published
+        geometry; other text columns are decoded once per worker.
+        Instantiated with:
+            databases: a database csv path, or a list of them
+            processes: number of worker processes; by default one per core
+            path_columns: columns of svg paths whose parsed geometry is
+                          published too, for subset, viewport and labels
+
+        Use it in a with block, or call close() when done, so the shared
+        memory is freed.
+
+        methods:
+        .submit(csv_path, ids, colors, save_filename, **kwargs): start a map,
+            made as chorogrid.render(csv_path, ids, colors, **kwargs), and
+            return a concurrent.futures Future of its svg bytes (or, if
+            save_filename is given, of the name of the file written)
+        .map(jobs): make a map per dict of submit's arguments; returns the
+            results in order
+        .close(): stop the workers and free the shared memory
+    """
+    def __init__(self, databases, processes=None, path_columns=('map_path',)):
+        if isinstance(databases, str):
+            databases = [databases]
+        self._blocks = []
+        manifests = []
+        for csv_path in databases:
+            block, manifest = _publish(csv_path, path_columns)
+            self._blocks.append(block)
+            manifests.append(manifest)
+        self.databases = [m['csv_path'] for m in manifests]
+        self._executor = ProcessPoolExecutor(processes, initializer=_attach,
+                                             initargs=(manifests,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, csv_path, ids, colors, save_filename=None, **kwargs):
+        """Starts a map in a worker; see the class docstring. kwargs are
+           those of chorogrid.render except cache; a save_filename ending
+           in '.svgz' implies compress=True."""
+        csv_path = os.path.abspath(csv_path)
+        assert csv_path in self.databases, ("{} was not given when the"
+                                            " pool was made".format(csv_path))
+        if save_filename is not None and save_filename[-5:] == '.svgz':
+            kwargs['compress'] = True
+        return self._executor.submit(_render_job, csv_path, ids, colors,
+                                     save_filename, kwargs)
+
+    def map(self, jobs):
+        futures = [self.submit(**job) for job in jobs]
+        return [f.result() for f in futures]
+
+    def close(self):
+        self._executor.shutdown()
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+def _publish(csv_path, path_columns):
+    """Copies a database into a new block of shared memory: numeric
+       columns as they are, text columns as utf-8 bytes with offsets, and
+       path columns also parsed. Returns the block and a manifest of where
+       each array is in it."""
+    df = pd.read_csv(csv_path)
+    arrays = {}
+    for column in df.columns:
+        values = df[column]
+        if pd.api.types.is_numeric_dtype(values):
+            arrays['column', column] = values.to_numpy()
+            continue
+        null = values.isnull().to_numpy()
+        encoded = [b'' if n else str(v).encode('utf-8')
+                   for v, n in zip(values, null)]
+        arrays['text', column] = np.frombuffer(b''.join(encoded),
+                                               dtype=np.uint8)
+        arrays['offsets', column] = np.concatenate([[0], np.cumsum(
+            [len(e) for e in encoded], dtype=np.int64)]).astype(np.int64)
+        arrays['null', column] = null
+        if column in path_columns:
+            coords, ring_offsets, region_offsets = parse_paths(values)
+            arrays['coords', column] = np.asarray(coords, dtype=float)
+            arrays['ring_offsets', column] = ring_offsets
+            arrays['region_offsets', column] = region_offsets
+    # each array starts on an 8 byte boundary
+    layout = {}
+    size = 0
+    for key, array in arrays.items():
+        layout[key] = (array.dtype.str, array.shape, size)
+        size += (array.nbytes + 7) // 8 * 8
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for key, array in arrays.items():
+        dtype, shape, offset = layout[key]
+        np.ndarray(shape, dtype, buffer=block.buf, offset=offset)[...] = array
+    manifest = {'csv_path': os.path.abspath(csv_path),
+                'mtime': os.path.getmtime(csv_path), 'name': block.name,
+                'columns': list(df.columns), 'layout': layout}
+    return block, manifest
+
+# in each worker: {csv_path: (block, arrays, manifest, {path column:
+# _Sharedtext})}
+_tables = {}
+# in each worker, text columns decoded so far: {(csv_path, column): array}
+_texts = {}
+
+class _Sharedtext(object):
+    """ A text column in a block of shared memory, read like an array of
+        its values; each value is decoded when it is read, not before.
+    """
+    def __init__(self, text, offsets, null):
+        self._text = memoryview(text)
+        self._offsets = offsets
+        self._null = null
+
+    def __len__(self):
+        return len(self._null)
+
+    def __getitem__(self, i):
+        if self._null[i]:
+            return np.nan
+        return str(self._text[self._offsets[i]:self._offsets[i + 1]],
+                   'utf-8')
+
+def _attach(manifests):
+    """Maps the blocks of shared memory of a pool's databases; runs once
+       in each worker"""
+    for manifest in manifests:
+        block = shared_memory.SharedMemory(name=manifest['name'])
+        arrays = {key: np.ndarray(shape, dtype, buffer=block.buf,
+                                  offset=offset)
+                  for key, (dtype, shape, offset)
+                  in manifest['layout'].items()}
+        shared = {column: _Sharedtext(arrays['text', column],
+                                      arrays['offsets', column],
+                                      arrays['null', column])
+                  for column in manifest['columns']
+                  if ('coords', column) in arrays}
+        _tables[manifest['csv_path']] = (block, arrays, manifest, shared)
+
+def _decoded(csv_path, arrays, column):
+    """A text column of a shared database as an array of str, decoded the
+       first time a job in this worker needs it"""
+    key = (csv_path, column)
+    if key not in _texts:
+        text = memoryview(arrays['text', column])
+        offsets = arrays['offsets', column].tolist()
+        values = np.empty(len(offsets) - 1, dtype=object)
+        values[:] = [str(text[a:b], 'utf-8') for a, b
+                     in zip(offsets[:-1], offsets[1:])]
+        values[arrays['null', column]] = np.nan
+        _texts[key] = values
+    return _texts[key]
+
+def _frame(csv_path, arrays, manifest, text_columns):
+    """A DataFrame of a database's numeric columns and the text columns
+       asked for, on the shared and already decoded arrays (not copies)"""
+    data = {}
+    for column in manifest['columns']:
+        if ('column', column) in arrays:
+            data[column] = arrays['column', column]
+        elif column in text_columns:
+            data[column] = _decoded(csv_path, arrays, column)
+    return pd.DataFrame(data, copy=False)
+
+def _render_job(csv_path, ids, colors, save_filename, kwargs):
+    """Makes one map in a worker from the shared copy of its database"""
+    block, arrays, manifest, shared = _tables[csv_path]
+    draw_method = kwargs.get('draw_method', 'draw_map')
+    id_column = kwargs.get('id_column', 'abbrev')
+    draw_kwargs = kwargs.get('draw_kwargs') or {}
+    text_columns = set([id_column] + _TEXT_COLUMNS.get(draw_method, []) +
+                       [v for v in draw_kwargs.values() if isinstance(v, str)])
+    # path columns are read from the block as they are drawn
+    df = _frame(csv_path, arrays, manifest, text_columns.difference(shared))
+    cg = Chorogrid(df, ids, colors, id_column)
+    cg._text_columns = shared
+    # look up geometry and label caches by the database's path, as if it
+    # had been read from there, so the shared geometry below is used
+    cg.csv_path = csv_path
+    for column in shared:
+        key = (csv_path, manifest['mtime'], id_column, column)
+        if key not in _geometry_cache:
+            _geometry_cache[key] = Geometry.from_arrays(df[id_column],
+                arrays['coords', column], arrays['ring_offsets', column],
+                arrays['region_offsets', column])
+    _draw(cg, draw_method, draw_kwargs, kwargs.get('title'),
+          kwargs.get('title_kwargs') or {}, kwargs.get('legend'),
+          kwargs.get('svg_fragments') or [])
+    compress = kwargs.get('compress', False)
+    data = cg.done(show=False, compress=compress, as_bytes=True)
+    if save_filename is None:
+        return data
+    if compress:
+        if save_filename[-5:] != '.svgz':
+            save_filename += '.svgz'
+    elif save_filename[-4:] != '.svg':
+        save_filename += '.svg'
+    with open(save_filename, 'wb') as f:
+        f.write(data)
+    return save_filename
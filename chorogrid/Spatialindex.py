@@ -0,0 +1,138 @@
+#!/usr/bin/python
+# Filename: Spatialindex.py
+
+import numpy as np
+
+class Spatialindex(object):
+    """ A grid-bucket index over the regions of a Geometry, for answering
+        "which region is at this point?" and "which regions are in this box?"
+        quickly, e.g. for tooltips over a drawn map. Instantiated with:
+            geometry: a Geometry object, in the coordinates you will query
+                      with (Chorogrid.spatial_index() builds one in the
+                      coordinates of the drawn svg)
+            buckets_per_side: grid resolution; by default about one
+                              bucket per region
+
+        Where regions overlap, the one drawn last (i.e. on top) wins.
+
+        methods:
+        .query_point(x, y): id of the region containing the point, or None
+        .query_points(points): region index (-1 if none) for each row of an
+                               (n, 2) array; .ids_for(indices) converts
+        .query_bbox(xmin, ymin, xmax, ymax): ids of regions whose bounding
+                                             boxes intersect the box
+    """
+    def __init__(self, geometry, buckets_per_side=None):
+        self.geometry = geometry
+        self.ids = geometry.ids
+        bboxes = geometry.bboxes
+        valid = ~np.isnan(bboxes[:, 0])
+        if valid.any():
+            self.xmin, self.ymin = bboxes[valid, 0].min(), bboxes[valid, 1].min()
+            self.xmax, self.ymax = bboxes[valid, 2].max(), bboxes[valid, 3].max()
+        else:
+            self.xmin = self.ymin = self.xmax = self.ymax = 0.
+        if buckets_per_side is None:
+            buckets_per_side = max(1, int(np.sqrt(valid.sum())))
+        self.nx = self.ny = buckets_per_side
+        self.bucket_w = max(self.xmax - self.xmin, 1e-9) / self.nx
+        self.bucket_h = max(self.ymax - self.ymin, 1e-9) / self.ny
+        # bucket ranges covered by each region's bounding box
+        regions = np.nonzero(valid)[0]
+        x0, y0 = self._bucket_xy(bboxes[regions, 0], bboxes[regions, 1])
+        x1, y1 = self._bucket_xy(bboxes[regions, 2], bboxes[regions, 3])
+        bucket_lists = [[] for _ in range(self.nx * self.ny)]
+        for region, a, b, c, d in zip(regions, x0, y0, x1, y1):
+            for bx in range(a, c + 1):
+                for by in range(b, d + 1):
+                    bucket_lists[by * self.nx + bx].append(region)
+        # compact (CSR) storage: bucket k holds
+        # regions[bucket_offsets[k]:bucket_offsets[k+1]], in drawing order
+        lengths = [len(x) for x in bucket_lists]
+        self.bucket_offsets = np.concatenate([[0], np.cumsum(lengths)]
+                                             ).astype(np.int64)
+        self.bucket_regions = np.array([r for x in bucket_lists for r in x],
+                                       dtype=np.int64)
+
+    def _bucket_xy(self, x, y):
+        bx = np.clip(((np.asarray(x) - self.xmin) / self.bucket_w
+                      ).astype(np.int64), 0, self.nx - 1)
+        by = np.clip(((np.asarray(y) - self.ymin) / self.bucket_h
+                      ).astype(np.int64), 0, self.ny - 1)
+        return bx, by
+
+    def _candidates(self, bucket):
+        return self.bucket_regions[self.bucket_offsets[bucket]:
+                                   self.bucket_offsets[bucket + 1]]
+
+    def query_point(self, x, y):
+        """Returns the id of the region containing x, y, or None"""
+        if not (self.xmin <= x <= self.xmax and self.ymin <= y <= self.ymax):
+            return None
+        bx, by = self._bucket_xy(x, y)
+        bboxes = self.geometry.bboxes
+        # later regions are drawn on top, so check them first
+        for region in self._candidates(by * self.nx + bx)[::-1]:
+            box = bboxes[region]
+            if (box[0] <= x <= box[2] and box[1] <= y <= box[3] and
+                    self.geometry.contains(region, [[x, y]])[0]):
+                return self.ids[region]
+        return None
+
+    def query_points(self, points):
+        """Takes an (n, 2) array of points, returns an array of n region
+           indices (into .ids), -1 for points not in any region"""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        result = np.full(len(points), -1, dtype=np.int64)
+        in_extent = ((points[:, 0] >= self.xmin) & (points[:, 0] <= self.xmax) &
+                     (points[:, 1] >= self.ymin) & (points[:, 1] <= self.ymax))
+        point_idx = np.nonzero(in_extent)[0]
+        if len(point_idx) == 0:
+            return result
+        bx, by = self._bucket_xy(points[point_idx, 0], points[point_idx, 1])
+        buckets = by * self.nx + bx
+        order = np.argsort(buckets, kind='stable')
+        point_idx, buckets = point_idx[order], buckets[order]
+        starts = np.nonzero(np.r_[True, buckets[1:] != buckets[:-1]])[0]
+        ends = np.r_[starts[1:], len(buckets)]
+        bboxes = self.geometry.bboxes
+        for start, end in zip(starts, ends):
+            these = point_idx[start:end]
+            xy = points[these]
+            for region in self._candidates(buckets[start]):
+                box = bboxes[region]
+                in_box = ((xy[:, 0] >= box[0]) & (xy[:, 0] <= box[2]) &
+                          (xy[:, 1] >= box[1]) & (xy[:, 1] <= box[3]))
+                if not in_box.any():
+                    continue
+                hit = np.zeros(len(xy), dtype=bool)
+                hit[in_box] = self.geometry.contains(region, xy[in_box])
+                # later regions are drawn on top, so they overwrite
+                result[these[hit]] = region
+        return result
+
+    def ids_for(self, indices):
+        """Converts region indices from query_points to ids (None for -1)"""
+        return [self.ids[i] if i >= 0 else None for i in indices]
+
+    def query_bbox(self, xmin, ymin, xmax, ymax):
+        """Returns the ids of regions whose bounding boxes intersect the
+           given box, in drawing order"""
+        return [self.ids[i] for i in self.query_bbox_indices(xmin, ymin,
+                                                             xmax, ymax)]
+
+    def query_bbox_indices(self, xmin, ymin, xmax, ymax):
+        """As query_bbox, but returns an array of region indices"""
+        if (xmax < self.xmin or xmin > self.xmax or
+                ymax < self.ymin or ymin > self.ymax):
+            return np.zeros(0, dtype=np.int64)
+        x0, y0 = self._bucket_xy(xmin, ymin)
+        x1, y1 = self._bucket_xy(xmax, ymax)
+        candidates = np.unique(np.concatenate(
+            [self._candidates(by * self.nx + bx)
+             for by in range(int(y0), int(y1) + 1)
+             for bx in range(int(x0), int(x1) + 1)]))
+        boxes = self.geometry.bboxes[candidates]
+        hit = ((boxes[:, 0] <= xmax) & (boxes[:, 2] >= xmin) &
+               (boxes[:, 1] <= ymax) & (boxes[:, 3] >= ymin))
+        return candidates[hit]
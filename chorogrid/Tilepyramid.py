@@ -0,0 +1,205 @@
+#!/usr/bin/python
+# Filename: Tilepyramid.py
+
+import hashlib
+import json
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from chorogrid.Chorogrid import _escape_attrib
+from chorogrid.Spatialindex import Spatialindex
+
+class Tilepyramid(object):
+    """ Exports a Chorogrid map as a slippy-map style pyramid of tiles,
+        directory/z/x/y.svg (or .png), for web viewers. Instantiated with:
+            chorogrid: a Chorogrid on which draw_map has been called; its
+                       colors, path column, stroke settings, subset and
+                       viewport are used
+            tile_size: width and height of a tile in pixels
+            max_zoom: tiles are made for zoom levels 0 to max_zoom; at zoom
+                      z the map is 2**z tiles across
+
+        At each zoom level the paths are simplified to that level's pixel
+        grid: vertices are snapped to it and repeats dropped, so low zooms
+        don't carry detail nobody can see. Tiles are svgs whose viewBox
+        crops the regions that overlap them. If the map was drawn zoomed
+        in, the pyramid covers only its view: only the regions draw_map
+        drew are tiled, and they are clipped at the edges of the view.
+
+        A manifest (tiles.json) records a hash of what went into each tile;
+        exporting again to the same directory only renders the tiles whose
+        regions changed color (or are missing).
+
+        methods:
+        .export(directory, fmt='svg', processes=None): write the tiles, in
+            parallel over processes (default: all cores); returns a dict
+            with the numbers of tiles written and skipped
+    """
+    def __init__(self, chorogrid, tile_size=256, max_zoom=4):
+        assert (chorogrid.drawn is not None and
+                chorogrid.drawn['method'] == 'draw_map'), ("draw_map must"
+            " be called before making tiles")
+        spacing_dict = chorogrid.drawn['spacing_dict']
+        self.path_column = chorogrid.drawn['path_column']
+        self.geometry = chorogrid._geometry(self.path_column)
+        self.index = Spatialindex(self.geometry)
+        # the rows draw_map drew, and its view (None for the whole map)
+        self.rows = chorogrid.drawn['rows']
+        self.view = chorogrid.drawn['view']
+        self._drawn = np.zeros(len(self.geometry), dtype=bool)
+        self._drawn[self.rows] = True
+        self.tile_size = tile_size
+        self.max_zoom = max_zoom
+        self.stroke_color = spacing_dict['stroke_color']
+        self.stroke_width = spacing_dict['stroke_width']
+        positions = chorogrid._id_positions()
+        self.colors = [chorogrid.colors[positions[id_]] if id_ in positions
+                       else spacing_dict['missing_color']
+                       for id_ in self.geometry.ids]
+        # the pyramid covers a square around the whole map, or the view
+        if self.view is None:
+            xmin, ymin = self.index.xmin, self.index.ymin
+            xmax, ymax = self.index.xmax, self.index.ymax
+        else:
+            xmin, ymin, xmax, ymax = self.view
+        self.x0, self.y0 = xmin, ymin
+        self.extent = max(xmax - xmin, ymax - ymin)
+
+    def _simplified_paths(self, zoom):
+        """Path strings of every region, snapped to the pixel grid of this
+           zoom level"""
+        pixel = self.extent / (self.tile_size * 2 ** zoom)
+        g = self.geometry
+        snapped = np.round((g.coords - [self.x0, self.y0]) / pixel)
+        snapped = snapped * pixel + [self.x0, self.y0]
+        paths = [''] * len(g)
+        for i in self.rows:
+            parts = []
+            for k in range(g.region_offsets[i], g.region_offsets[i+1]):
+                ring = snapped[g.ring_offsets[k]:g.ring_offsets[k+1]]
+                repeat = np.r_[False, (ring[1:] == ring[:-1]).all(axis=1)]
+                ring = ring[~repeat]
+                if len(ring) < 3:
+                    continue
+                parts.append('M' + ' L'.join('{:g},{:g}'.format(x, y)
+                                            for x, y in ring) + ' Z')
+            paths[i] = ' '.join(parts)
+        return paths
+
+    def _tile_bbox(self, z, x, y):
+        size = self.extent / 2 ** z
+        return (self.x0 + x * size, self.y0 + y * size,
+                self.x0 + (x + 1) * size, self.y0 + (y + 1) * size)
+
+    def _tile_regions(self, bbox):
+        """The drawn regions overlapping a tile, and the view to clip them
+           to (None if the tile is wholly inside it)"""
+        xmin, ymin, xmax, ymax = bbox
+        clip = None
+        if self.view is not None:
+            vxmin, vymin, vxmax, vymax = self.view
+            if xmin >= vxmax or ymin >= vymax:
+                return np.zeros(0, dtype=np.int64), None
+            if xmax > vxmax or ymax > vymax:
+                clip = self.view
+                xmax, ymax = min(xmax, vxmax), min(ymax, vymax)
+        regions = np.asarray(self.index.query_bbox_indices(xmin, ymin,
+                                                           xmax, ymax))
+        return regions[self._drawn[regions]], clip
+
+    def _tile_key(self, z, regions):
+        """Hash of everything that goes into a tile"""
+        h = hashlib.sha1()
+        h.update(repr((self.tile_size, self.extent, self.x0, self.y0,
+                       self.stroke_color, self.stroke_width, self.view,
+                       len(self.geometry.coords), z)).encode('utf-8'))
+        for i in regions:
+            h.update('{}:{};'.format(i, self.colors[i]).encode('utf-8'))
+        return h.hexdigest()
+
+    def export(self, directory, fmt='svg', processes=None):
+        """Writes directory/z/x/y.<fmt> for every tile that changed since
+           the last export to directory. fmt is 'svg' or 'png' (png needs
+           the cairosvg package)."""
+        assert fmt in ('svg', 'png'), "fmt must be 'svg' or 'png'"
+        manifest_path = os.path.join(directory, 'tiles.json')
+        manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding='utf-8') as f:
+                manifest = json.load(f)
+        counts = {'written': 0, 'skipped': 0}
+        with ProcessPoolExecutor(processes) as executor:
+            for z in range(self.max_zoom + 1):
+                jobs = []
+                for x in range(2 ** z):
+                    for y in range(2 ** z):
+                        bbox = self._tile_bbox(z, x, y)
+                        regions, clip = self._tile_regions(bbox)
+                        if len(regions) == 0:
+                            continue
+                        name = '{}/{}/{}.{}'.format(z, x, y, fmt)
+                        key = self._tile_key(z, regions)
+                        filename = os.path.join(directory, name)
+                        if (manifest.get(name) == key and
+                                os.path.exists(filename)):
+                            counts['skipped'] += 1
+                            continue
+                        manifest[name] = key
+                        jobs.append((filename, bbox, regions, clip))
+                if len(jobs) == 0:
+                    continue
+                paths = self._simplified_paths(z)
+                # keep strokes stroke_width pixels wide at every zoom
+                stroke_width = (self.stroke_width * self.extent / 
+                                (self.tile_size * 2 ** z))
+                tasks = []
+                for filename, bbox, regions, clip in jobs:
+                    os.makedirs(os.path.dirname(filename), exist_ok=True)
+                    elements = [(self.geometry.ids[i], paths[i],
+                                 self.colors[i]) for i in regions]
+                    tasks.append(executor.submit(_write_tile, filename,
+                        bbox, elements, self.tile_size, self.stroke_color,
+                        stroke_width, fmt, clip))
+                for task in tasks:
+                    task.result()
+                counts['written'] += len(tasks)
+        os.makedirs(directory, exist_ok=True)
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        return counts
+
+def _write_tile(filename, bbox, elements, tile_size, stroke_color,
+                stroke_width, fmt, clip=None):
+    """Renders one tile, with the paths clipped to clip (xmin, ymin,
+       xmax, ymax) if given; runs in a worker process"""
+    xmin, ymin, xmax, ymax = bbox
+    parts = ['<svg xmlns="http://www.w3.org/2000/svg" version="1.1" '
+             'width="{0}" height="{0}" viewBox="{1} {2} {3} {4}">\n'.format(
+             tile_size, xmin, ymin, xmax - xmin, ymax - ymin)]
+    if clip is not None:
+        parts.append('<defs><clipPath id="view"><rect x="{}" y="{}" '
+                     'width="{}" height="{}" /></clipPath></defs>\n'
+                     '<g clip-path="url(#view)">\n'.format(clip[0], clip[1],
+                     clip[2] - clip[0], clip[3] - clip[1]))
+    for id_, path, color in elements:
+        if len(path) == 0:
+            continue
+        parts.append('<path id="{}" d="{}" style="stroke:{};stroke-width:{};'
+                     'stroke-miterlimit:4;stroke-opacity:1;stroke-dasharray:'
+                     'none;fill:{}" />\n'.format(_escape_attrib(id_), path,
+                     _escape_attrib(stroke_color), stroke_width,
+                     _escape_attrib(color)))
+    if clip is not None:
+        parts.append('</g>\n')
+    parts.append('</svg>\n')
+    svgstring = ''.join(parts)
+    if fmt == 'png':
+        try:
+            import cairosvg
+        except ImportError:
+            raise ImportError("png tiles need the cairosvg package")
+        cairosvg.svg2png(bytestring=svgstring.encode('utf-8'),
+                         write_to=filename)
+    else:
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(svgstring)
@@ -3,6 +3,20 @@
 
 # Author: David Taylor (@Prooffreader)
 
+from chorogrid.Palettecolors import Palettecolors
 from chorogrid.Colorbin import Colorbin
-from chorogrid.Chorogrid import Chorogrid
+from chorogrid.Colormatrix import Colormatrix
+from chorogrid.Chorogrid import Chorogrid, render
+from chorogrid.Geometry import Geometry
+from chorogrid.Spatialindex import Spatialindex
 
+from chorogrid.Gridcartogram import Gridcartogram
+from chorogrid.Adjacency import Adjacency
+from chorogrid.Dissolve import Dissolve
+from chorogrid.Tilepyramid import Tilepyramid
+from chorogrid.Rendercache import Rendercache
+from chorogrid.Asyncrenderer import Asyncrenderer, render_async
+from chorogrid.Layerstack import Layerstack
+from chorogrid.Joinindex import Joinindex
+from chorogrid.Hexgrid import Hexgrid
+from chorogrid.Renderpool import Renderpool
@@ -0,0 +1,206 @@
+#!/usr/bin/python
+# Filename: __main__.py
+
+""" Renders a batch of maps from the command line, e.g.
+
+    python -m chorogrid usa_states sample_state_data.csv \
+        --colors '#edf8fb,#b2e2e2,#66c2a4,#238b45' --draw-method draw_hex \
+        --output-dir maps
+
+    makes one map per value column of the data csv (or per value of
+    --group-by), in parallel over all cores, and reports how long each
+    took. The exit status is 1 if the data's ids don't match the
+    database's (unless --allow-mismatch), 2 for bad arguments, 3 if any
+    map couldn't be made (e.g. a column or group with no values); the
+    other maps are still made.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from chorogrid.Chorogrid import Chorogrid
+from chorogrid.Colormatrix import Colormatrix
+
+_databases = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'databases')
+
+def _database_path(name):
+    """A database csv path, given either a path or a name such as
+       'usa_states'"""
+    if os.path.exists(name):
+        return name
+    path = os.path.join(_databases, name + '.csv')
+    if not os.path.exists(path):
+        raise ValueError('no database {}; choose a csv path or one of {}'
+                         .format(name, sorted(f[:-4] for f in
+                         os.listdir(_databases) if f.endswith('.csv'))))
+    return path
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m chorogrid',
+        description='Render one map per value column (or group) of a data'
+                    ' csv.')
+    parser.add_argument('database', help="database name, e.g. 'usa_states',"
+                        " or the path of a database csv")
+    parser.add_argument('data', help='csv of ids and values')
+    parser.add_argument('--id-column', default='abbrev',
+                        help='id column of the database (default: abbrev)')
+    parser.add_argument('--data-id-column', default=None,
+                        help='id column of the data (default: the same name'
+                             ' as --id-column if present, else the first'
+                             ' column)')
+    parser.add_argument('--columns', default=None,
+                        help='comma-separated value columns (default: every'
+                             ' numeric column)')
+    parser.add_argument('--group-by', default=None,
+                        help='make a map per value of this column (and per'
+                             ' value column)')
+    parser.add_argument('--encoding', default='utf-8',
+                        help='encoding of the data csv')
+    parser.add_argument('--colors', default='#f1eef6,#bdc9e1,#74a9cf,#0570b0',
+                        help='comma-separated colors, one per bin')
+    parser.add_argument('--quantiles', action='store_true',
+                        help='bins with equal numbers of members, rather'
+                             ' than equal widths')
+    parser.add_argument('--decimals', type=int, default=None,
+                        help='round fenceposts to this many decimals')
+    parser.add_argument('--shared-fenceposts', action='store_true',
+                        help='the same fenceposts for every map')
+    parser.add_argument('--draw-method', default='draw_map',
+                        choices=['draw_map', 'draw_squares', 'draw_hex',
+                                 'draw_multihex', 'draw_multisquare'])
+    parser.add_argument('--draw-kwargs', default='{}',
+                        help='json of keyword arguments for the draw method,'
+                             ' e.g. \'{"spacing_dict": {"cell_width": 30}}\'')
+    parser.add_argument('--legend', action='store_true',
+                        help='add a legend of the bins')
+    parser.add_argument('--missing-color', default='#a0a0a0',
+                        help='color for ids whose value is blank')
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--compress', action='store_true',
+                        help='write .svgz files')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='number of worker processes (default: all'
+                             ' cores)')
+    parser.add_argument('--allow-mismatch', action='store_true',
+                        help="exit 0 even if the data's ids don't match the"
+                             " database's")
+    return parser.parse_args(argv)
+
+def _jobs(args, data, database):
+    """Yields one dict per map to make"""
+    id_column = args.data_id_column
+    if id_column is None:
+        id_column = (args.id_column if args.id_column in data.columns
+                     else data.columns[0])
+    if args.columns is not None:
+        columns = args.columns.split(',')
+    else:
+        columns = [c for c in data.select_dtypes('number').columns
+                   if c not in (id_column, args.group_by)]
+    if args.group_by is None:
+        groups = [(None, data)]
+    else:
+        groups = list(data.groupby(args.group_by, sort=False))
+    colors = args.colors.split(',')
+    fenceposts = {}
+    if args.shared_fenceposts:
+        for column in columns:
+            values = data[column].dropna().values
+            if len(values) == 0:
+                continue  # its maps fail, see _render_job
+            fenceposts[column] = list(Colormatrix(values[:, np.newaxis],
+                colors, not args.quantiles, args.decimals).fenceposts[0])
+    draw_kwargs = json.loads(args.draw_kwargs)
+    extension = '.svgz' if args.compress else '.svg'
+    for group, rows in groups:
+        for column in columns:
+            name = column if group is None else '{}_{}'.format(group, column)
+            filename = os.path.join(args.output_dir, re.sub(r'[^\w.-]+', '_',
+                                    name) + extension)
+            yield {'name': name, 'database': database,
+                   'id_column': args.id_column,
+                   'ids': list(rows[id_column]),
+                   'values': rows[column].values.astype(float),
+                   'colors': colors, 'proportional': not args.quantiles,
+                   'decimals': args.decimals,
+                   'fenceposts': fenceposts.get(column),
+                   'missing_color': args.missing_color,
+                   'draw_method': args.draw_method,
+                   'draw_kwargs': draw_kwargs, 'legend': args.legend,
+                   'title': name, 'filename': filename}
+
+def _render_job(job):
+    """Makes one map; runs in a worker process. Returns the job's name,
+       its filename, the seconds it took, the mismatched ids and why it
+       failed (None if it didn't)."""
+    start = time.perf_counter()
+    values = job['values']
+    blank = np.isnan(values)
+    if blank.all():
+        return (job['name'], job['filename'], time.perf_counter() - start,
+                set(), set(), 'no values to bin')
+    bins = Colormatrix(values[~blank, np.newaxis], job['colors'],
+                       job['proportional'], job['decimals'],
+                       fenceposts=job['fenceposts'])
+    colors = np.array([job['missing_color']] * len(values), dtype=object)
+    colors[~blank] = bins.colors_out(0)
+    cg = Chorogrid(job['database'], job['ids'], list(colors),
+                   job['id_column'], warn=False)
+    cg.set_title(job['title'])
+    if job['legend']:
+        cg.set_legend(job['colors'], bins.labels[0])
+    getattr(cg, job['draw_method'])(**job['draw_kwargs'])
+    cg.done(show=False, save_filename=job['filename'])
+    return (job['name'], job['filename'], time.perf_counter() - start,
+            cg.invalid_ids, cg.missing_ids, None)
+
+def main(argv=None):
+    args = _parse_args(argv)
+    try:
+        database = _database_path(args.database)
+    except ValueError as e:
+        print('ERROR: {}'.format(e), file=sys.stderr)
+        return 2
+    data = pd.read_csv(args.data, encoding=args.encoding)
+    os.makedirs(args.output_dir, exist_ok=True)
+    start = time.perf_counter()
+    invalid, missing = set(), set()
+    n_maps = 0
+    failed = []
+    with ProcessPoolExecutor(args.processes) as executor:
+        for name, filename, seconds, job_invalid, job_missing, error in \
+                executor.map(_render_job, _jobs(args, data, database)):
+            if error is not None:
+                print('ERROR: map {} not made: {}'.format(name, error),
+                      file=sys.stderr)
+                failed.append(name)
+                continue
+            print('{:8.3f}s  {}  {}'.format(seconds, name, filename))
+            invalid |= job_invalid
+            missing |= job_missing
+            n_maps += 1
+    print('{} maps in {:.3f}s'.format(n_maps, time.perf_counter() - start))
+    if len(failed) > 0:
+        print('ERROR: {} maps failed: {}'.format(len(failed), 
+              ', '.join(failed)), file=sys.stderr)
+    if len(invalid) > 0:
+        print('WARNING: The following are not recognized'
+              ' ids: {}'.format(invalid), file=sys.stderr)
+    if len(missing) > 0:
+        print('WARNING: The following ids in the csv are not '
+              'included: {}'.format(missing), file=sys.stderr)
+    if len(failed) > 0:
+        return 3
+    if (len(invalid) > 0 or len(missing) > 0) and not args.allow_mismatch:
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
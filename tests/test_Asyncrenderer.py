@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# Filename: test_Asyncrenderer.py
+
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import chorogrid
+from chorogrid.Asyncrenderer import Asyncrenderer, render_async
+
+COUNTIES = os.path.join(os.path.dirname(chorogrid.__file__), 'databases',
+                        'usa_counties.csv')
+STATES = os.path.join(os.path.dirname(chorogrid.__file__), 'databases',
+                      'usa_states.csv')
+
+# how long the event loop may go without running the ticker
+MAX_GAP = 0.2
+
+async def _render_while_ticking(ids, colors):
+    ticks = []
+    done = asyncio.Event()
+    async def ticker():
+        while not done.is_set():
+            ticks.append(time.perf_counter())
+            await asyncio.sleep(0.001)
+    task = asyncio.ensure_future(ticker())
+    # let the ticker start before the map does
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    data = await render_async(COUNTIES, ids, colors, id_column='fips',
+                              draw_kwargs={'spacing_dict': {
+                                  'stroke_width': 0.1}})
+    end = time.perf_counter()
+    done.set()
+    await task
+    return data, start, end, ticks
+
+def test_render_async_keeps_event_loop_responsive():
+    ids = list(pd.read_csv(COUNTIES, usecols=['fips'])['fips'])
+    colors = ['#fdae61', '#abd9e9', '#2c7bb6'] * (len(ids) // 3 + 1)
+    data, start, end, ticks = asyncio.run(
+        _render_while_ticking(ids, colors[:len(ids)]))
+    assert data.startswith(b"<svg") and len(data) > 100000
+    during = [t for t in ticks if start <= t <= end]
+    # the ticker kept running for the whole map, not just before and after
+    assert len(during) >= 2
+    gaps = [b - a for a, b in zip([start] + during, during + [end])]
+    assert max(gaps) < MAX_GAP, ("the event loop was blocked for {:.3f}s"
+                                 " of {:.3f}s".format(max(gaps), end - start))
+
+async def _render_many(renderer, n_maps, n_colors):
+    ids = list(pd.read_csv(STATES, usecols=['abbrev'])['abbrev'])
+    # every map is asked for several times at once
+    jobs = [renderer.render(STATES, ids, ['#{:06x}'.format(i % n_colors)] *
+                            len(ids)) for i in range(n_maps)]
+    return await asyncio.gather(*jobs)
+
+def _cached_renders(tmpdir, executor):
+    cache = chorogrid.Rendercache(str(tmpdir), max_bytes=50000)
+    renderer = Asyncrenderer(executor, max_concurrent=8, cache=cache)
+    results = asyncio.run(_render_many(renderer, 40, 10))
+    for i, data in enumerate(results):
+        assert data == results[i % 10]
+    assert cache.hits + cache.misses == 40
+    assert cache.misses >= 10
+    on_disk = sum(os.path.getsize(os.path.join(str(tmpdir), name))
+                  for name in os.listdir(str(tmpdir)))
+    assert on_disk == cache.total_bytes <= 50000
+    assert not [name for name in os.listdir(str(tmpdir)) 
+                if name.endswith('.tmp')]
+
+def test_concurrent_cached_renders_on_threads(tmpdir):
+    _cached_renders(tmpdir, None)
+
+def test_concurrent_cached_renders_on_processes(tmpdir):
+    with ProcessPoolExecutor(2) as executor:
+        _cached_renders(tmpdir, executor)
@@ -0,0 +1,36 @@
+#!/usr/bin/python
+# Filename: test_Colormatrix.py
+
+import numpy as np
+import pandas as pd
+from chorogrid import Colorbin, Colormatrix
+
+COLORS = ['#eeeeee', '#bbbbbb', '#888888', '#444444']
+
+def _table():
+    rng = np.random.RandomState(0)
+    return pd.DataFrame({'count': rng.randint(0, 40, 50),
+                         'rate': rng.uniform(0, 1, 50).round(3),
+                         'total': rng.randint(100, 900, 50)})
+
+def test_labels_match_colorbin_per_column():
+    df = _table()
+    for proportional in (False, True):
+        matrix = Colormatrix(df, COLORS, proportional=proportional)
+        for j, column in enumerate(df.columns):
+            cb = Colorbin(df[column], COLORS, proportional=proportional)
+            assert matrix.labels[j] == cb.labels
+            assert matrix.fencepostlabels[j] == cb.fencepostlabels
+            assert matrix.colors_out(column) == cb.colors_out
+
+def test_integer_column_labels_stay_integer():
+    df = _table()
+    matrix = Colormatrix(df, COLORS, proportional=False)
+    assert matrix.labels[0][0] == '0-9'
+    assert matrix.labels[0] == Colorbin(df['count'], COLORS,
+                                        proportional=False).labels
+    assert '.' in matrix.labels[1][0]
+
+def test_shared_mixed_table_labels_are_float():
+    matrix = Colormatrix(_table(), COLORS, proportional=False, shared=True)
+    assert all('.' in label for label in matrix.fencepostlabels[0])
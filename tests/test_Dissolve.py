@@ -0,0 +1,28 @@
+#!/usr/bin/python
+# Filename: test_Dissolve.py
+
+import os
+import chorogrid
+from chorogrid import Dissolve
+
+COUNTIES = os.path.join(os.path.dirname(chorogrid.__file__), 'databases',
+                        'usa_counties.csv')
+
+def _ring_counts(dissolve, parents):
+    return {p: len(dissolve.geometry.rings(dissolve.parent_ids.index(p)))
+            for p in parents}
+
+def test_states_dissolve_without_slivers():
+    # one outline each, as in usa_states.csv; Colorado was left with 8
+    # slivers where its counties' edges do not quite meet
+    counts = _ring_counts(Dissolve(COUNTIES), ['CO', 'KS', 'IA', 'NE', 'UT'])
+    assert counts == {'CO': 1, 'KS': 1, 'IA': 1, 'NE': 1, 'UT': 1}
+
+def test_islands_are_kept():
+    counts = _ring_counts(Dissolve(COUNTIES), ['HI', 'MI', 'AK'])
+    # usa_states.csv draws 7, 4 and 10 rings
+    assert counts['HI'] >= 7 and counts['MI'] == 4 and counts['AK'] >= 10
+
+def test_slivers_are_kept_without_threshold():
+    counts = _ring_counts(Dissolve(COUNTIES, min_ring_share=0), ['CO'])
+    assert counts['CO'] == 9
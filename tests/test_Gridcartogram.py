@@ -0,0 +1,27 @@
+#!/usr/bin/python
+# Filename: test_Gridcartogram.py
+
+import os
+import numpy as np
+import chorogrid
+from chorogrid import Gridcartogram
+
+STATES = os.path.join(os.path.dirname(chorogrid.__file__), 'databases',
+                      'usa_states.csv')
+
+def test_square_layout_keeps_state_neighbours():
+    layout = Gridcartogram(STATES, grid='square')
+    # the hand-made square layout shipped with usa_states keeps 55%
+    assert layout.adjacency_kept() >= 0.55
+    assert layout.adjacency_kept() > Gridcartogram(
+        STATES, grid='square', adjacency_weight=0).adjacency_kept()
+
+def test_hex_layout_keeps_state_neighbours():
+    # the shipped hex layout keeps 78%
+    assert Gridcartogram(STATES, grid='hex').adjacency_kept() >= 0.75
+
+def test_one_region_per_cell():
+    layout = Gridcartogram(STATES, grid='hex')
+    cells = set(zip(layout.x.tolist(), layout.y.tolist()))
+    assert len(cells) == len(layout.ids)
+    assert layout.x.min() == 0 and layout.y.min() in (0, 1)
@@ -0,0 +1,32 @@
+#!/usr/bin/python
+# Filename: test_Layerstack.py
+
+import os
+import re
+import xml.etree.ElementTree as ET
+import pandas as pd
+import chorogrid
+from chorogrid import Chorogrid, Layerstack
+
+STATES = os.path.join(os.path.dirname(chorogrid.__file__), 'databases',
+                      'usa_states.csv')
+
+def _zoomed(viewport):
+    ids = list(pd.read_csv(STATES).abbrev)
+    cg = Chorogrid(STATES, ids, ['#888888'] * len(ids), 'abbrev',
+                   warn=False)
+    cg.draw_map(viewport=viewport)
+    return cg
+
+def test_clipped_layers_have_their_own_clip_paths():
+    stack = Layerstack()
+    stack.add(_zoomed((0, 0, 400, 300)))
+    stack.add(_zoomed((300, 200, 700, 500)), opacity=0.5)
+    svg = stack.done(show=False, as_bytes=True).decode('utf-8')
+    ET.fromstring(svg)
+    clip_ids = re.findall(r'<clipPath id="([^"]+)"', svg)
+    assert len(clip_ids) == 2 and len(set(clip_ids)) == 2
+    used = re.findall(r'clip-path="url\(#([^)]+)\)"', svg)
+    assert sorted(used) == sorted(clip_ids)
+    rects = re.findall(r'<clipPath id="[^"]+">\s*<rect ([^/]*)/>', svg)
+    assert len(set(rects)) == 2
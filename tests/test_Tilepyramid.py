@@ -0,0 +1,52 @@
+#!/usr/bin/python
+# Filename: test_Tilepyramid.py
+
+import glob
+import os
+import re
+import pandas as pd
+import chorogrid
+from chorogrid import Chorogrid, Tilepyramid
+
+STATES = os.path.join(os.path.dirname(chorogrid.__file__), 'databases',
+                      'usa_states.csv')
+
+def _map(**kwargs):
+    ids = list(pd.read_csv(STATES).abbrev)
+    cg = Chorogrid(STATES, ids, ['#888888'] * len(ids), 'abbrev',
+                   warn=False)
+    cg.draw_map(**kwargs)
+    return cg
+
+def _tile_ids(directory):
+    ids = set()
+    for filename in glob.glob(os.path.join(directory, '*', '*', '*.svg')):
+        with open(filename, encoding='utf-8') as f:
+            ids.update(re.findall(r'<path id="([^"]+)"', f.read()))
+    return ids
+
+def test_subset_is_tiled_alone(tmpdir):
+    pyramid = Tilepyramid(_map(subset=['CO', 'UT', 'WY']), max_zoom=2)
+    pyramid.export(str(tmpdir), processes=1)
+    assert _tile_ids(str(tmpdir)) == {'CO', 'UT', 'WY'}
+    # the pyramid covers the three states, not the whole country
+    xmin, ymin, xmax, ymax = pyramid.view
+    assert pyramid.extent == max(xmax - xmin, ymax - ymin)
+
+def test_viewport_is_tiled_and_clipped(tmpdir):
+    viewport = (100, 100, 400, 250)
+    cg = _map(viewport=viewport)
+    pyramid = Tilepyramid(cg, max_zoom=1)
+    counts = pyramid.export(str(tmpdir), processes=1)
+    drawn = set(cg.df['abbrev'].values[cg.drawn['rows']])
+    assert _tile_ids(str(tmpdir)) == drawn
+    # the view is twice as wide as high: the zoom 0 tile is clipped at the
+    # bottom of the view, and at zoom 1 only the top row of tiles, which
+    # the view fills, has anything in it
+    assert counts['written'] == 1 + 2
+    def tile(name):
+        with open(os.path.join(str(tmpdir), name), encoding='utf-8') as f:
+            return f.read()
+    assert 'clip-path="url(#view)"' in tile('0/0/0.svg')
+    assert 'clip-path' not in tile('1/0/0.svg')
+    assert not os.path.exists(os.path.join(str(tmpdir), '1', '0', '1.svg'))